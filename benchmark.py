@@ -0,0 +1,841 @@
+import io
+import os
+import gzip
+import re
+import sys
+import json
+import logging
+import time
+import random
+import functools
+import tempfile
+import hashlib
+import argparse
+import itertools
+import platform
+import subprocess
+import threading
+import statistics
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+DEFAULT_REPORT_PATH = "bench_report.json"
+ID_SEGMENT = re.compile(r"/[0-9a-f]{8,}|/\d+")
+HEAVY_MODULES = ["numpy", "pandas", "openai", "httpx", "pypdf"]
+GZIP_MIN_BYTES = 1024
+PASSAGE_WORDS = (
+    "supplier buyer invoice e-invoice validation IRBM MyInvois TIN SST tax amount currency "
+    "consolidated self-billed credit debit note refund issuance submission portal API "
+    "timestamp identifier classification code description quantity unit price discount "
+    "exemption threshold transaction period taxpayer registration number address"
+).split()
+PAGE_FLOW = ["user_setup", "chatbot_setup", "knowledge_setup", "document_upload", "chat"]
+
+class MockRagServer:
+    """
+    Local stand-in for the RAG server with configurable latency and failure
+    injection. Implements the endpoints the app uses, including upload sessions
+    and streamed /query responses, and counts every request it receives.
+    """
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, fail_status: int = 502,
+                 stream: bool = True, batch_endpoint: bool = True, paginate_history: bool = True, seed: int = 0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = "0"
+        self.stream = stream
+        self.batch_endpoint = batch_endpoint
+        self.paginate_history = paginate_history
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.users = [{"user_id": 1, "user_name": "bench"}]
+        self.chatbots = {1: [{"chatbot_id": 1, "chatbot_name": "e-invoice", "chatbot_desc": "IRBM e-invoice guidelines"}]}
+        self.knowledge = {1: [
+            {"knowledge_id": 1, "knowledge_name": "e-invoice", "knowledge_desc": "IRBM e-invoice guidelines"},
+            {"knowledge_id": 2, "knowledge_name": "aml-cft", "knowledge_desc": "AML/CFT policy documents"}
+        ]}
+        self.documents: Dict[int, List[Dict[str, Any]]] = {1: [], 2: []}
+        self.upload_sessions: Dict[str, Dict[str, Any]] = {}
+        self.history: List[Dict[str, Any]] = []
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+        self.chunk_contents: Dict[str, str] = {}
+        self.bytes_sent = 0
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self) -> "MockRagServer":
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+    def total_requests(self) -> int:
+        with self.lock:
+            return sum(self.requests.values())
+
+    def _count(self, method: str, path: str):
+        key = f"{method} {ID_SEGMENT.sub('/{id}', path)}"
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def _add_document(self, knowledge_id: int, filename: str, size: int) -> Dict[str, Any]:
+        document = {
+            "document_id": next(self.ids) + 1000,
+            "filename": filename,
+            "upload_date": datetime.now().isoformat(),
+            "size": size
+        }
+        with self.lock:
+            self.documents.setdefault(knowledge_id, []).append(document)
+        return document
+
+    def _delete_documents(self, document_ids: List[int]) -> set:
+        with self.lock:
+            found = set()
+            for knowledge_id, documents in self.documents.items():
+                found.update(d["document_id"] for d in documents if d["document_id"] in document_ids)
+                self.documents[knowledge_id] = [d for d in documents if d["document_id"] not in document_ids]
+        return found
+
+    def _answer(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        query = body.get("query", "")
+        query_id = next(self.ids)
+        words = random.Random(query_id)
+        chunks = [
+            {
+                "chunk_id": f"chunk-{query_id}-{i}",
+                "timestamp": datetime.now().isoformat(),
+                "source": "irbm-e-invoice-specific-guideline.pdf",
+                "content": f"Passage {i} relevant to: {query}. " + " ".join(words.choices(PASSAGE_WORDS, k=80)),
+                "score": 1.0 - i / 10,
+                "keywords": body.get("keywords") or []
+            }
+            for i in range(int(body.get("k", 5)))
+        ]
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "answer": f"Mock answer for '{query}' from knowledge base {body.get('knowledge_id')}",
+            "chunks": chunks
+        }
+        with self.lock:
+            self.history.append({"query": query, **result})
+            self.chunk_contents.update((chunk["chunk_id"], chunk["content"]) for chunk in chunks)
+        if body.get("chunk_fields"):
+            fields = set(body["chunk_fields"]) | {"chunk_id"}
+            result = {**result, "chunks": [{k: v for k, v in chunk.items() if k in fields} for chunk in chunks]}
+        return result
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle on, delayed ACKs
+            # add ~40 ms to every request on a reused connection
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding") == "chunked":
+                    data = b""
+                    while True:
+                        size = int(self.rfile.readline().strip(), 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return data
+                        data += self.rfile.read(size)
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def send_json(self, payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None):
+                content_type = "application/json"
+                if "msgpack" in self.headers.get("Accept", ""):
+                    import msgpack
+                    content_type = "application/msgpack"
+                    data = msgpack.packb(payload, use_bin_type=True)
+                else:
+                    data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if "gzip" in self.headers.get("Accept-Encoding", "") and len(data) > GZIP_MIN_BYTES:
+                    data = gzip.compress(data, compresslevel=5)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with server.lock:
+                    server.bytes_sent += len(data)
+
+            def send_events(self, events: List[Dict[str, Any]]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in events:
+                    data = f"data: {json.dumps(event)}\n\n".encode("utf-8")
+                    with server.lock:
+                        server.bytes_sent += len(data)
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+                    if event["type"] == "token" and server.latency:
+                        time.sleep(server.latency / 20)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def handle_request(self, method: str):
+                raw = self.read_body()
+                path, _, query_string = self.path.partition("?")
+                server._count(method, path)
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.fail_rate and server.random.random() < server.fail_rate:
+                    return self.send_json({"detail": "Injected failure"}, server.fail_status, {"Retry-After": server.retry_after})
+                try:
+                    body = json.loads(raw) if raw[:1] in (b"{", b"[") else {}
+                except ValueError:
+                    body = {}
+                self.route(method, path, query_string, body, raw)
+
+            def route(self, method: str, path: str, query_string: str, body: Dict[str, Any], raw: bytes):
+                if path == "/":
+                    return self.send_json({"status": "ok"})
+                if path == "/users/list":
+                    return self.send_json(server.users)
+                if path == "/users/create":
+                    user = {"user_id": next(server.ids) + 100, "user_name": body.get("user_name")}
+                    server.users.append(user)
+                    return self.send_json(user)
+                match = re.fullmatch(r"/chatbots/list/(\d+)", path)
+                if match:
+                    return self.send_json(server.chatbots.get(int(match[1]), []))
+                match = re.fullmatch(r"/knowledge/list/(\d+)", path)
+                if match:
+                    return self.send_json(server.knowledge.get(int(match[1]), []))
+                match = re.fullmatch(r"/documents/list/(\d+)", path)
+                if match:
+                    return self.send_json(server.documents.get(int(match[1]), []))
+                match = re.fullmatch(r"/documents/upload/(\d+)", path)
+                if match:
+                    filename = re.search(rb'filename="([^"]*)"', raw)
+                    name = filename[1].decode("utf-8") if filename else "upload.bin"
+                    return self.send_json(server._add_document(int(match[1]), name, len(raw)))
+                match = re.fullmatch(r"/documents/upload-session/(\d+)", path)
+                if match and method == "POST":
+                    upload_id = hashlib.sha1(f"{path}{next(server.ids)}".encode()).hexdigest()
+                    server.upload_sessions[upload_id] = {"knowledge_id": int(match[1]), "received": 0, **body}
+                    return self.send_json({"upload_id": upload_id, "received": 0})
+                match = re.fullmatch(r"/documents/upload-session/([0-9a-f]+)(/complete)?", path)
+                if match and match[1] in server.upload_sessions:
+                    session = server.upload_sessions[match[1]]
+                    if match[2]:
+                        del server.upload_sessions[match[1]]
+                        return self.send_json(server._add_document(session["knowledge_id"], session["filename"], session["received"]))
+                    if method == "PUT":
+                        session["received"] += len(raw)
+                    return self.send_json({"upload_id": match[1], "received": session["received"]})
+                match = re.fullmatch(r"/documents/delete/(\d+)", path)
+                if match:
+                    server._delete_documents([int(match[1])])
+                    return self.send_json({"status": "deleted"})
+                match = re.fullmatch(r"/documents/reindex/(\d+)", path)
+                if match:
+                    return self.send_json({"status": "reindexed"})
+                if path == "/documents/batch" and server.batch_endpoint:
+                    document_ids = body.get("document_ids", [])
+                    found = server._delete_documents(document_ids) if body.get("action") == "delete" else set(document_ids)
+                    return self.send_json({"results": [
+                        {"document_id": document_id, "status": "ok" if document_id in found else "error",
+                         "detail": None if document_id in found else "Document not found"}
+                        for document_id in document_ids
+                    ]})
+                if path == "/clear-history":
+                    server.history.clear()
+                    return self.send_json({"status": "cleared"})
+                if path == "/history":
+                    if not server.paginate_history:
+                        return self.send_json(server.history)
+                    params = dict(part.split("=", 1) for part in query_string.split("&") if "=" in part)
+                    offset = int(params.get("cursor", 0))
+                    limit = int(params.get("limit", len(server.history) or 1))
+                    items = server.history[offset:offset + limit]
+                    next_cursor = str(offset + limit) if offset + limit < len(server.history) else None
+                    return self.send_json({"items": items, "next_cursor": next_cursor})
+                if path == "/chunks":
+                    chunk_ids = [chunk_id for chunk_id in body.get("chunk_ids", []) if chunk_id in server.chunk_contents]
+                    return self.send_json({"chunks": [
+                        {"chunk_id": chunk_id, "content": server.chunk_contents[chunk_id]} for chunk_id in chunk_ids
+                    ]})
+                if path == "/query":
+                    profile = body.get("parameter_profile")
+                    if profile:
+                        server.profiles[profile["profile_id"]] = profile["parameters"]
+                    elif "profile_id" in body and body["profile_id"] not in server.profiles:
+                        return self.send_json({"detail": "Unknown parameter profile"}, 409)
+                    profile_id = profile["profile_id"] if profile else body.get("profile_id")
+                    result = server._answer({**server.profiles.get(profile_id, {}), **body})
+                    if body.get("stream") and server.stream:
+                        events = [{"type": "chunks", "chunks": result["chunks"]}]
+                        events += [{"type": "token", "content": f"{word} "} for word in result["answer"].split()]
+                        events.append({"type": "done", "timestamp": result["timestamp"]})
+                        return self.send_events(events)
+                    return self.send_json(result)
+                return self.send_json({"detail": "Not Found"}, 404)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def do_PUT(self):
+                self.handle_request("PUT")
+
+            def do_DELETE(self):
+                self.handle_request("DELETE")
+
+        return Handler
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    def pct(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 2)
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 2),
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2)
+    }
+
+def load_app():
+    """Import main.py in bare mode for direct calls into the client layer"""
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    import main
+    return main
+
+def bench_page_flows(server: MockRagServer, iterations: int) -> Dict[str, Any]:
+    """Render each wizard page with Streamlit's AppTest and time full script runs"""
+    from streamlit.testing.v1 import AppTest
+    results = {}
+    for step in PAGE_FLOW:
+        samples = []
+        requests_before = server.total_requests()
+        for _ in range(iterations):
+            app = AppTest.from_file(APP_PATH, default_timeout=60)
+            app.secrets["mykey"] = ""
+            for key, value in {"server_url": server.url, "step": step, "user_id": 1, "chatbot_id": 1, "knowledge_id": 1}.items():
+                app.session_state[key] = value
+            start = time.perf_counter()
+            app.run()
+            samples.append(time.perf_counter() - start)
+            if app.exception:
+                raise RuntimeError(f"{step} raised: {app.exception[0].value}")
+        results[step] = {**summarize(samples), "server_requests": server.total_requests() - requests_before}
+    return results
+
+COLD_IMPORT_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+import streamlit
+streamlit_seconds = time.perf_counter() - start
+import main
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"import_s": time.perf_counter() - start, "streamlit_s": streamlit_seconds, "loaded": loaded}}))
+"""
+
+COLD_RENDER_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app_path!r}, default_timeout=60)
+app.session_state["server_url"] = {server_url!r}
+app.run()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"first_render_s": time.perf_counter() - start, "loaded": loaded, "exception": bool(app.exception)}}))
+"""
+
+def run_python(script: str) -> Dict[str, Any]:
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=tempfile.gettempdir()).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def bench_cold_start(server: MockRagServer, iterations: int) -> Dict[str, Any]:
+    """Time importing main.py and the first page render in fresh interpreter processes"""
+    imports = [
+        run_python(COLD_IMPORT_SCRIPT.format(app_dir=os.path.dirname(APP_PATH), heavy=HEAVY_MODULES))
+        for _ in range(iterations)
+    ]
+    renders = [
+        run_python(COLD_RENDER_SCRIPT.format(app_path=APP_PATH, server_url=server.url, heavy=HEAVY_MODULES))
+        for _ in range(iterations)
+    ]
+    return {
+        "import": summarize([run["import_s"] for run in imports]),
+        "streamlit_import": summarize([run["streamlit_s"] for run in imports]),
+        "modules_loaded_by_import": imports[-1]["loaded"],
+        "first_render": summarize([run["first_render_s"] for run in renders]),
+        "modules_loaded_by_first_render": renders[-1]["loaded"],
+        "render_errors": sum(run["exception"] for run in renders)
+    }
+
+class PageRenderCounter(logging.Handler):
+    """Count page renders from the app's "Displaying ..." log lines"""
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        if record.getMessage().startswith("Displaying "):
+            self.count += 1
+
+def bench_navigation(server: MockRagServer) -> Dict[str, Any]:
+    """Click through the wizard with AppTest and count page renders per user action"""
+    from streamlit.testing.v1 import AppTest
+    counter = PageRenderCounter()
+    logging.getLogger("chatbot_app").addHandler(counter)
+    app = AppTest.from_file(APP_PATH, default_timeout=60)
+    app.secrets["mykey"] = ""
+
+    def click(label: str):
+        next(button for button in app.button if button.label == label).click()
+
+    actions: List[Tuple[str, Callable[[], Any]]] = [
+        ("open", lambda: None),
+        ("connect", lambda: (app.text_input[0].input(server.url), click("Connect to Server"))),
+        ("pick user", lambda: app.selectbox[0].select_index(1)),
+        ("use user", lambda: click("Use Selected User")),
+        ("previous", lambda: click("◀ Previous")),
+        ("next", lambda: click("Next ▶")),
+        ("pick chatbot", lambda: app.selectbox[0].select_index(1)),
+        ("use chatbot", lambda: click("Use Selected Chatbot")),
+        ("pick knowledge base", lambda: app.selectbox[0].select_index(1)),
+        ("use knowledge base", lambda: click("Use Selected Knowledge Base")),
+        ("proceed to chat", lambda: click("Proceed to Chat"))
+    ]
+    steps = []
+    try:
+        for name, action in actions:
+            action()
+            renders = counter.count
+            start = time.perf_counter()
+            app.run()
+            steps.append({
+                "action": name,
+                "step": app.session_state.step,
+                "page_renders": counter.count - renders,
+                "seconds": round(time.perf_counter() - start, 3)
+            })
+            if app.exception:
+                raise RuntimeError(f"{name} raised: {app.exception[0].value}")
+    finally:
+        logging.getLogger("chatbot_app").removeHandler(counter)
+    return {
+        "actions": len(steps),
+        "page_renders": sum(step["page_renders"] for step in steps),
+        "page_renders_per_action": round(sum(step["page_renders"] for step in steps) / len(steps), 2),
+        "steps": steps
+    }
+
+def bench_prefetch(latency: float, think_time: float) -> Dict[str, Any]:
+    """
+    Walk the wizard with AppTest, pausing after each selection as a user would, and
+    time the step transitions the prefetcher should have warmed
+    """
+    from streamlit.testing.v1 import AppTest
+    server = MockRagServer(latency=latency).start()
+    app = AppTest.from_file(APP_PATH, default_timeout=60)
+    app.secrets["mykey"] = ""
+
+    def click(label: str):
+        next(button for button in app.button if button.label == label).click()
+
+    actions: List[Tuple[str, Callable[[], Any], float]] = [
+        ("connect", lambda: (app.text_input[0].input(server.url), click("Connect to Server")), 0.0),
+        ("pick user", lambda: app.selectbox[0].select_index(1), think_time),
+        ("use user", lambda: click("Use Selected User"), 0.0),
+        ("pick chatbot", lambda: app.selectbox[0].select_index(1), think_time),
+        ("use chatbot", lambda: click("Use Selected Chatbot"), 0.0),
+        ("pick knowledge base", lambda: app.selectbox[0].select_index(1), think_time),
+        ("use knowledge base", lambda: click("Use Selected Knowledge Base"), think_time),
+        ("proceed to chat", lambda: click("Proceed to Chat"), 0.0)
+    ]
+    steps = []
+    try:
+        app.run()
+        for name, action, pause in actions:
+            action()
+            start = time.perf_counter()
+            app.run()
+            steps.append({"action": name, "step": app.session_state.step, "seconds": round(time.perf_counter() - start, 3)})
+            if app.exception:
+                raise RuntimeError(f"{name} raised: {app.exception[0].value}")
+            time.sleep(pause)
+        app.sidebar.toggle[0].set_value(True).run()
+        prefetch = next(caption.value for caption in app.sidebar.caption if caption.value.startswith("Prefetch"))
+    finally:
+        server.stop()
+    transitions = [step["seconds"] for step in steps if step["action"].startswith("use")]
+    return {
+        "server_latency_ms": round(latency * 1000, 2),
+        "think_time_ms": round(think_time * 1000, 2),
+        "transitions": summarize(transitions),
+        "prefetch": prefetch,
+        "steps": steps
+    }
+
+def bench_uploads(app: Any, server: MockRagServer, files: int, size_kb: int, workers: int) -> Dict[str, Any]:
+    """Upload generated documents through the app's upload pipeline"""
+    payloads = [os.urandom(size_kb * 1024) for _ in range(files)]
+    sessions = app.TTLCache(maxsize=1024, ttl=3600)
+    manifest = app.UploadManifest(path=os.path.join(tempfile.mkdtemp(), "manifest.json"))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        reports = list(pool.map(
+            lambda item: app.upload_document(
+                server.url, 1, io.BytesIO(item[1]), f"bench-{item[0]}.pdf", sessions, manifest,
+                hashlib.sha256(item[1]).hexdigest()
+            ),
+            enumerate(payloads)
+        ))
+    elapsed = time.perf_counter() - start
+    uploaded = sum(1 for report in reports if report["status"] == "uploaded")
+    return {
+        "files": files,
+        "uploaded": uploaded,
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "files_per_s": round(files / elapsed, 2),
+        "mb_per_s": round(files * size_kb / 1024 / elapsed, 2),
+        "per_file": summarize([report["seconds"] for report in reports])
+    }
+
+def bench_queries(app: Any, server: MockRagServer, sessions: int, queries: int) -> Dict[str, Any]:
+    """Simulate concurrent chat sessions issuing /query requests"""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def session(session_id: int):
+        nonlocal errors
+        for i in range(queries):
+            start = time.perf_counter()
+            try:
+                app.make_api_request('POST', "/query", server_url=server.url, json={
+                    "query": f"session {session_id} question {i} about TIN formats",
+                    "chatbot_id": 1,
+                    "knowledge_id": 1,
+                    "keywords": ["TIN"]
+                })
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(session, range(sessions)))
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "queries": sessions * queries,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "queries_per_s": round(sessions * queries / elapsed, 2),
+        "latency": summarize(latencies)
+    }
+
+def bench_federated(app: Any, server: MockRagServer, queries: int) -> Dict[str, Any]:
+    """Compare federated queries over every knowledge base with querying them one by one"""
+    knowledge_names = {kb["knowledge_id"]: kb["knowledge_name"] for kb in server.knowledge[1]}
+    profile = {
+        "profile_id": "benchmark",
+        "version": 1,
+        "parameters": {"temperature": 0.5, "k": 10, "chunk_overlap": 30, "rerank_method": "similarity"}
+    }
+    payload = {"query": "What must a self-billed e-invoice contain?", "chatbot_id": 1, "keywords": None}
+    sequential, federated = [], []
+    for _ in range(queries):
+        start = time.perf_counter()
+        for knowledge_id in knowledge_names:
+            app.make_api_request('POST', "/query", server_url=server.url, json={**payload, "knowledge_id": knowledge_id})
+        sequential.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        app.federated_query(payload, list(knowledge_names), profile, server.url, knowledge_names)
+        federated.append(time.perf_counter() - start)
+    return {
+        "knowledge_bases": len(knowledge_names),
+        "sequential": summarize(sequential),
+        "federated": summarize(federated)
+    }
+
+def bench_list_fetch(app: Any, server: MockRagServer, renders: int) -> Dict[str, Any]:
+    """
+    Time the concurrent list reads of one chat page render, opening a new
+    AsyncClient and event loop per render as before against the shared client
+    """
+    import asyncio
+    import httpx
+    endpoints = ["/chatbots/list/1", "/knowledge/list/1"]
+
+    async def per_render_client() -> List[Any]:
+        async with httpx.AsyncClient(base_url=server.url) as client:
+            return await asyncio.gather(*(app.async_make_api_request(client, 'GET', endpoint) for endpoint in endpoints))
+
+    per_render, shared = [], []
+    client = app.get_async_api_client(server.url)
+    for _ in range(renders):
+        start = time.perf_counter()
+        asyncio.run(per_render_client())
+        per_render.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.gather_json(endpoints)
+        shared.append(time.perf_counter() - start)
+    return {
+        "endpoints": len(endpoints),
+        "per_render_client": summarize(per_render),
+        "shared_client": summarize(shared)
+    }
+
+def bench_compact_queries(app: Any, server: MockRagServer, queries: int, k: int) -> Dict[str, Any]:
+    """Compare full /query responses with projected chunk fields, as JSON and as msgpack"""
+    modes = [
+        ("full_json", None, "application/json"),
+        ("projected_json", app.QUERY_CHUNK_FIELDS, "application/json"),
+        ("projected_msgpack", app.QUERY_CHUNK_FIELDS, app.query_accept_header())
+    ]
+    results = {}
+    for mode, fields, accept in modes:
+        server.reset_counts()
+        samples = []
+        chunk_ids = []
+        for i in range(queries):
+            payload = {"query": f"question {i} about TIN formats", "chatbot_id": 1, "knowledge_id": 1, "k": k, "keywords": ["TIN"]}
+            if fields:
+                payload["chunk_fields"] = fields
+            start = time.perf_counter()
+            response = app.make_api_request('POST', "/query", server_url=server.url, json=payload, headers={"Accept": accept})
+            result = app.decode_response(response)
+            samples.append(time.perf_counter() - start)
+            chunk_ids = [chunk["chunk_id"] for chunk in result["chunks"]]
+        query_bytes = server.bytes_sent
+        start = time.perf_counter()
+        app.make_api_request('POST', "/chunks", server_url=server.url, json={"chunk_ids": chunk_ids}, headers={"Accept": accept})
+        results[mode] = {
+            "queries": queries,
+            "k": k,
+            "bytes_per_query": round(query_bytes / queries),
+            "latency": summarize(samples),
+            "expand_bytes": server.bytes_sent - query_bytes,
+            "expand_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+    return results
+
+def bench_bulk_documents(app: Any, latency: float, documents: int) -> Dict[str, Any]:
+    """Delete documents through /documents/batch and through the per-document fallback"""
+    results = {}
+    for mode, batch_endpoint in (("batch", True), ("fan_out", False)):
+        server = MockRagServer(latency=latency, batch_endpoint=batch_endpoint).start()
+        try:
+            document_ids = [server._add_document(1, f"bulk-{i}.pdf", 1024)["document_id"] for i in range(documents)]
+            start = time.perf_counter()
+            outcome = app.batch_document_action(server.url, 1, "delete", document_ids)
+            results[mode] = {
+                "documents": documents,
+                "deleted": sum(1 for error in outcome.values() if error is None),
+                "seconds": round(time.perf_counter() - start, 3),
+                "server_requests": server.total_requests()
+            }
+        finally:
+            server.stop()
+    return results
+
+def bench_retries(app: Any, server: MockRagServer, fail_rate: float, requests_count: int) -> Dict[str, Any]:
+    """Measure how the retry policy behaves against injected failures"""
+    app.get_retry_policy.clear()
+    previous = server.fail_rate
+    server.fail_rate = fail_rate
+    server.reset_counts()
+    outcomes: Dict[str, int] = {}
+    samples = []
+    try:
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            try:
+                app.make_api_request('GET', "/users/list", server_url=server.url)
+                outcome = "ok"
+            except Exception as e:
+                outcome = type(e).__name__
+            samples.append(time.perf_counter() - start)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    finally:
+        server.fail_rate = previous
+        app.get_retry_policy.clear()
+    attempts = server.total_requests()
+    return {
+        "fail_rate": fail_rate,
+        "requests": requests_count,
+        "outcomes": outcomes,
+        "server_attempts": attempts,
+        "attempts_per_request": round(attempts / requests_count, 3),
+        "latency": summarize(samples)
+    }
+
+def bench_reindex(app: Any, corpus_dir: str, overlaps: List[int]) -> Dict[str, Any]:
+    """Index a local corpus at several chunk overlaps; only the first run should embed anything"""
+    embedded = []
+
+    @functools.wraps(app.local_retrieval.hashing_embedding)
+    def counting_embedding(texts: List[str]) -> Any:
+        embedded.append(len(texts))
+        return app.local_retrieval.hashing_embedding(texts)
+
+    if not app.local_retrieval.LocalRetriever(corpus_dir).corpus_files():
+        raise RuntimeError(f"No documents to index in {corpus_dir}; add some or pass --corpus-dir")
+    index_dir = tempfile.mkdtemp()
+    runs = []
+    for overlap in overlaps:
+        embedded.clear()
+        start = time.perf_counter()
+        retriever = app.local_retrieval.LocalRetriever(corpus_dir, chunk_overlap=overlap, embed_fn=counting_embedding, index_dir=index_dir)
+        retriever.load_or_build()
+        runs.append({
+            "chunk_overlap": overlap,
+            "chunks": len(retriever.chunks),
+            "embedded": sum(embedded),
+            "seconds": round(time.perf_counter() - start, 3)
+        })
+    return {"corpus_dir": corpus_dir, "runs": runs}
+
+def bench_bm25(app: Any, chunks: int, queries: int, seed: int) -> Dict[str, Any]:
+    """
+    Time building the BM25 index over a synthetic corpus of chunks and scoring
+    queries against it, alone and fused with vector similarity as in hybrid search
+    """
+    np = app.np
+    retrieval = app.local_retrieval
+    rng = random.Random(seed)
+    vocabulary = PASSAGE_WORDS + [f"term{i}" for i in range(5000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    texts = [" ".join(rng.choices(vocabulary, weights, k=retrieval.LOCAL_CHUNK_SIZE)) for _ in range(chunks)]
+    start = time.perf_counter()
+    index = retrieval.InvertedIndex(texts)
+    build_seconds = time.perf_counter() - start
+    vectors = np.random.default_rng(seed).standard_normal((chunks, retrieval.HASH_EMBEDDING_DIM), dtype=np.float32)
+    
+    bm25_samples, hybrid_samples = [], []
+    for _ in range(queries):
+        query = " ".join(rng.choices(vocabulary, weights, k=6))
+        start = time.perf_counter()
+        bm25 = index.scores(query)
+        retrieval.top_indices(bm25, 10)
+        bm25_samples.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        similarity = vectors @ retrieval.hashing_embedding([query])[0]
+        bm25 = index.scores(query)
+        candidates = [retrieval.top_indices(similarity, retrieval.HYBRID_CANDIDATES),
+                      retrieval.top_indices(bm25, min(retrieval.HYBRID_CANDIDATES, int(np.count_nonzero(bm25))))]
+        retrieval.top_indices(retrieval.reciprocal_rank_fusion(candidates, chunks), 10)
+        hybrid_samples.append(time.perf_counter() - start)
+    return {
+        "chunks": chunks,
+        "terms": len(index.vocab),
+        "postings": int(len(index.doc_ids)),
+        "build_seconds": round(build_seconds, 3),
+        "bm25_query": summarize(bm25_samples),
+        "hybrid_query": summarize(hybrid_samples)
+    }
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    server = MockRagServer(latency=args.latency, fail_rate=0.0, seed=args.seed).start()
+    try:
+        app = load_app()
+        report: Dict[str, Any] = {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "config": vars(args),
+            "results": {}
+        }
+        steps: Dict[str, Callable[[], Any]] = {
+            "cold_start": lambda: bench_cold_start(server, args.iterations),
+            "page_flows": lambda: bench_page_flows(server, args.iterations),
+            "navigation": lambda: bench_navigation(server),
+            "prefetch": lambda: bench_prefetch(args.prefetch_latency, args.think_time),
+            "uploads": lambda: bench_uploads(app, server, args.upload_files, args.upload_kb, args.upload_workers),
+            "queries": lambda: bench_queries(app, server, args.sessions, args.queries),
+            "federated": lambda: bench_federated(app, server, args.queries),
+            "list_fetch": lambda: bench_list_fetch(app, server, args.renders),
+            "compact_queries": lambda: bench_compact_queries(app, server, args.queries, args.chunks_per_query),
+            "bulk_documents": lambda: bench_bulk_documents(app, args.latency, args.bulk_documents),
+            "retries": lambda: bench_retries(app, server, args.fail_rate, args.retry_requests),
+            "reindex": lambda: bench_reindex(
+                app, args.corpus_dir or os.path.join(os.path.dirname(APP_PATH), app.LOCAL_CORPUS_DIR), args.overlaps
+            ),
+            "bm25": lambda: bench_bm25(app, args.bm25_chunks, args.bm25_queries, args.seed)
+        }
+        for name in args.only or steps:
+            print(f"Running {name} benchmark...", file=sys.stderr)
+            report["results"][name] = steps[name]()
+        return report
+    finally:
+        server.stop()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks against a local mock RAG server")
+    parser.add_argument("--output", default=DEFAULT_REPORT_PATH, help="Where to write the JSON report")
+    parser.add_argument("--latency", type=float, default=0.02, help="Injected server latency per request in seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="Failure rate for the retry benchmark")
+    parser.add_argument("--iterations", type=int, default=3, help="Script runs per page")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent simulated chat sessions")
+    parser.add_argument("--queries", type=int, default=10, help="Queries per session")
+    parser.add_argument("--renders", type=int, default=30, help="Page renders in the list fetch benchmark")
+    parser.add_argument("--prefetch-latency", type=float, default=0.25, help="Server latency for the prefetch benchmark in seconds")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Pause after each selection in the prefetch benchmark")
+    parser.add_argument("--upload-files", type=int, default=8)
+    parser.add_argument("--upload-kb", type=int, default=512, help="Size of each uploaded file in KB")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--chunks-per-query", type=int, default=50, help="Chunks requested per query in the compact response benchmark")
+    parser.add_argument("--bulk-documents", type=int, default=200, help="Documents deleted in the bulk benchmark")
+    parser.add_argument("--retry-requests", type=int, default=30)
+    parser.add_argument("--corpus-dir", help="Local corpus for the re-indexing benchmark (default: the app's LOCAL_CORPUS_DIR)")
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[30, 0, 30, 50], help="Chunk overlaps to index in turn")
+    parser.add_argument("--bm25-chunks", type=int, default=20000, help="Synthetic chunks in the BM25 benchmark")
+    parser.add_argument("--bm25-queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", choices=["cold_start", "page_flows", "navigation", "prefetch", "uploads", "queries", "federated", "list_fetch", "compact_queries", "bulk_documents", "retries", "reindex", "bm25"])
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,529 @@
+from __future__ import annotations
+
+import os
+import re
+import sys
+import json
+import zlib
+import time
+import hashlib
+import logging
+import functools
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple, List, Callable, Iterator
+
+import numpy as np
+
+logger = logging.getLogger('chatbot_app')
+
+# Offline embeddings: a deterministic hashed bag-of-words embedding, the default for
+# local retrieval and the fallback for the semantic cache without an OpenAI key
+HASH_EMBEDDING_DIM = 512
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+def hashing_embedding(texts: List[str], dim: int = HASH_EMBEDDING_DIM) -> np.ndarray:
+    """
+    Embed texts as L2-normalised signed hashes of their words and word bigrams.
+    Deterministic across processes, so it is safe for persisted caches and tests.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vectors[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+# Local retrieval engine: answers queries in-process from a directory of documents
+LOCAL_INDEX_DIR = ".local_index"
+LOCAL_CHUNK_SIZE = 200
+LOCAL_CORPUS_EXTENSIONS = (".txt", ".md", ".csv", ".pdf")
+
+def chunk_words(words: List[str], chunk_size: int, overlap: int) -> Iterator[List[str]]:
+    """Split a word list into windows of chunk_size words sharing overlap words"""
+    step = max(chunk_size - overlap, 1)
+    for start in range(0, max(len(words) - overlap, 1), step):
+        window = words[start:start + chunk_size]
+        if window:
+            yield window
+
+# Incremental ingestion: documents are read page by page, split into non-overlapping
+# segments and checkpointed per page so re-runs only re-chunk pages whose text changed
+INGEST_CHECKPOINT_DIR = os.path.join(LOCAL_INDEX_DIR, "checkpoints")
+INGEST_BATCH_SIZE = 64
+TEXT_LINES_PER_PAGE = 200
+
+def iter_pdf_pages(path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) for a PDF one page at a time"""
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
+
+def iter_text_pages(path: str, lines_per_page: int = TEXT_LINES_PER_PAGE) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) for a text file in pages of lines_per_page lines"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        number = 0
+        while True:
+            lines = [line for _, line in zip(range(lines_per_page), f)]
+            if not lines:
+                return
+            number += 1
+            yield number, "".join(lines)
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+class DocumentIngestor:
+    """
+    Stream a document as batches of chunks. Pages are extracted one at a time and
+    split into segments of chunk_size words that do not overlap, so a segment only
+    depends on its own page; LocalRetriever adds overlap from the neighbouring
+    segment when it returns results. Each page's chunks are checkpointed to their
+    own file under checkpoint_dir together with a hash of the page text, written
+    once when the page changes, so an interrupted or repeated run reuses unchanged
+    pages and an unchanged file is replayed from disk page by page without being
+    parsed at all. Only the current page and batch are held in memory. After
+    batches() is exhausted, stats holds throughput and peak RSS for the file.
+    """
+    def __init__(self, path: str, chunk_size: int = LOCAL_CHUNK_SIZE,
+                 batch_size: int = INGEST_BATCH_SIZE, checkpoint_dir: str = INGEST_CHECKPOINT_DIR):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        key = json.dumps([os.path.abspath(path), chunk_size])
+        self.checkpoint_dir = os.path.join(checkpoint_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+        self.state_path = os.path.join(self.checkpoint_dir, "state.json")
+        self.stats: Dict[str, Any] = {}
+
+    def iter_pages(self) -> Iterator[Tuple[int, str]]:
+        if self.path.lower().endswith(".pdf"):
+            return iter_pdf_pages(self.path)
+        return iter_text_pages(self.path)
+
+    def _read_json(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path: str, data: Dict[str, Any]):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _page_path(self, number: int) -> str:
+        return os.path.join(self.checkpoint_dir, f"page-{number}.json")
+
+    def _page_chunks(self, text: str) -> List[str]:
+        return [" ".join(window) for window in chunk_words(text.split(), self.chunk_size, 0)]
+
+    def _replay(self, pages: int) -> Iterator[Tuple[int, List[str], bool]]:
+        for number in range(1, pages + 1):
+            yield number, self._read_json(self._page_path(number))["chunks"], False
+
+    def _process(self) -> Iterator[Tuple[int, List[str], bool]]:
+        last = 0
+        for number, text in self.iter_pages():
+            page_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            entry = self._read_json(self._page_path(number))
+            changed = entry is None or entry["hash"] != page_hash
+            if changed:
+                entry = {"hash": page_hash, "chunks": self._page_chunks(text)}
+                self._write_json(self._page_path(number), entry)
+            last = number
+            yield number, entry["chunks"], changed
+        # Drop pages that no longer exist, e.g. after the document got shorter
+        for name in os.listdir(self.checkpoint_dir) if os.path.isdir(self.checkpoint_dir) else []:
+            match = re.fullmatch(r"page-(\d+)\.json", name)
+            if match and int(match.group(1)) > last:
+                os.remove(os.path.join(self.checkpoint_dir, name))
+
+    def batches(self) -> Iterator[List[Dict[str, Any]]]:
+        """Yield lists of up to batch_size chunk dicts, checkpointing each page as it is chunked"""
+        start = time.perf_counter()
+        source = os.path.basename(self.path)
+        file_state = [os.path.getsize(self.path), os.path.getmtime(self.path)]
+        state = self._read_json(self.state_path) or {}
+        unchanged_file = (
+            state.get("file_state") == file_state and state.get("completed")
+            and all(os.path.exists(self._page_path(number)) for number in range(1, state["pages"] + 1))
+        )
+        if not unchanged_file:
+            self._write_json(self.state_path, {"file_state": file_state, "completed": False})
+        
+        pages = pages_changed = chunks = 0
+        batch: List[Dict[str, Any]] = []
+        try:
+            page_source = self._replay(state["pages"]) if unchanged_file else self._process()
+            for number, page_chunks, changed in page_source:
+                pages += 1
+                pages_changed += changed
+                for i, content in enumerate(page_chunks):
+                    batch.append({
+                        "chunk_id": f"{source}#p{number}-{i}",
+                        "source": source,
+                        "page": number,
+                        "content": content,
+                        "changed": changed
+                    })
+                if len(batch) >= self.batch_size:
+                    chunks += len(batch)
+                    yield batch
+                    batch = []
+            if batch:
+                chunks += len(batch)
+                yield batch
+        except ImportError:
+            logger.warning(f"pypdf is not installed, skipping {self.path}")
+            return
+        
+        if not unchanged_file:
+            self._write_json(self.state_path, {"file_state": file_state, "completed": True, "pages": pages})
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        self.stats = {
+            "file": source,
+            "pages": pages,
+            "pages_changed": pages_changed,
+            "chunks": chunks,
+            "seconds": round(elapsed, 3),
+            "pages_per_s": round(pages / elapsed, 1),
+            "chunks_per_s": round(chunks / elapsed, 1),
+            "peak_rss_mb": peak_rss_mb()
+        }
+        logger.info(
+            f"Ingested {source}: {pages} pages ({pages_changed} changed), {chunks} chunks in {elapsed:.2f}s "
+            f"({self.stats['pages_per_s']} pages/s, {self.stats['chunks_per_s']} chunks/s, "
+            f"peak RSS {self.stats['peak_rss_mb']} MB)"
+        )
+
+# Hybrid retrieval: BM25 over an inverted index fused with vector similarity
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+HYBRID_CANDIDATES = 100
+
+class InvertedIndex:
+    """
+    Compact BM25 index. Postings are stored CSR-style in flat NumPy arrays: for
+    term t, doc_ids[offsets[t]:offsets[t + 1]] are the documents containing it and
+    weights[...] their precomputed BM25 contributions (IDF times saturated term
+    frequency), so scoring a query is one vectorised add per query term.
+    """
+    def __init__(self, texts: List[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+        
+        self.num_docs = len(texts)
+        term_array = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_array, kind="stable")
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        tf_array = np.asarray(tfs, dtype=np.float32)[order]
+        df = np.bincount(term_array, minlength=len(self.vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        self.idf = np.log1p((self.num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        norm = k1 * (1 - b + b * doc_lengths[self.doc_ids] / (avg_length or 1.0))
+        self.weights = (np.repeat(self.idf, df) * tf_array * (k1 + 1) / (tf_array + norm)).astype(np.float32)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for a query"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            postings = slice(self.offsets[term_id], self.offsets[term_id + 1])
+            scores[self.doc_ids[postings]] += self.weights[postings]
+        return scores
+
+def top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], size: int, k: int = RRF_K) -> np.ndarray:
+    """Fuse ranked index lists into one score per item: sum of 1 / (k + rank)"""
+    fused = np.zeros(size, dtype=np.float32)
+    for ranking in rankings:
+        fused[ranking] += 1.0 / (k + np.arange(1, len(ranking) + 1, dtype=np.float32))
+    return fused
+
+def hybrid_rerank(chunks: List[Dict[str, Any]], query: str, keywords: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Rerank chunks returned by the server by fusing their similarity order with
+    BM25 over their content, for servers without a hybrid rerank method
+    """
+    if len(chunks) < 2 or not all(chunk.get("content") for chunk in chunks):
+        return chunks
+    index = InvertedIndex([chunk["content"] for chunk in chunks])
+    bm25 = index.scores(" ".join([query] + (keywords or [])))
+    vector_order = np.argsort([-chunk["score"] for chunk in chunks], kind="stable")
+    fused = reciprocal_rank_fusion([vector_order, top_indices(bm25, int(np.count_nonzero(bm25)))], len(chunks))
+    return [{**chunks[i], "score": float(fused[i])} for i in top_indices(fused, len(chunks))]
+
+def embedding_model_name(embed_fn: Callable[[List[str]], np.ndarray]) -> str:
+    """Name the model behind an embedding function, used to key cached vectors"""
+    return getattr(embed_fn, "model_name", None) or getattr(embed_fn, "__name__", repr(embed_fn))
+
+class EmbeddingCache:
+    """
+    Content-addressed store of chunk embeddings for one model. Vectors are appended
+    to a raw float32 matrix that is read back through np.memmap, and a JSON index
+    maps hash(chunk text, model) to its row, so re-chunking a corpus only embeds
+    chunk texts that have not been seen before.
+    """
+    def __init__(self, cache_dir: str, model: str):
+        self.model = model
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        self.vectors_path = os.path.join(cache_dir, f"{slug}.f32")
+        self.index_path = os.path.join(cache_dir, f"{slug}.idx.json")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dim = 0
+        self.index: Dict[str, int] = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.dim = data["dim"]
+            self.index = data["offsets"]
+        except (OSError, ValueError, KeyError):
+            pass
+        # Rows appended after the last saved index stay unreferenced; a partly written
+        # row from an interrupted append is cut off so new rows stay aligned
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        self.rows = size // (4 * self.dim) if self.dim else 0
+        if size != self.rows * 4 * self.dim:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self.rows * 4 * self.dim)
+        self.index = {key: row for key, row in self.index.items() if row < self.rows}
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for texts, calling embed_fn only for texts missing from the cache"""
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self.index and key not in missing:
+                    missing[key] = text
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            if missing:
+                vectors = np.asarray(embed_fn(list(missing.values())), dtype=np.float32)
+                if self.dim and vectors.shape[1] != self.dim:
+                    logger.warning(f"Embedding size for {self.model} changed, discarding cached vectors")
+                    self.index = {}
+                    self.rows = 0
+                    os.remove(self.vectors_path)
+                self.dim = vectors.shape[1]
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                for key in missing:
+                    self.index[key] = self.rows
+                    self.rows += 1
+            if not texts:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+            return np.asarray(matrix[[self.index[key] for key in keys]])
+
+    def save(self):
+        """Persist the offset index atomically"""
+        with self._lock:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model, "dim": self.dim, "offsets": self.index}, f)
+            os.replace(tmp_path, self.index_path)
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_cache(cache_dir: str, model: str) -> EmbeddingCache:
+    """Return the process-wide embedding cache for a directory and model"""
+    return EmbeddingCache(cache_dir, model)
+
+class LocalRetriever:
+    """
+    In-process retrieval over a local corpus. Documents are split into segments of
+    chunk_size words that do not overlap; their embeddings are kept in a
+    memory-mapped NumPy matrix under index_dir, and search returns chunks shaped
+    like the server's /query response. chunk_overlap is applied to results by
+    prefixing each segment with the tail of the one before it, so changing it needs
+    neither a rebuild nor new embeddings. Each corpus has a single index that is
+    replaced when the corpus changes, and segment embeddings are reused across
+    rebuilds through an EmbeddingCache. embed_fn is pluggable; hashing_embedding
+    keeps it offline.
+    """
+    def __init__(self, corpus_dir: str, chunk_overlap: int = 30,
+                 embed_fn: Callable[[List[str]], np.ndarray] = hashing_embedding,
+                 index_dir: str = LOCAL_INDEX_DIR, chunk_size: int = LOCAL_CHUNK_SIZE):
+        self.corpus_dir = corpus_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = min(chunk_overlap, chunk_size - 1)
+        self.embed_fn = embed_fn
+        self.index_dir = index_dir
+        self.chunks: List[Dict[str, Any]] = []
+        self.ingest_reports: List[Dict[str, Any]] = []
+        self.vectors: Optional[np.ndarray] = None
+        self._bm25: Optional[InvertedIndex] = None
+
+    def corpus_files(self) -> List[str]:
+        paths = []
+        for root, dirnames, filenames in os.walk(self.corpus_dir):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            if os.path.abspath(root).startswith(os.path.abspath(self.index_dir)):
+                continue
+            paths.extend(
+                os.path.join(root, name) for name in sorted(filenames)
+                if name.lower().endswith(LOCAL_CORPUS_EXTENSIONS)
+            )
+        return sorted(paths)
+
+    def signature(self, paths: List[str]) -> str:
+        """Identify the corpus state, segment size and embedding model an index was built from"""
+        state = [(path, os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+        key = [state, self.chunk_size, embedding_model_name(self.embed_fn)]
+        return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def load_or_build(self) -> "LocalRetriever":
+        """Reuse the on-disk index when the corpus is unchanged, otherwise rebuild it in place"""
+        paths = self.corpus_files()
+        signature = self.signature(paths)
+        name = hashlib.sha1(os.path.abspath(self.corpus_dir).encode("utf-8")).hexdigest()
+        meta_path = os.path.join(self.index_dir, f"{name}.json")
+        vectors_path = os.path.join(self.index_dir, f"{name}.f32")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        if meta.get("signature") == signature and os.path.exists(vectors_path):
+            self._open(meta, vectors_path)
+            logger.info(f"Loaded local index with {len(self.chunks)} chunks")
+            return self
+        
+        start = time.perf_counter()
+        os.makedirs(self.index_dir, exist_ok=True)
+        cache = get_embedding_cache(os.path.join(self.index_dir, "embeddings"), embedding_model_name(self.embed_fn))
+        hits, misses = cache.hits, cache.misses
+        self.chunks = []
+        self.ingest_reports = []
+        dim = 0
+        with open(f"{vectors_path}.tmp", "wb") as vectors_file:
+            for path in paths:
+                ingestor = DocumentIngestor(path, self.chunk_size,
+                                            checkpoint_dir=os.path.join(self.index_dir, "checkpoints"))
+                for batch in ingestor.batches():
+                    embeddings = cache.embed([chunk["content"] for chunk in batch], self.embed_fn)
+                    dim = embeddings.shape[1]
+                    vectors_file.write(embeddings.tobytes())
+                    self.chunks.extend(
+                        {key: chunk[key] for key in ("chunk_id", "source", "page", "content")} for chunk in batch
+                    )
+                if ingestor.stats:
+                    self.ingest_reports.append(ingestor.stats)
+        cache.save()
+        logger.info(f"Embedded {cache.misses - misses} new chunks, reused {cache.hits - hits} cached embeddings")
+        meta = {"signature": signature, "dim": dim, "chunks": self.chunks, "ingest_reports": self.ingest_reports}
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        # Retrievers still reading the previous index keep their memory map of the
+        # replaced file; a crash between the two renames leaves a stale signature
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self._open(meta, vectors_path)
+        logger.info(f"Built local index: {len(self.chunks)} chunks from {len(paths)} files in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def _open(self, meta: Dict[str, Any], vectors_path: str):
+        self._bm25 = None
+        self.chunks = meta["chunks"]
+        self.ingest_reports = meta.get("ingest_reports", [])
+        self.vectors = None
+        if self.chunks:
+            self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(len(self.chunks), meta["dim"]))
+
+    def bm25_index(self) -> InvertedIndex:
+        """Build the BM25 inverted index over the chunks on first use"""
+        if self._bm25 is None:
+            start = time.perf_counter()
+            self._bm25 = InvertedIndex([chunk["content"] for chunk in self.chunks])
+            logger.info(f"Built BM25 index over {len(self.chunks)} chunks in {time.perf_counter() - start:.2f}s")
+        return self._bm25
+
+    def chunk(self, i: int, chunk_overlap: Optional[int] = None) -> Dict[str, Any]:
+        """Segment i prefixed with the last chunk_overlap words of the previous segment of its file"""
+        overlap = self.chunk_overlap if chunk_overlap is None else min(chunk_overlap, self.chunk_size - 1)
+        chunk = self.chunks[i]
+        if overlap and i > 0 and self.chunks[i - 1]["source"] == chunk["source"]:
+            context = self.chunks[i - 1]["content"].split()[-overlap:]
+            return {**chunk, "content": " ".join(context + [chunk["content"]])}
+        return dict(chunk)
+
+    def search(self, query: str, k: int = 10, keywords: Optional[List[str]] = None,
+               rerank_method: str = "similarity", chunk_overlap: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the top-k chunks for a query in the server's /query chunk shape"""
+        if self.vectors is None or not self.chunks:
+            return []
+        query_vector = self.embed_fn([query])[0]
+        scores = np.asarray(self.vectors @ query_vector, dtype=np.float32)
+        keyword_set = {kw.lower() for kw in keywords or [] if kw}
+        
+        if rerank_method == "hybrid":
+            bm25 = self.bm25_index().scores(" ".join([query] + sorted(keyword_set)))
+            candidates = [top_indices(scores, HYBRID_CANDIDATES),
+                          top_indices(bm25, min(HYBRID_CANDIDATES, int(np.count_nonzero(bm25))))]
+            scores = reciprocal_rank_fusion(candidates, len(self.chunks))
+            order = top_indices(scores, k)
+        elif rerank_method == "keyword" and keyword_set:
+            hits = np.array([
+                sum(kw in chunk["content"].lower() for kw in keyword_set) for chunk in self.chunks
+            ], dtype=np.float32)
+            order = np.lexsort((-scores, -hits))[:k]
+        else:
+            order = top_indices(scores, k)
+        
+        timestamp = datetime.now().isoformat()
+        results = []
+        for i in order:
+            chunk = self.chunk(i, chunk_overlap)
+            results.append({
+                **chunk,
+                "score": float(scores[i]),
+                "keywords": [kw for kw in keyword_set if kw in chunk["content"].lower()],
+                "timestamp": timestamp
+            })
+        return results
@@ -1,23 +1,122 @@
+from __future__ import annotations
+
 import streamlit as st
 import requests
-import openai
 import time
+import io
 import json
+import math
 import logging
+import queue
+import atexit
+import base64
+import os
+import re
+import random
+import asyncio
+import functools
+import sys
+import hashlib
+import threading
+import uuid
+import argparse
+import importlib
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
-from typing import Optional, Dict, Any
-from requests.exceptions import RequestException
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Tuple, List, Callable, Collection, Iterator, BinaryIO
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectTimeout, HTTPError, RequestException
+from urllib3.exceptions import NewConnectionError
+from streamlit.errors import StreamlitAPIException
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access. Streamlit
+    re-executes this script on every rerun, and most pages never touch the heavy
+    numeric and API client modules. The proxy stays out of sys.modules, so
+    introspection (inspect.getmodule, st.cache_resource) does not trigger the import.
+    """
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        module = importlib.import_module(self._name)
+        # Later lookups hit the instance dict and skip __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+np = LazyModule("numpy")
+local_retrieval = LazyModule("local_retrieval")
+
+# Logging: handlers run on a QueueListener thread so log calls never block on
+# disk I/O; the file is size-rotated and written as JSON lines
+LOG_PATH = "chatbot_app.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_RATE_LIMIT_INTERVAL = 60.0
+NOISY_LOG_PREFIXES = ("Displaying ",)
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let each noisy per-rerun message (matched by prefix) through at most once per
+    interval; the next one that passes carries the number of suppressed repeats
+    """
+    def __init__(self, prefixes: Tuple[str, ...] = NOISY_LOG_PREFIXES, interval: float = LOG_RATE_LIMIT_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self.prefixes = prefixes
+        self.interval = interval
+        self.clock = clock
+        self._last_emitted: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if not message.startswith(self.prefixes):
+            return True
+        now = self.clock()
+        with self._lock:
+            last = self._last_emitted.get(message)
+            if last is not None and now - last < self.interval:
+                self._suppressed[message] = self._suppressed.get(message, 0) + 1
+                return False
+            self._last_emitted[message] = now
+            record.suppressed = self._suppressed.pop(message, 0)
+        return True
 
-# Configure logging with both file and stream handlers
 def setup_logging():
+    """
+    Install the logging pipeline once per process. Streamlit re-executes this
+    module on every rerun, so the listener is remembered on the logger itself.
+    """
     logger = logging.getLogger('chatbot_app')
+    if getattr(logger, "queue_listener", None) is not None:
+        return logger
     logger.setLevel(logging.INFO)
     
     # File handler
-    file_handler = logging.FileHandler('chatbot_app.log')
+    file_handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                       encoding="utf-8", delay=True)
     file_handler.setLevel(logging.INFO)
-    file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_format)
+    file_handler.setFormatter(JsonFormatter())
     
     # Stream handler for console output
     stream_handler = logging.StreamHandler()
@@ -25,24 +124,52 @@ def setup_logging():
     stream_format = logging.Formatter('%(levelname)s: %(message)s')
     stream_handler.setFormatter(stream_format)
     
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    # Log calls only enqueue; the listener thread does the formatting and I/O
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    logger.addHandler(queue_handler)
+    logger.queue_listener = listener
     
     return logger
 
 logger = setup_logging()
 
-# OpenAI API Key
-openai.api_key = st.secrets["mykey"]
+@st.cache_resource
+def get_secrets() -> Dict[str, Any]:
+    """Read the app secrets once per process; without a secrets file the app runs offline"""
+    try:
+        return dict(st.secrets)
+    except FileNotFoundError:
+        logger.warning("No secrets file found, OpenAI features are disabled")
+        return {}
 
-# Page configuration
-st.set_page_config(
-    page_title="Chatbot Interface",
-    page_icon="🤖",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+def openai_api_key() -> str:
+    return get_secrets().get("mykey") or ""
+
+@st.cache_resource
+def get_openai():
+    """Import and configure the OpenAI client on first use"""
+    import openai
+    openai.api_key = openai_api_key()
+    return openai
+
+# Flash messages survive the st.rerun() that follows a successful action
+def flash_success(message: str):
+    """Queue a success message to show after the next rerun instead of sleeping before it"""
+    st.session_state.setdefault("flash_messages", []).append(("success", message))
+
+def flash_warning(message: str):
+    """Queue a warning to show after the next rerun"""
+    st.session_state.setdefault("flash_messages", []).append(("warning", message))
+
+def show_flash_messages():
+    for level, message in st.session_state.pop("flash_messages", []):
+        getattr(st, level)(message)
 
 # Initialize session state variables
 def init_session_state():
@@ -60,38 +187,1290 @@ def init_session_state():
         st.session_state.chat_history = []
     if "documents" not in st.session_state:
         st.session_state.documents = []
+    if "uploader_key" not in st.session_state:
+        st.session_state.uploader_key = 0
+    if "upload_report" not in st.session_state:
+        st.session_state.upload_report = None
+    if "show_history" not in st.session_state:
+        st.session_state.show_history = False
+    if "history_cursors" not in st.session_state:
+        st.session_state.history_cursors = [None]
+    if "history_page" not in st.session_state:
+        st.session_state.history_page = None
+    if "parameter_profile" not in st.session_state:
+        st.session_state.parameter_profile = None
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = new_conversation()
+    if "last_query" not in st.session_state:
+        st.session_state.last_query = None
+    if "last_result" not in st.session_state:
+        st.session_state.last_result = None
+    if "chunk_contents" not in st.session_state:
+        st.session_state.chunk_contents = TTLCache(maxsize=CHUNK_CONTENT_CACHE_SIZE, ttl=CHUNK_CONTENT_TTL)
+    if "prefetch_group" not in st.session_state:
+        st.session_state.prefetch_group = uuid.uuid4().hex
+
+# HTTP client defaults: connection pool size and (connect, read) timeouts in seconds
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (3.05, 60)
+
+class ApiClient:
+    """
+    Keep-alive HTTP client for a single server backed by a pooled requests.Session
+    """
+    def __init__(self, base_url: str, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def request(self, method: str, endpoint: str, timeout: Optional[Any] = None, **kwargs) -> requests.Response:
+        """Send a request through the pooled session, applying the default timeout"""
+        url = f"{self.base_url}{endpoint}"
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Report connection reuse across all pools of the adapter. Every request that
+        did not need a new connection was served from a kept-alive one.
+        """
+        pools = self.adapter.poolmanager.pools
+        requests_sent = 0
+        connections_opened = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "connections_reused": max(requests_sent - connections_opened, 0),
+        }
+
+    def close(self):
+        self.session.close()
+
+@st.cache_resource
+def get_api_client(server_url: str, pool_size: int = DEFAULT_POOL_SIZE) -> ApiClient:
+    """Return the process-wide pooled client for a server URL"""
+    logger.info(f"Creating pooled HTTP client for {server_url} (pool size {pool_size})")
+    return ApiClient(server_url, pool_size=pool_size)
+
+# Request and render metrics, exported in Prometheus text format
+METRICS_PATH = "metrics.prom"
+METRICS_EXPORT_INTERVAL = 10.0
+METRICS_RESERVOIR_SIZE = 1024
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """
+    Cumulative bucket counts for Prometheus plus a bounded reservoir of recent
+    observations for p50/p95/p99
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: "deque[float]" = deque(maxlen=METRICS_RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q: float) -> float:
+        """Linearly interpolated quantile of the reservoir, without loading numpy"""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        position = q * (len(values) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+class Metrics:
+    """
+    Process-wide metrics: per-endpoint request latency, retries and payload sizes,
+    and render durations per page and per script rerun
+    """
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str], Histogram] = {}
+        self.statuses: Dict[Tuple[str, str, str], int] = {}
+        self.retries: Dict[Tuple[str, str], int] = {}
+        self.request_bytes: Dict[Tuple[str, str], int] = {}
+        self.response_bytes: Dict[Tuple[str, str], int] = {}
+        self.renders: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, method: str, endpoint: str, status: str, seconds: float,
+                        request_bytes: int = 0, response_bytes: int = 0):
+        key = (method, RetryPolicy.endpoint_key(endpoint))
+        with self._lock:
+            self.requests.setdefault(key, Histogram()).observe(seconds)
+            self.statuses[key + (status,)] = self.statuses.get(key + (status,), 0) + 1
+            self.request_bytes[key] = self.request_bytes.get(key, 0) + request_bytes
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + response_bytes
+
+    def record_retry(self, method: str, endpoint: str):
+        key = (method, RetryPolicy.endpoint_key(endpoint))
+        with self._lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def observe_render(self, name: str, seconds: float):
+        with self._lock:
+            self.renders.setdefault(name, Histogram()).observe(seconds)
+
+    def request_rows(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "endpoint": f"{method} {endpoint}",
+                    "count": hist.count,
+                    "p50_ms": round(hist.quantile(0.5) * 1000, 1),
+                    "p95_ms": round(hist.quantile(0.95) * 1000, 1),
+                    "p99_ms": round(hist.quantile(0.99) * 1000, 1),
+                    "retries": self.retries.get((method, endpoint), 0),
+                    "sent_kb": round(self.request_bytes.get((method, endpoint), 0) / 1024, 1),
+                    "received_kb": round(self.response_bytes.get((method, endpoint), 0) / 1024, 1)
+                }
+                for (method, endpoint), hist in sorted(self.requests.items())
+            ]
+
+    def render_rows(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "render": name,
+                    "count": hist.count,
+                    "p50_ms": round(hist.quantile(0.5) * 1000, 1),
+                    "p95_ms": round(hist.quantile(0.95) * 1000, 1),
+                    "p99_ms": round(hist.quantile(0.99) * 1000, 1)
+                }
+                for name, hist in sorted(self.renders.items())
+            ]
+
+    def render_prometheus(self) -> str:
+        """Serialise all metrics in the Prometheus text exposition format"""
+        def labels(**values: str) -> str:
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in values.items()) + "}"
+        
+        def histogram_lines(name: str, hist: Histogram, **label_values: str) -> List[str]:
+            lines = [
+                f"{name}_bucket{labels(**label_values, le=str(bound))} {count}"
+                for bound, count in zip(hist.buckets, hist.counts)
+            ]
+            lines.append(f"{name}_bucket{labels(**label_values, le='+Inf')} {hist.count}")
+            lines.append(f"{name}_sum{labels(**label_values)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{labels(**label_values)} {hist.count}")
+            return lines
+        
+        with self._lock:
+            lines = ["# HELP ragapi_client_request_duration_seconds Latency of API requests per attempt",
+                     "# TYPE ragapi_client_request_duration_seconds histogram"]
+            for (method, endpoint), hist in sorted(self.requests.items()):
+                lines += histogram_lines("ragapi_client_request_duration_seconds", hist, method=method, endpoint=endpoint)
+            lines += ["# HELP ragapi_client_request_latency_quantile_seconds Recent API request latency quantiles",
+                      "# TYPE ragapi_client_request_latency_quantile_seconds gauge"]
+            for (method, endpoint), hist in sorted(self.requests.items()):
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(f"ragapi_client_request_latency_quantile_seconds"
+                                 f"{labels(method=method, endpoint=endpoint, quantile=str(q))} {hist.quantile(q):.6f}")
+            lines += ["# HELP ragapi_client_requests_total API request attempts by status",
+                      "# TYPE ragapi_client_requests_total counter"]
+            for (method, endpoint, status), count in sorted(self.statuses.items()):
+                lines.append(f"ragapi_client_requests_total{labels(method=method, endpoint=endpoint, status=status)} {count}")
+            lines += ["# HELP ragapi_client_retries_total API request retries",
+                      "# TYPE ragapi_client_retries_total counter"]
+            for (method, endpoint), count in sorted(self.retries.items()):
+                lines.append(f"ragapi_client_retries_total{labels(method=method, endpoint=endpoint)} {count}")
+            for metric, values in (("request", self.request_bytes), ("response", self.response_bytes)):
+                lines += [f"# HELP ragapi_client_{metric}_bytes_total API {metric} payload bytes",
+                          f"# TYPE ragapi_client_{metric}_bytes_total counter"]
+                for (method, endpoint), total in sorted(values.items()):
+                    lines.append(f"ragapi_client_{metric}_bytes_total{labels(method=method, endpoint=endpoint)} {total}")
+            lines += ["# HELP ragapi_client_render_duration_seconds Duration of page renders and script reruns",
+                      "# TYPE ragapi_client_render_duration_seconds histogram"]
+            for name, hist in sorted(self.renders.items()):
+                lines += histogram_lines("ragapi_client_render_duration_seconds", hist, render=name)
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str = METRICS_PATH):
+        """Write the Prometheus text file atomically"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
 
-def make_api_request(method: str, endpoint: str, max_retries: int = 3, **kwargs) -> Optional[requests.Response]:
+class MetricsExporter:
     """
-    Make API request with automatic retries and logging
+    Daemon thread writing the metrics file every METRICS_EXPORT_INTERVAL seconds and
+    once more at exit, so script reruns never wait on serialising or writing it
     """
-    url = f"{st.session_state.server_url}{endpoint}"
+    def __init__(self, metrics: Metrics, path: str = METRICS_PATH, interval: float = METRICS_EXPORT_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            self.metrics.export(self.path)
+        except OSError as e:
+            logger.error(f"Failed to export metrics to {self.path}: {str(e)}")
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.export()
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    """Return the process-wide metrics registry"""
+    return Metrics()
+
+@st.cache_resource
+def get_metrics_exporter() -> MetricsExporter:
+    """Start the process-wide background export of the metrics file"""
+    return MetricsExporter(get_metrics())
+
+def payload_size(body: Any) -> int:
+    """Best-effort size of a request body without consuming it"""
+    if body is None:
+        return 0
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+def response_size(response: Any, streamed: bool = False) -> int:
+    """Response size from Content-Length, or the body when it is already loaded"""
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return int(length)
+    return 0 if streamed else len(response.content)
+
+def timed_render(name: str):
+    """Decorator recording how long a page render takes, including renders ended by st.rerun()"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                get_metrics().observe_render(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# Retry policy: jittered exponential backoff, Retry-After, per-endpoint retry
+# budgets, idempotency rules and a per-server circuit breaker. Retries wait on the
+# calling thread, usually the script thread, so no single wait may exceed
+# RETRY_MAX_DELAY; a longer Retry-After is reported to the caller instead
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 2.0
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX_TOKENS = 10.0
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+IDEMPOTENT_POST_ENDPOINTS = {"/clear-history", "/chunks"}
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+class CircuitOpenError(RequestException):
+    """Raised without contacting the server while its circuit breaker is open"""
+
+class RetryLaterError(HTTPError):
+    """Raised instead of blocking when the server asks for a longer wait than RETRY_MAX_DELAY"""
+    def __init__(self, retry_after: float, response: Any):
+        super().__init__(f"{response.status_code} from server, retry in {math.ceil(retry_after)}s", response=response)
+        self.retry_after = retry_after
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of traffic: every request deposits
+    ratio tokens and every retry spends one, so a failing endpoint cannot multiply
+    its load by max_retries
+    """
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, max_tokens: float = RETRY_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failures; while open every
+    request fails fast. After reset_timeout one trial request is let through
+    (half-open) and its outcome closes or re-opens the circuit. If the trial's
+    outcome is never recorded, another trial is let through after reset_timeout.
+    """
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state in ("open", "half_open") and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.opened_at = self.clock()
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = self.clock()
+
+class RetryPolicy:
+    """
+    Decides whether and when to retry a request. Idempotent requests are retried
+    on retryable status codes and transport errors; non-idempotent ones (POST
+    /users/create, /query, uploads) only when the server cannot have processed
+    them: the connection was never established, or it answered 429/503. Delays use
+    full jitter capped at max_delay and honour Retry-After up to max_delay. clock,
+    sleep and rng are injectable so the policy can be driven deterministically with
+    a fake clock.
+    """
+    def __init__(self, base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 rng: Callable[[], float] = random.random):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_key(endpoint: str) -> str:
+        """Collapse IDs in a path so /documents/list/1 and /documents/list/2 share a budget"""
+        return re.sub(r"/(\d+|[0-9a-fA-F-]{16,})(?=/|$)", "/{id}", endpoint.split("?")[0])
+
+    def budget(self, endpoint: str) -> RetryBudget:
+        key = self.endpoint_key(endpoint)
+        with self._lock:
+            return self._budgets.setdefault(key, RetryBudget())
+
+    def breaker(self, server_url: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(server_url, CircuitBreaker(clock=self.clock))
+
+    def is_idempotent(self, method: str, endpoint: str) -> bool:
+        method = method.upper()
+        return method in IDEMPOTENT_METHODS or (method == "POST" and self.endpoint_key(endpoint) in IDEMPOTENT_POST_ENDPOINTS)
+
+    def before_request(self, server_url: str, endpoint: str):
+        """Fail fast while the server's circuit is open and fund the endpoint's retry budget"""
+        if not self.breaker(server_url).allow_request():
+            raise CircuitOpenError(f"Circuit open for {server_url}, not sending request to {endpoint}")
+        self.budget(endpoint).record_request()
+
+    def record_outcome(self, server_url: str, ok: bool):
+        if ok:
+            self.breaker(server_url).record_success()
+        else:
+            self.breaker(server_url).record_failure()
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential delay, or the server's Retry-After when it gives one"""
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return max(delay, 0.0)
+        return self.rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    def retry_delay(self, method: str, endpoint: str, attempt: int, max_attempts: int,
+                    status_code: Optional[int] = None, retry_after: Optional[str] = None,
+                    connection_failed: bool = False) -> Optional[float]:
+        """
+        Return how long to wait before the next attempt, or None to give up.
+        Pass status_code for an HTTP response, or connection_failed for a transport
+        error that happened before the request reached the server. A Retry-After
+        above max_delay is returned without spending the retry budget; callers
+        raise RetryLaterError for it rather than wait.
+        """
+        if attempt + 1 >= max_attempts:
+            return None
+        if status_code is not None:
+            if status_code not in RETRYABLE_STATUS_CODES:
+                return None
+            if not self.is_idempotent(method, endpoint) and status_code not in (429, 503):
+                return None
+        elif not connection_failed and not self.is_idempotent(method, endpoint):
+            return None
+        delay = self.backoff(attempt, retry_after)
+        if delay > self.max_delay:
+            return delay
+        if not self.budget(endpoint).try_spend():
+            logger.warning(f"Retry budget exhausted for {self.endpoint_key(endpoint)}")
+            return None
+        return delay
+
+@st.cache_resource
+def get_retry_policy() -> RetryPolicy:
+    """Return the process-wide retry policy shared by all sessions"""
+    return RetryPolicy()
+
+def is_connection_failure(error: Exception) -> bool:
+    """Whether a requests error happened before the request could reach the server"""
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, ConnectTimeout) or isinstance(reason, NewConnectionError)
+
+def make_api_request(method: str, endpoint: str, max_retries: int = 3,
+                     server_url: Optional[str] = None, **kwargs) -> Optional[requests.Response]:
+    """
+    Make API request with automatic retries and logging. Pass server_url explicitly
+    when calling from a worker thread, which has no access to st.session_state.
+    max_retries is the total number of attempts; retries follow the RetryPolicy.
+    """
+    server_url = server_url or st.session_state.server_url
+    client = get_api_client(server_url)
+    policy = get_retry_policy()
+    metrics = get_metrics()
+    body = kwargs.get("data")
     attempt = 0
     
-    while attempt < max_retries:
+    while True:
+        if attempt == 0:
+            policy.before_request(server_url, endpoint)
+        elif not policy.breaker(server_url).allow_request():
+            raise CircuitOpenError(f"Circuit open for {server_url}, not retrying {endpoint}")
+        logger.info(f"Attempting {method} request to {endpoint} (Attempt {attempt + 1}/{max_retries})")
+        if attempt and hasattr(body, "seek"):
+            body.seek(0)  # Rewind streamed bodies before resending
+        start = time.perf_counter()
         try:
-            logger.info(f"Attempting {method} request to {endpoint} (Attempt {attempt + 1}/{max_retries})")
-            response = requests.request(method, url, **kwargs)
-            
-            if response.status_code == 502:
-                attempt += 1
-                logger.warning(f"502 error encountered. Retrying... (Attempt {attempt}/{max_retries})")
-                time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-                
-            response.raise_for_status()
-            logger.info(f"Successful {method} request to {endpoint}")
-            return response
-            
+            response = client.request(method, endpoint, **kwargs)
         except RequestException as e:
-            attempt += 1
+            metrics.observe_request(method, endpoint, type(e).__name__, time.perf_counter() - start)
+            policy.record_outcome(server_url, ok=False)
             logger.error(f"Request failed: {str(e)}")
-            if attempt == max_retries:
-                logger.error("Max retries reached")
+            delay = policy.retry_delay(method, endpoint, attempt, max_retries,
+                                       connection_failed=is_connection_failure(e))
+            if delay is None:
+                logger.error("Not retrying request")
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
-    return None
+        except Exception:
+            # Any outcome must reach the breaker, or a half-open trial would never resolve
+            policy.record_outcome(server_url, ok=False)
+            raise
+        else:
+            metrics.observe_request(
+                method, endpoint, str(response.status_code), time.perf_counter() - start,
+                request_bytes=payload_size(response.request.body),
+                response_bytes=response_size(response, streamed=kwargs.get("stream", False))
+            )
+            policy.record_outcome(server_url, ok=response.status_code < 500)
+            delay = policy.retry_delay(method, endpoint, attempt, max_retries,
+                                       status_code=response.status_code,
+                                       retry_after=response.headers.get("Retry-After"))
+            if delay is None:
+                response.raise_for_status()
+                logger.info(f"Successful {method} request to {endpoint}")
+                return response
+            if delay > policy.max_delay:
+                logger.warning(f"{response.status_code} error encountered. Server asked to retry in {delay:.0f}s, not waiting")
+                raise RetryLaterError(delay, response)
+            logger.warning(f"{response.status_code} error encountered. Retrying in {delay:.2f}s (Attempt {attempt + 1}/{max_retries})")
+        attempt += 1
+        metrics.record_retry(method, endpoint)
+        policy.sleep(delay)
+
+# List endpoint cache: entries expire after LIST_CACHE_TTL seconds
+LIST_CACHE_TTL = 30
+LIST_CACHE_MAXSIZE = 256
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed time-to-live
+    """
+    def __init__(self, maxsize: int = LIST_CACHE_MAXSIZE, ttl: float = LIST_CACHE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= self.clock():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Any, value: Any):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key: Any) -> bool:
+        """Whether key holds a live entry, without counting a hit or miss"""
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] > self.clock()
+
+    def invalidate(self, key: Any):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+@st.cache_resource
+def get_list_cache() -> TTLCache:
+    """Return the process-wide cache shared by all sessions for list endpoints"""
+    return TTLCache()
+
+# Speculative prefetch: the next wizard step's lists are fetched on background
+# threads as soon as the selection they depend on is made
+PREFETCH_WORKERS = 2
+
+class Prefetcher:
+    """
+    Fetches list endpoints into the shared list cache on worker threads. Each
+    session has one group of pending prefetches, and a new selection cancels the
+    ones it no longer needs unless another session is waiting on them. A group
+    is dropped once all of its prefetches have finished or been cancelled. Reads through fetch_list report whether a prefetch
+    paid off, as hits (already cached), joins (still in flight) and misses.
+    """
+    def __init__(self, cache: TTLCache, workers: int = PREFETCH_WORKERS):
+        self.cache = cache
+        self.hits = 0
+        self.joins = 0
+        self.misses = 0
+        self.submitted = 0
+        self.cancelled = 0
+        self.unused = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._pending: Dict[Tuple[str, str], Tuple[Any, threading.Event]] = {}
+        self._groups: Dict[Any, set] = {}
+        self._prefetched: set = set()
+        self._lock = threading.Lock()
 
+    def submit(self, server_url: str, endpoints: List[str], group: Any):
+        """Prefetch endpoints for a session, cancelling its pending prefetches for other endpoints"""
+        keys = {(server_url, endpoint) for endpoint in endpoints}
+        with self._lock:
+            expired = {key for key in self._prefetched if key not in self.cache}
+            self._prefetched -= expired
+            self.unused += len(expired)
+            previous = self._groups.pop(group, set())
+            wanted = set().union(*self._groups.values())
+            for key in previous - keys - wanted:
+                self._cancel(key)
+            for key in keys:
+                if key in self._pending or key in self.cache:
+                    continue
+                cancelled = threading.Event()
+                self._pending[key] = (self._pool.submit(self._fetch, key, cancelled), cancelled)
+                self.submitted += 1
+                logger.info(f"Prefetching {key[1]}")
+            pending = keys & self._pending.keys()
+            if pending:
+                self._groups[group] = pending
+
+    def _fetch(self, key: Tuple[str, str], cancelled: threading.Event) -> Optional[List[Dict[str, Any]]]:
+        server_url, endpoint = key
+        try:
+            if cancelled.is_set():
+                return None
+            data = make_api_request('GET', endpoint, server_url=server_url).json()
+            with self._lock:
+                if cancelled.is_set():
+                    return None
+                self.cache.set(key, data)
+                self._prefetched.add(key)
+            return data
+        except Exception as e:
+            logger.warning(f"Prefetch of {endpoint} failed: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                # A cancelled prefetch was already removed, and the key may since
+                # have been submitted again
+                if self._pending.get(key, (None, None))[1] is cancelled:
+                    del self._pending[key]
+                    self._resolve(key)
+
+    def _resolve(self, key: Tuple[str, str]):
+        """Remove a finished or cancelled key from the groups, dropping emptied groups"""
+        for group in [group for group, keys in self._groups.items() if key in keys]:
+            self._groups[group].discard(key)
+            if not self._groups[group]:
+                del self._groups[group]
+
+    def _cancel(self, key: Tuple[str, str]):
+        pending = self._pending.pop(key, None)
+        if pending:
+            future, cancelled = pending
+            cancelled.set()
+            future.cancel()
+            self._resolve(key)
+            self.cancelled += 1
+            logger.info(f"Cancelled prefetch of {key[1]}")
+
+    def cancel(self, key: Tuple[str, str]):
+        """Cancel a pending prefetch, e.g. after a write made its result stale"""
+        with self._lock:
+            self._cancel(key)
+            self._prefetched.discard(key)
+
+    def claim(self, key: Tuple[str, str]):
+        """Record a cache hit, counting it as a prefetch hit when a prefetch stored the entry"""
+        with self._lock:
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                self.hits += 1
+
+    def join(self, key: Tuple[str, str], timeout: float = DEFAULT_TIMEOUT[1]) -> Optional[List[Dict[str, Any]]]:
+        """Wait for an in-flight prefetch of key instead of requesting it again"""
+        with self._lock:
+            pending = self._pending.get(key)
+        if pending is None:
+            return None
+        try:
+            data = pending[0].result(timeout=timeout)
+        except Exception:
+            return None
+        if data is not None:
+            with self._lock:
+                self._prefetched.discard(key)
+                self.joins += 1
+        return data
+
+    def miss(self, count: int = 1):
+        """Record list reads that had to go to the server"""
+        with self._lock:
+            self.misses += count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            reads = self.hits + self.joins + self.misses
+            return {
+                "submitted": self.submitted,
+                "cancelled": self.cancelled,
+                "unused": self.unused,
+                "hits": self.hits,
+                "joins": self.joins,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.joins) / reads if reads else 0.0
+            }
+
+@st.cache_resource
+def get_prefetcher() -> Prefetcher:
+    """Return the process-wide prefetcher, filling the shared list cache"""
+    return Prefetcher(get_list_cache())
+
+def fetch_list(endpoint: str) -> List[Dict[str, Any]]:
+    """
+    Fetch a list endpoint, serving repeated reads from the shared list cache and
+    waiting on a prefetch of it that is still in flight
+    """
+    cache = get_list_cache()
+    prefetcher = get_prefetcher()
+    key = (st.session_state.server_url, endpoint)
+    cached = cache.get(key)
+    if cached is not None:
+        logger.info(f"Serving {endpoint} from list cache")
+        prefetcher.claim(key)
+        return cached
+    
+    prefetched = prefetcher.join(key)
+    if prefetched is not None:
+        logger.info(f"Serving {endpoint} from an in-flight prefetch")
+        return prefetched
+    
+    prefetcher.miss()
+    response = make_api_request('GET', endpoint)
+    if response and response.status_code == 200:
+        data = response.json()
+        cache.set(key, data)
+        return data
+    return []
+
+def invalidate_list(endpoint: str):
+    """Drop a cached list after a write that changes it"""
+    logger.info(f"Invalidating list cache for {endpoint}")
+    key = (st.session_state.server_url, endpoint)
+    get_prefetcher().cancel(key)
+    get_list_cache().invalidate(key)
+
+def update_cached_list(endpoint: str, update: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]):
+    """Apply a write the server confirmed to a cached list instead of refetching it"""
+    cache = get_list_cache()
+    key = (st.session_state.server_url, endpoint)
+    cached = cache.get(key)
+    if cached is not None:
+        logger.info(f"Updating cached {endpoint} in place")
+        cache.set(key, update(cached))
+
+async def async_make_api_request(client: Any, method: str, endpoint: str, max_retries: int = 3,
+                                 policy: Optional[RetryPolicy] = None, metrics: Optional[Metrics] = None,
+                                 **kwargs) -> Optional[Any]:
+    """
+    Async counterpart of make_api_request for an httpx.AsyncClient, following the
+    same RetryPolicy. Pass policy and metrics explicitly when running off the
+    script thread, where the cached resources cannot be looked up.
+    """
+    import httpx
+    policy = policy if policy is not None else get_retry_policy()
+    metrics = metrics if metrics is not None else get_metrics()
+    server_url = str(client.base_url).rstrip("/")
+    attempt = 0
+    
+    while True:
+        if attempt == 0:
+            policy.before_request(server_url, endpoint)
+        elif not policy.breaker(server_url).allow_request():
+            raise CircuitOpenError(f"Circuit open for {server_url}, not retrying {endpoint}")
+        logger.info(f"Attempting async {method} request to {endpoint} (Attempt {attempt + 1}/{max_retries})")
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, endpoint, **kwargs)
+        except httpx.TransportError as e:
+            metrics.observe_request(method, endpoint, type(e).__name__, time.perf_counter() - start)
+            policy.record_outcome(server_url, ok=False)
+            logger.error(f"Request failed: {str(e)}")
+            delay = policy.retry_delay(method, endpoint, attempt, max_retries,
+                                       connection_failed=isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)))
+            if delay is None:
+                logger.error("Not retrying request")
+                raise
+        except Exception:
+            policy.record_outcome(server_url, ok=False)
+            raise
+        else:
+            metrics.observe_request(
+                method, endpoint, str(response.status_code), time.perf_counter() - start,
+                request_bytes=len(response.request.content), response_bytes=len(response.content)
+            )
+            policy.record_outcome(server_url, ok=response.status_code < 500)
+            delay = policy.retry_delay(method, endpoint, attempt, max_retries,
+                                       status_code=response.status_code,
+                                       retry_after=response.headers.get("Retry-After"))
+            if delay is None:
+                response.raise_for_status()
+                logger.info(f"Successful async {method} request to {endpoint}")
+                return response
+            if delay > policy.max_delay:
+                logger.warning(f"{response.status_code} error encountered. Server asked to retry in {delay:.0f}s, not waiting")
+                raise RetryLaterError(delay, response)
+            logger.warning(f"{response.status_code} error encountered. Retrying in {delay:.2f}s (Attempt {attempt + 1}/{max_retries})")
+        attempt += 1
+        metrics.record_retry(method, endpoint)
+        await asyncio.sleep(delay)  # Yields to the other gathered requests while backing off
+
+class AsyncApiClient:
+    """
+    Keep-alive httpx.AsyncClient for a single server. The client is bound to the
+    event loop it was created on, so it lives on a private loop running in a
+    daemon thread and renders submit their coroutines to that loop instead of
+    starting a fresh loop and connection pool with asyncio.run.
+    """
+    def __init__(self, base_url: str, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                 policy: Optional[RetryPolicy] = None, metrics: Optional[Metrics] = None):
+        import httpx
+        self.base_url = base_url.rstrip('/')
+        self.policy = policy if policy is not None else get_retry_policy()
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-api-client", daemon=True)
+        self._thread.start()
+        self.client = self._run(self._open(httpx, pool_size, timeout))
+
+    async def _open(self, httpx: Any, pool_size: int, timeout: Tuple[float, float]) -> Any:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def _run(self, coroutine: Any) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _gather_json(self, endpoints: List[str]) -> List[Any]:
+        responses = await asyncio.gather(
+            *(async_make_api_request(self.client, 'GET', endpoint, policy=self.policy, metrics=self.metrics)
+              for endpoint in endpoints),
+            return_exceptions=True
+        )
+        results = []
+        for endpoint, response in zip(endpoints, responses):
+            if isinstance(response, BaseException):
+                logger.error(f"Failed to fetch {endpoint}: {response}")
+                results.append(None)
+            else:
+                results.append(response.json())
+        return results
+
+    def gather_json(self, endpoints: List[str]) -> List[Any]:
+        """
+        GET several endpoints concurrently over the kept-alive pool and decode their
+        JSON. A failed endpoint yields None without failing the others.
+        """
+        return self._run(self._gather_json(endpoints))
+
+    def close(self):
+        self._run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+@st.cache_resource
+def get_async_api_client(server_url: str, pool_size: int = DEFAULT_POOL_SIZE) -> AsyncApiClient:
+    """Return the process-wide async client for a server URL"""
+    logger.info(f"Creating async HTTP client for {server_url} (pool size {pool_size})")
+    return AsyncApiClient(server_url, pool_size=pool_size)
+
+def fetch_lists(endpoints: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Fetch several independent list endpoints for one page render. Cache hits and
+    in-flight prefetches are served directly and the misses are requested
+    concurrently over the server's kept-alive AsyncApiClient, so the page waits for
+    the slowest read rather than the sum of all of them. Falls back to sequential fetch_list calls when httpx
+    is not installed.
+    """
+    cache = get_list_cache()
+    prefetcher = get_prefetcher()
+    server_url = st.session_state.server_url
+    results = {endpoint: cache.get((server_url, endpoint)) for endpoint in endpoints}
+    for endpoint, data in results.items():
+        if data is not None:
+            prefetcher.claim((server_url, endpoint))
+        else:
+            results[endpoint] = prefetcher.join((server_url, endpoint))
+    misses = [endpoint for endpoint, data in results.items() if data is None]
+    if len(misses) < 2:
+        return {endpoint: data if data is not None else fetch_list(endpoint) for endpoint, data in results.items()}
+    
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        return {endpoint: data if data is not None else fetch_list(endpoint) for endpoint, data in results.items()}
+    
+    prefetcher.miss(len(misses))
+    start = time.perf_counter()
+    for endpoint, data in zip(misses, get_async_api_client(server_url).gather_json(misses)):
+        if data is None:
+            # Failures are shown as empty for this render only; caching them would
+            # hide the list from every session until the entry expires
+            results[endpoint] = []
+            continue
+        cache.set((server_url, endpoint), data)
+        results[endpoint] = data
+    logger.info(f"Fetched {len(misses)} endpoints concurrently in {time.perf_counter() - start:.3f}s")
+    return results
+
+# Document upload pipeline: concurrent uploads, streamed bodies and resumable
+# chunked transfers for files above RESUMABLE_UPLOAD_THRESHOLD bytes
+UPLOAD_WORKERS = 4
+UPLOAD_BLOCK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+RESUMABLE_UPLOAD_THRESHOLD = 16 * 1024 * 1024
+UPLOAD_TIMEOUT = (3.05, 300)
+
+class MultipartFileStream:
+    """
+    File-like multipart/form-data body that reads the file block by block while it
+    is being sent, instead of building the whole body in memory
+    """
+    def __init__(self, fileobj: BinaryIO, filename: str, size: int, field: str = "file",
+                 content_type: str = "application/octet-stream", block_size: int = UPLOAD_BLOCK_SIZE):
+        boundary = uuid.uuid4().hex
+        safe_name = filename.replace('"', '%22')
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{safe_name}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._fileobj = fileobj
+        self._size = size
+        self._block_size = block_size
+        self.seek(0)
+
+    def __len__(self) -> int:
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            block = self.read(self._block_size)
+            if not block:
+                return
+            yield block
+
+    def seek(self, offset: int, whence: int = 0):
+        """Rewind to the start of the body (only offset 0 is supported)"""
+        if offset != 0 or whence != 0:
+            raise ValueError("MultipartFileStream can only be rewound to the start")
+        self._fileobj.seek(0)
+        self._buffer = self._head
+        self._file_done = False
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        remaining = size if size is not None and size >= 0 else None
+        while remaining is None or remaining > 0:
+            if not self._buffer:
+                self._buffer = self._next_part()
+                if not self._buffer:
+                    break
+            n = len(self._buffer) if remaining is None else min(remaining, len(self._buffer))
+            parts.append(self._buffer[:n])
+            self._buffer = self._buffer[n:]
+            if remaining is not None:
+                remaining -= n
+        return b"".join(parts)
+
+    def _next_part(self) -> bytes:
+        if self._file_done:
+            return b""
+        block = self._fileobj.read(self._block_size)
+        if block:
+            return block
+        self._file_done = True
+        return self._tail
+
+@st.cache_resource
+def get_upload_sessions() -> TTLCache:
+    """Return the process-wide registry of in-progress resumable uploads"""
+    return TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+def get_file_size(fileobj: BinaryIO) -> int:
+    """Return the size of a seekable file object without reading it"""
+    size = getattr(fileobj, "size", None)
+    if size is None:
+        fileobj.seek(0, 2)
+        size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+def upload_streamed(server_url: str, knowledge_id: str, fileobj: BinaryIO,
+                    filename: str, size: int) -> requests.Response:
+    """Upload a whole file in one request with a streamed multipart body"""
+    body = MultipartFileStream(fileobj, filename, size)
+    return make_api_request(
+        'POST',
+        f"/documents/upload/{knowledge_id}",
+        server_url=server_url,
+        data=body,
+        headers={"Content-Type": body.content_type},
+        timeout=UPLOAD_TIMEOUT
+    )
+
+def upload_resumable(server_url: str, knowledge_id: str, fileobj: BinaryIO, filename: str,
+                     size: int, sessions: TTLCache) -> Optional[requests.Response]:
+    """
+    Upload a large file in UPLOAD_CHUNK_SIZE pieces through an upload session, resuming
+    from the last byte the server acknowledged when a previous attempt was interrupted.
+    Returns None when the server does not offer upload sessions.
+    """
+    session_key = (server_url, knowledge_id, filename, size)
+    upload_id = sessions.get(session_key)
+    offset = 0
+    
+    try:
+        if upload_id:
+            response = make_api_request('GET', f"/documents/upload-session/{upload_id}",
+                                        max_retries=1, server_url=server_url)
+            offset = response.json().get("received", 0)
+            logger.info(f"Resuming upload of {filename} at byte {offset}")
+        else:
+            response = make_api_request(
+                'POST',
+                f"/documents/upload-session/{knowledge_id}",
+                max_retries=1,
+                server_url=server_url,
+                json={"filename": filename, "size": size}
+            )
+            upload_id = response.json()["upload_id"]
+            sessions.set(session_key, upload_id)
+    except HTTPError as e:
+        if e.response is not None and e.response.status_code in (404, 405):
+            if upload_id:
+                sessions.invalidate(session_key)
+                return upload_resumable(server_url, knowledge_id, fileobj, filename, size, sessions)
+            logger.info("Server does not support resumable uploads")
+            return None
+        raise
+    
+    while offset < size:
+        fileobj.seek(offset)
+        chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+        end = offset + len(chunk) - 1
+        response = make_api_request(
+            'PUT',
+            f"/documents/upload-session/{upload_id}",
+            server_url=server_url,
+            data=chunk,
+            headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Range": f"bytes {offset}-{end}/{size}"
+            },
+            timeout=UPLOAD_TIMEOUT
+        )
+        offset = response.json().get("received", end + 1)
+    
+    response = make_api_request('POST', f"/documents/upload-session/{upload_id}/complete",
+                                server_url=server_url, timeout=UPLOAD_TIMEOUT)
+    sessions.invalidate(session_key)
+    return response
+
+# Local record of uploaded file hashes per knowledge base, used to skip duplicates
+UPLOAD_MANIFEST_PATH = "upload_manifest.json"
+
+def hash_file(fileobj: BinaryIO, block_size: int = UPLOAD_BLOCK_SIZE) -> str:
+    """Compute the SHA-256 of a file object block by block and rewind it"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(block_size), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+class UploadManifest:
+    """
+    JSON file mapping knowledge_id -> filename -> {sha256, size, document_id, uploaded_at}
+    """
+    def __init__(self, path: str = UPLOAD_MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def entries(self, knowledge_id: Any) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._data.get(str(knowledge_id), {}))
+
+    def record(self, knowledge_id: Any, filename: str, sha256: str, size: int, document_id: Any = None):
+        with self._lock:
+            self._data.setdefault(str(knowledge_id), {})[filename] = {
+                "sha256": sha256,
+                "size": size,
+                "document_id": document_id,
+                "uploaded_at": datetime.now().isoformat()
+            }
+            self._save()
+
+    def forget(self, knowledge_id: Any, document_id: Any):
+        with self._lock:
+            entries = self._data.get(str(knowledge_id), {})
+            for filename in [name for name, entry in entries.items() if entry.get("document_id") == document_id]:
+                del entries[filename]
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+@st.cache_resource
+def get_upload_manifest() -> UploadManifest:
+    """Return the process-wide upload manifest"""
+    return UploadManifest()
+
+def name_conflicts(files: List[Any], existing_docs: List[Dict[str, Any]]) -> List[str]:
+    """Names of selected files that an existing document already uses"""
+    existing_names = {doc["filename"] for doc in existing_docs}
+    return [file.name for file in files if file.name in existing_names]
+
+def plan_uploads(files: List[Any], knowledge_id: str, existing_docs: List[Dict[str, Any]],
+                 manifest: UploadManifest, replace: Collection[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Hash each selected file and decide whether it is new or a duplicate of content
+    already in the knowledge base. A file whose name matches an existing document
+    with other content is flagged with conflicts_with; it only replaces (deletes)
+    that document when its name is in replace, which the user confirms. Unrelated
+    files can share a name, so nothing is deleted on a name match alone.
+    Manifest entries only count while their document is still listed by the server.
+    """
+    docs_by_name = {doc["filename"]: doc for doc in existing_docs}
+    docs_by_id = {doc["document_id"]: doc for doc in existing_docs}
+    known_hashes = {}
+    for doc in existing_docs:
+        content_hash = doc.get("content_hash") or doc.get("sha256")
+        if content_hash:
+            known_hashes[content_hash] = doc["filename"]
+    for filename, entry in manifest.entries(knowledge_id).items():
+        document_id = entry.get("document_id")
+        if (document_id in docs_by_id) if document_id is not None else (filename in docs_by_name):
+            known_hashes.setdefault(entry["sha256"], filename)
+    
+    plan = []
+    for file in files:
+        sha256 = hash_file(file)
+        item = {"file": file, "sha256": sha256, "action": "upload", "replaces": None, "conflicts_with": None}
+        if sha256 in known_hashes:
+            item["action"] = "skip"
+            item["duplicate_of"] = known_hashes[sha256]
+        elif file.name in docs_by_name:
+            item["conflicts_with"] = docs_by_name[file.name]
+            if file.name in replace:
+                item["action"] = "replace"
+                item["replaces"] = docs_by_name[file.name]
+        known_hashes.setdefault(sha256, file.name)
+        plan.append(item)
+    return plan
+
+def upload_document(server_url: str, knowledge_id: str, fileobj: BinaryIO, filename: str,
+                    sessions: TTLCache, manifest: UploadManifest, sha256: str,
+                    replaces: Optional[Dict[str, Any]] = None,
+                    conflicts_with: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Upload one file and return its entry for the batch report. When the file
+    replaces an existing document (a confirmed replacement), the old document is
+    deleted after the new content is uploaded.
+    """
+    start = time.perf_counter()
+    size = get_file_size(fileobj)
+    report = {"file": filename, "size": size, "status": "failed", "detail": ""}
+    try:
+        logger.info(f"Attempting to upload file: {filename} ({size} bytes)")
+        response = None
+        if size > RESUMABLE_UPLOAD_THRESHOLD:
+            response = upload_resumable(server_url, knowledge_id, fileobj, filename, size, sessions)
+        if response is None:
+            response = upload_streamed(server_url, knowledge_id, fileobj, filename, size)
+        
+        if response and response.status_code == 200:
+            logger.info(f"File uploaded successfully: {filename}")
+            try:
+                document_id = response.json().get("document_id")
+            except ValueError:
+                document_id = None
+            manifest.record(knowledge_id, filename, sha256, size, document_id)
+            report["status"] = "uploaded"
+            if conflicts_with and not replaces:
+                report["detail"] = f"Kept existing document {conflicts_with['document_id']} with the same name"
+            if replaces:
+                logger.info(f"Deleting replaced document: {replaces['filename']}")
+                make_api_request('DELETE', f"/documents/delete/{replaces['document_id']}", server_url=server_url)
+                report["status"] = "replaced"
+                report["detail"] = f"Replaced document {replaces['document_id']}"
+        else:
+            logger.error(f"Error uploading file: {filename}")
+            report["detail"] = "Unknown error"
+    except HTTPError as e:
+        try:
+            report["detail"] = e.response.json().get('detail', str(e))
+        except ValueError:
+            report["detail"] = str(e)
+        logger.error(f"Error uploading file {filename}: {report['detail']}")
+    except Exception as e:
+        report["detail"] = str(e)
+        logger.error(f"Error uploading file {filename}: {str(e)}")
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    return report
+
+def upload_documents(files: List[Any], knowledge_id: str, existing_docs: List[Dict[str, Any]],
+                     on_progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None,
+                     replace: Collection[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Upload a batch of files on a bounded thread pool, skipping content that is
+    already in the knowledge base. Files named in replace delete the existing
+    document of the same name once uploaded. on_progress is called on the calling
+    thread after each file finishes with (files done, total files, report).
+    """
+    server_url = st.session_state.server_url
+    sessions = get_upload_sessions()
+    manifest = get_upload_manifest()
+    reports = []
+    
+    plan = plan_uploads(files, knowledge_id, existing_docs, manifest, replace)
+    for item in plan:
+        if item["action"] == "skip":
+            logger.info(f"Skipping duplicate file {item['file'].name} (same content as {item['duplicate_of']})")
+            reports.append({
+                "file": item["file"].name,
+                "size": get_file_size(item["file"]),
+                "status": "duplicate",
+                "detail": f"Same content as {item['duplicate_of']}",
+                "seconds": 0.0
+            })
+            if on_progress:
+                on_progress(len(reports), len(files), reports[-1])
+    
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        futures = [
+            pool.submit(upload_document, server_url, knowledge_id, item["file"], item["file"].name,
+                        sessions, manifest, item["sha256"], item["replaces"], item["conflicts_with"])
+            for item in plan if item["action"] != "skip"
+        ]
+        for future in as_completed(futures):
+            reports.append(future.result())
+            if on_progress:
+                on_progress(len(reports), len(files), reports[-1])
+    return reports
+
+@timed_render("server_setup")
 def show_server_setup():
     st.title("Server Configuration")
     logger.info("Displaying server setup page")
@@ -114,45 +1493,40 @@ def show_server_setup():
             entered_url = entered_url.rstrip('/')
             try:
                 logger.info(f"Testing connection to {entered_url}")
-                response = requests.get(entered_url)
+                response = get_api_client(entered_url).request('GET', "")
                 st.session_state.server_url = entered_url
                 logger.info("Server connection successful")
-                st.success("✅ Connected successfully!")
-                time.sleep(1)
-                st.session_state.step = "user_setup"
-                st.rerun()
+                flash_success("✅ Connected successfully!")
+                advance_to("user_setup")
             except Exception as e:
                 logger.error(f"Server connection failed: {str(e)}")
                 st.error(f"Connection error: {str(e)}")
 
+@timed_render("user_setup")
 def show_user_setup():
     st.title("User Setup")
     logger.info("Displaying user setup page")
     
     # Fetch existing users
     try:
-        response = make_api_request('GET', "/users/list")
-        if response and response.status_code == 200:
-            existing_users = response.json()
+        existing_users = fetch_list("/users/list")
+        if existing_users:
+            st.subheader("Select Existing User")
+            user_options = ["Select a user..."] + [user["user_name"] for user in existing_users]
+            selected_user = st.selectbox(
+                "Choose a user",
+                options=user_options,
+                index=0
+            )
             
-            if existing_users:
-                st.subheader("Select Existing User")
-                user_options = ["Select a user..."] + [user["user_name"] for user in existing_users]
-                selected_user = st.selectbox(
-                    "Choose a user",
-                    options=user_options,
-                    index=0
+            if selected_user != "Select a user...":
+                selected_user_data = next(user for user in existing_users if user["user_name"] == selected_user)
+                prefetch_step("chatbot_setup", user_id=selected_user_data["user_id"])
+                st.button(
+                    "Use Selected User",
+                    on_click=choose,
+                    args=("user_id", selected_user_data["user_id"], f"Selected user: {selected_user}", "chatbot_setup")
                 )
-                
-                if selected_user != "Select a user...":
-                    selected_user_data = next(user for user in existing_users if user["user_name"] == selected_user)
-                    if st.button("Use Selected User"):
-                        logger.info(f"Selected existing user: {selected_user}")
-                        st.session_state.user_id = selected_user_data["user_id"]
-                        st.success(f"Selected user: {selected_user}")
-                        time.sleep(1)
-                        st.session_state.step = "chatbot_setup"
-                        st.rerun()
     except Exception as e:
         logger.error(f"Error fetching users: {str(e)}")
         st.error(f"Error fetching users: {str(e)}")
@@ -180,11 +1554,10 @@ def show_user_setup():
                 if response and response.status_code == 200:
                     data = response.json()
                     st.session_state.user_id = data["user_id"]
+                    invalidate_list("/users/list")
                     logger.info(f"User created successfully: {user_name}")
-                    st.success("User created successfully!")
-                    time.sleep(1)
-                    st.session_state.step = "chatbot_setup"
-                    st.rerun()
+                    flash_success("User created successfully!")
+                    advance_to("chatbot_setup")
                 else:
                     logger.error("Failed to create user")
                     st.error("Error creating user")
@@ -192,49 +1565,39 @@ def show_user_setup():
                 logger.error(f"Error creating user: {str(e)}")
                 st.error(f"Error: {str(e)}")
 
+@timed_render("chatbot_setup")
 def show_chatbot_setup():
     st.title("Chatbot Setup")
     logger.info("Displaying chatbot setup page")
     
-    if not st.session_state.user_id:
-        logger.warning("No user_id found in session state")
-        st.error("Please select or create a user first")
-        return
-    
     # Fetch existing chatbots
     try:
-        response = make_api_request(
-            'GET',
-            f"/chatbots/list/{st.session_state.user_id}"
-        )
-        if response and response.status_code == 200:
-            existing_chatbots = response.json()
+        existing_chatbots = fetch_list(f"/chatbots/list/{st.session_state.user_id}")
+        if existing_chatbots:
+            st.subheader("Select Existing Chatbot")
+            chatbot_options = ["Select a chatbot..."] + [
+                f"{chatbot['chatbot_name']} - {chatbot['chatbot_desc'][:50]}..." 
+                for chatbot in existing_chatbots
+            ]
+            selected_chatbot = st.selectbox(
+                "Choose a chatbot",
+                options=chatbot_options,
+                index=0
+            )
             
-            if existing_chatbots:
-                st.subheader("Select Existing Chatbot")
-                chatbot_options = ["Select a chatbot..."] + [
-                    f"{chatbot['chatbot_name']} - {chatbot['chatbot_desc'][:50]}..." 
-                    for chatbot in existing_chatbots
-                ]
-                selected_chatbot = st.selectbox(
-                    "Choose a chatbot",
-                    options=chatbot_options,
-                    index=0
+            if selected_chatbot != "Select a chatbot...":
+                selected_chatbot_name = selected_chatbot.split(" - ")[0]
+                selected_chatbot_data = next(
+                    chatbot for chatbot in existing_chatbots 
+                    if chatbot["chatbot_name"] == selected_chatbot_name
+                )
+                prefetch_step("knowledge_setup", chatbot_id=selected_chatbot_data["chatbot_id"])
+                st.button(
+                    "Use Selected Chatbot",
+                    on_click=choose,
+                    args=("chatbot_id", selected_chatbot_data["chatbot_id"],
+                          f"Selected chatbot: {selected_chatbot_name}", "knowledge_setup")
                 )
-                
-                if selected_chatbot != "Select a chatbot...":
-                    selected_chatbot_name = selected_chatbot.split(" - ")[0]
-                    selected_chatbot_data = next(
-                        chatbot for chatbot in existing_chatbots 
-                        if chatbot["chatbot_name"] == selected_chatbot_name
-                    )
-                    if st.button("Use Selected Chatbot"):
-                        logger.info(f"Selected existing chatbot: {selected_chatbot_name}")
-                        st.session_state.chatbot_id = selected_chatbot_data["chatbot_id"]
-                        st.success(f"Selected chatbot: {selected_chatbot_name}")
-                        time.sleep(1)
-                        st.session_state.step = "knowledge_setup"
-                        st.rerun()
     except Exception as e:
         logger.error(f"Error fetching chatbots: {str(e)}")
         st.error(f"Error fetching chatbots: {str(e)}")
@@ -266,11 +1629,10 @@ def show_chatbot_setup():
                 if response and response.status_code == 200:
                     data = response.json()
                     st.session_state.chatbot_id = data["chatbot_id"]
+                    invalidate_list(f"/chatbots/list/{st.session_state.user_id}")
                     logger.info(f"Chatbot created successfully: {chatbot_name}")
-                    st.success("Chatbot created successfully!")
-                    time.sleep(1)
-                    st.session_state.step = "knowledge_setup"
-                    st.rerun()
+                    flash_success("Chatbot created successfully!")
+                    advance_to("knowledge_setup")
                 else:
                     logger.error("Failed to create chatbot")
                     st.error("Error creating chatbot")
@@ -278,49 +1640,39 @@ def show_chatbot_setup():
                 logger.error(f"Error creating chatbot: {str(e)}")
                 st.error(f"Error: {str(e)}")
 
+@timed_render("knowledge_setup")
 def show_knowledge_setup():
     st.title("Knowledge Base Setup")
     logger.info("Displaying knowledge base setup page")
     
-    if not st.session_state.chatbot_id:
-        logger.warning("No chatbot_id found in session state")
-        st.error("Please select or create a chatbot first")
-        return
-    
     # Fetch existing knowledge bases
     try:
-        response = make_api_request(
-            'GET',
-            f"/knowledge/list/{st.session_state.chatbot_id}"
-        )
-        if response and response.status_code == 200:
-            existing_knowledge_bases = response.json()
+        existing_knowledge_bases = fetch_list(f"/knowledge/list/{st.session_state.chatbot_id}")
+        if existing_knowledge_bases:
+            st.subheader("Select Existing Knowledge Base")
+            kb_options = ["Select a knowledge base..."] + [
+                f"{kb['knowledge_name']} - {kb['knowledge_desc'][:50]}..."
+                for kb in existing_knowledge_bases
+            ]
+            selected_kb = st.selectbox(
+                "Choose a knowledge base",
+                options=kb_options,
+                index=0
+            )
             
-            if existing_knowledge_bases:
-                st.subheader("Select Existing Knowledge Base")
-                kb_options = ["Select a knowledge base..."] + [
-                    f"{kb['knowledge_name']} - {kb['knowledge_desc'][:50]}..."
-                    for kb in existing_knowledge_bases
-                ]
-                selected_kb = st.selectbox(
-                    "Choose a knowledge base",
-                    options=kb_options,
-                    index=0
+            if selected_kb != "Select a knowledge base...":
+                selected_kb_name = selected_kb.split(" - ")[0]
+                selected_kb_data = next(
+                    kb for kb in existing_knowledge_bases 
+                    if kb["knowledge_name"] == selected_kb_name
+                )
+                prefetch_step("document_upload", knowledge_id=selected_kb_data["knowledge_id"])
+                st.button(
+                    "Use Selected Knowledge Base",
+                    on_click=choose,
+                    args=("knowledge_id", selected_kb_data["knowledge_id"],
+                          f"Selected knowledge base: {selected_kb_name}", "document_upload")
                 )
-                
-                if selected_kb != "Select a knowledge base...":
-                    selected_kb_name = selected_kb.split(" - ")[0]
-                    selected_kb_data = next(
-                        kb for kb in existing_knowledge_bases 
-                        if kb["knowledge_name"] == selected_kb_name
-                    )
-                    if st.button("Use Selected Knowledge Base"):
-                        logger.info(f"Selected existing knowledge base: {selected_kb_name}")
-                        st.session_state.knowledge_id = selected_kb_data["knowledge_id"]
-                        st.success(f"Selected knowledge base: {selected_kb_name}")
-                        time.sleep(1)
-                        st.session_state.step = "document_upload"
-                        st.rerun()
     except Exception as e:
         logger.error(f"Error fetching knowledge bases: {str(e)}")
         st.error(f"Error fetching knowledge bases: {str(e)}")
@@ -352,11 +1704,10 @@ def show_knowledge_setup():
                 if response and response.status_code == 200:
                     data = response.json()
                     st.session_state.knowledge_id = data["knowledge_id"]
+                    invalidate_list(f"/knowledge/list/{st.session_state.chatbot_id}")
                     logger.info(f"Knowledge base created successfully: {knowledge_name}")
-                    st.success("Knowledge base created successfully!")
-                    time.sleep(1)
-                    st.session_state.step = "document_upload"
-                    st.rerun()
+                    flash_success("Knowledge base created successfully!")
+                    advance_to("document_upload")
                 else:
                     logger.error("Failed to create knowledge base")
                     st.error("Error creating knowledge base")
@@ -364,45 +1715,113 @@ def show_knowledge_setup():
                 logger.error(f"Error creating knowledge base: {str(e)}")
                 st.error(f"Error: {str(e)}")
 
+# Bulk document operations: one /documents/batch request, or a concurrent fan-out of
+# the single-document endpoints on servers that do not have it
+DOCUMENT_BATCH_WORKERS = 8
+DOCUMENT_ACTIONS = {
+    "delete": ('DELETE', "/documents/delete/{document_id}"),
+    "reindex": ('POST', "/documents/reindex/{document_id}")
+}
+
+@st.cache_resource
+def get_unsupported_endpoints() -> set:
+    """(server_url, endpoint) pairs found missing, so fallbacks skip the probe"""
+    return set()
+
+def batch_document_action(server_url: str, knowledge_id: Any, action: str,
+                          document_ids: List[Any]) -> Dict[Any, Optional[str]]:
+    """
+    Delete or re-index documents and return {document_id: error detail, or None
+    on success}. Uses a single /documents/batch request when the server has it.
+    """
+    unsupported = get_unsupported_endpoints()
+    start = time.perf_counter()
+    if (server_url, "/documents/batch") not in unsupported:
+        try:
+            response = make_api_request(
+                'POST',
+                "/documents/batch",
+                server_url=server_url,
+                json={"action": action, "knowledge_id": knowledge_id, "document_ids": document_ids}
+            )
+            outcome = {
+                result["document_id"]: None if result.get("status") == "ok" else result.get("detail", "Failed")
+                for result in response.json().get("results", [])
+            }
+            logger.info(f"Batch {action} of {len(document_ids)} documents in {time.perf_counter() - start:.2f}s")
+            return {document_id: outcome.get(document_id, "No result from server") for document_id in document_ids}
+        except HTTPError as e:
+            if e.response is None or e.response.status_code not in (404, 405):
+                raise
+            logger.info(f"{server_url} has no /documents/batch, falling back to per-document requests")
+            unsupported.add((server_url, "/documents/batch"))
+    
+    method, template = DOCUMENT_ACTIONS[action]
+    
+    def apply(document_id: Any) -> Tuple[Any, Optional[str]]:
+        try:
+            make_api_request(method, template.format(document_id=document_id), server_url=server_url)
+            return document_id, None
+        except Exception as e:
+            return document_id, str(e)
+    
+    with ThreadPoolExecutor(max_workers=DOCUMENT_BATCH_WORKERS) as pool:
+        outcome = dict(pool.map(apply, document_ids))
+    logger.info(f"Fanned out {action} of {len(document_ids)} documents in {time.perf_counter() - start:.2f}s")
+    return outcome
+
+@timed_render("document_upload")
 def show_document_upload():
     st.title("Document Upload")
     logger.info("Displaying document upload page")
     
-    if not st.session_state.knowledge_id:
-        logger.warning("No knowledge_id found in session state")
-        st.error("Please select or create a knowledge base first")
-        return
-        
     # Show existing documents
+    existing_docs = []
     try:
-        response = make_api_request(
-            'GET',
-            f"/documents/list/{st.session_state.knowledge_id}"
-        )
-        if response and response.status_code == 200:
-            existing_docs = response.json()
-            if existing_docs:
-                st.subheader("Existing Documents")
-                for doc in existing_docs:
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        st.write(f"📄 {doc['filename']}")
-                        st.write(f"Uploaded: {doc['upload_date']}")
-                    with col2:
-                        if st.button("Delete", key=f"delete_{doc['document_id']}"):
-                            try:
-                                logger.info(f"Attempting to delete document: {doc['filename']}")
-                                delete_response = make_api_request(
-                                    'DELETE',
-                                    f"/documents/delete/{doc['document_id']}"
-                                )
-                                if delete_response and delete_response.status_code == 200:
-                                    logger.info(f"Document deleted successfully: {doc['filename']}")
-                                    st.success(f"Deleted {doc['filename']}")
-                                    st.rerun()
-                            except Exception as e:
-                                logger.error(f"Error deleting document: {str(e)}")
-                                st.error(f"Error deleting document: {str(e)}")
+        documents_endpoint = f"/documents/list/{st.session_state.knowledge_id}"
+        existing_docs = fetch_list(documents_endpoint)
+        if existing_docs:
+            st.subheader("Existing Documents")
+            st.dataframe(
+                [{"File": doc["filename"], "Uploaded": doc["upload_date"]} for doc in existing_docs],
+                hide_index=True
+            )
+            documents = {doc["document_id"]: doc for doc in existing_docs}
+            selected_ids = st.multiselect(
+                "Select documents",
+                options=list(documents),
+                format_func=lambda document_id: documents[document_id]["filename"],
+                key=f"selected_documents_{st.session_state.knowledge_id}"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                delete_clicked = st.button(f"Delete {len(selected_ids)} selected", disabled=not selected_ids)
+            with col2:
+                reindex_clicked = st.button(f"Re-index {len(selected_ids)} selected", disabled=not selected_ids)
+            if delete_clicked or reindex_clicked:
+                action = "delete" if delete_clicked else "reindex"
+                logger.info(f"Running {action} on {len(selected_ids)} documents")
+                with st.spinner(f"Running {action} on {len(selected_ids)} documents..."):
+                    outcome = batch_document_action(
+                        st.session_state.server_url, st.session_state.knowledge_id, action, selected_ids
+                    )
+                done = [document_id for document_id, error in outcome.items() if error is None]
+                failed = {document_id: error for document_id, error in outcome.items() if error is not None}
+                if action == "delete" and done:
+                    manifest = get_upload_manifest()
+                    for document_id in done:
+                        manifest.forget(st.session_state.knowledge_id, document_id)
+                    removed = set(done)
+                    update_cached_list(documents_endpoint, lambda docs: [d for d in docs if d["document_id"] not in removed])
+                if done:
+                    get_semantic_cache().invalidate_knowledge(st.session_state.knowledge_id)
+                    flash_success(f"{'Deleted' if action == 'delete' else 'Re-indexed'} {len(done)} document(s)")
+                if failed:
+                    flash_warning("Failed: " + "; ".join(
+                        f"{documents[document_id]['filename']} ({error})" for document_id, error in failed.items()
+                    ))
+                del st.session_state[f"selected_documents_{st.session_state.knowledge_id}"]
+                rerun_step()
     except Exception as e:
         logger.error(f"Error fetching documents: {str(e)}")
         st.error(f"Error fetching documents: {str(e)}")
@@ -412,133 +1831,1142 @@ def show_document_upload():
     uploaded_files = st.file_uploader(
         "Choose files",
         type=['txt', 'pdf', 'csv'],
-        accept_multiple_files=True
+        accept_multiple_files=True,
+        key=f"uploader_{st.session_state.uploader_key}"
+    )
+    
+    replace = []
+    conflicts = name_conflicts(uploaded_files or [], existing_docs)
+    if conflicts:
+        st.warning(f"{len(conflicts)} file(s) share a name with an existing document: {', '.join(conflicts)}")
+        replace = st.multiselect(
+            "Replace these existing documents",
+            options=conflicts,
+            help="Selected documents are deleted once the new file is uploaded. Others are kept, and the "
+                 "new file is uploaded alongside them unless its content is already in the knowledge base.",
+            key=f"replace_documents_{st.session_state.uploader_key}"
+        )
+    
+    if uploaded_files and st.button(f"Upload {len(uploaded_files)} file(s)"):
+        progress = st.progress(0.0, text="Starting upload...")
+        
+        def on_progress(done: int, total: int, report: Dict[str, Any]):
+            progress.progress(done / total, text=f"{done}/{total} files processed ({report['file']}: {report['status']})")
+        
+        reports = upload_documents(uploaded_files, st.session_state.knowledge_id, existing_docs, on_progress, replace)
+        invalidate_knowledge_caches(st.session_state.knowledge_id)
+        st.session_state.upload_report = reports
+        st.session_state.uploader_key += 1
+        rerun_step()
+    
+    if st.session_state.upload_report:
+        reports = st.session_state.upload_report
+        uploaded = sum(1 for report in reports if report["status"] in ("uploaded", "replaced"))
+        duplicates = sum(1 for report in reports if report["status"] == "duplicate")
+        summary = f"Uploaded {uploaded} of {len(reports)} files ({duplicates} duplicates skipped)"
+        if uploaded + duplicates == len(reports):
+            st.success(summary)
+        else:
+            st.warning(summary)
+        st.table(reports)
+    
+    st.button("Proceed to Chat", on_click=go_to, args=("chat",))
+
+# Embeddings: OpenAI when an API key is configured, otherwise the deterministic
+# hashed bag-of-words embedding from local_retrieval that works offline
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+def openai_embedding(texts: List[str], model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Embed texts with the OpenAI embeddings API"""
+    response = get_openai().Embedding.create(model=model, input=texts)
+    return np.array([item["embedding"] for item in response["data"]], dtype=np.float32)
+
+def get_embedder() -> Callable[[List[str]], np.ndarray]:
+    """Return the embedding function for the current configuration"""
+    return openai_embedding if openai_api_key() else local_retrieval.hashing_embedding
+
+# Semantic answer cache in front of /query
+SEMANTIC_CACHE_PATH = "semantic_cache"
+SEMANTIC_CACHE_MAX_ENTRIES = 500
+SEMANTIC_CACHE_TTL = 24 * 60 * 60
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_JOURNAL_MAX = 500
+
+class SemanticCache:
+    """
+    Cache of /query results looked up by cosine similarity of query embeddings.
+    Entries are grouped into namespaces (chatbot, knowledge base and parameters),
+    each holding a normalised embedding matrix so a lookup is one matrix-vector
+    product. Eviction is LRU across namespaces plus a TTL.
+    
+    Persistence is incremental: each store or invalidation appends one record to
+    SEMANTIC_CACHE_PATH.log. After journal_max records, and at exit, the cache is
+    compacted into a snapshot, SEMANTIC_CACHE_PATH.npz (vectors) plus
+    SEMANTIC_CACHE_PATH.json (entries), and the journal starts over. Records carry
+    a sequence number so a journal left behind by a crash mid-compaction is not
+    replayed twice.
+    """
+    def __init__(self, path: Optional[str] = SEMANTIC_CACHE_PATH, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl: float = SEMANTIC_CACHE_TTL, clock: Callable[[], float] = time.time,
+                 journal_max: int = SEMANTIC_CACHE_JOURNAL_MAX):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.journal_max = journal_max
+        self.hits = 0
+        self.misses = 0
+        self._buckets: Dict[str, Dict[str, Any]] = {}
+        self._seq = 0
+        self._journal_records = 0
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def namespace(server_url: str, chatbot_id: Any, knowledge_id: Any, parameters: Dict[str, Any]) -> str:
+        key = json.dumps([server_url, chatbot_id, knowledge_id, parameters], sort_keys=True, default=str)
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return sum(len(bucket["entries"]) for bucket in self._buckets.values())
+
+    def lookup(self, namespace: str, vector: np.ndarray,
+               threshold: float = SEMANTIC_CACHE_THRESHOLD) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return (cached result, similarity) for the closest query above threshold"""
+        with self._lock:
+            self._expire()
+            bucket = self._buckets.get(namespace)
+            if bucket and bucket["vectors"].shape[1] == vector.shape[0]:
+                scores = bucket["vectors"] @ (vector / (np.linalg.norm(vector) or 1.0))
+                best = int(np.argmax(scores))
+                if scores[best] >= threshold:
+                    entry = bucket["entries"][best]
+                    entry["last_used"] = self.clock()
+                    self.hits += 1
+                    return entry["result"], float(scores[best])
+            self.misses += 1
+            return None
+
+    def store(self, namespace: str, knowledge_id: Any, query: str, vector: np.ndarray, result: Dict[str, Any]):
+        with self._lock:
+            now = self.clock()
+            vector = (vector / (np.linalg.norm(vector) or 1.0)).astype(np.float32)
+            self._insert(namespace, str(knowledge_id), query, vector, result, now)
+            self._append({
+                "op": "store", "namespace": namespace, "knowledge_id": str(knowledge_id), "query": query,
+                "vector": base64.b64encode(vector.tobytes()).decode("ascii"), "result": result, "created": now
+            })
+
+    def invalidate_knowledge(self, knowledge_id: Any):
+        """Drop every cached answer drawn from a knowledge base"""
+        with self._lock:
+            if self._drop_knowledge(str(knowledge_id)):
+                logger.info(f"Invalidated semantic cache for knowledge base {knowledge_id}")
+                self._append({"op": "invalidate", "knowledge_id": str(knowledge_id)})
+
+    def flush(self):
+        """Compact pending journal records into the snapshot"""
+        with self._lock:
+            if self._journal_records:
+                self._save()
+
+    def _insert(self, namespace: str, knowledge_id: str, query: str, vector: np.ndarray,
+                result: Dict[str, Any], created: float):
+        bucket = self._buckets.get(namespace)
+        if bucket is None or bucket["vectors"].shape[1] != vector.shape[0]:
+            bucket = {"knowledge_id": knowledge_id, "vectors": np.empty((0, vector.shape[0]), dtype=np.float32), "entries": []}
+            self._buckets[namespace] = bucket
+        bucket["vectors"] = np.vstack([bucket["vectors"], vector[None, :]])
+        bucket["entries"].append({"query": query, "result": result, "created": created, "last_used": created})
+        while len(self) > self.max_entries:
+            self._evict_lru()
+
+    def _drop_knowledge(self, knowledge_id: str) -> bool:
+        # Federated answers are stored under a comma-separated list of knowledge bases
+        stale = [ns for ns, bucket in self._buckets.items() if knowledge_id in bucket["knowledge_id"].split(",")]
+        for ns in stale:
+            del self._buckets[ns]
+        return bool(stale)
+
+    def _remove(self, namespace: str, indices: List[int]):
+        bucket = self._buckets[namespace]
+        keep = np.setdiff1d(np.arange(len(bucket["entries"])), indices)
+        bucket["vectors"] = bucket["vectors"][keep]
+        bucket["entries"] = [bucket["entries"][i] for i in keep]
+        if not bucket["entries"]:
+            del self._buckets[namespace]
+
+    def _expire(self):
+        cutoff = self.clock() - self.ttl
+        for ns in list(self._buckets):
+            expired = [i for i, entry in enumerate(self._buckets[ns]["entries"]) if entry["created"] < cutoff]
+            if expired:
+                self._remove(ns, expired)
+
+    def _evict_lru(self):
+        ns, index = min(
+            ((ns, i) for ns, bucket in self._buckets.items() for i in range(len(bucket["entries"]))),
+            key=lambda item: self._buckets[item[0]]["entries"][item[1]]["last_used"]
+        )
+        self._remove(ns, [index])
+
+    def _append(self, record: Dict[str, Any]):
+        """Journal one change, compacting once journal_max records have accumulated"""
+        if not self.path:
+            return
+        self._seq += 1
+        with open(f"{self.path}.log", "a", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": self._seq, **record}) + "\n")
+        self._journal_records += 1
+        if self._journal_records >= self.journal_max:
+            self._save()
+
+    def _load(self):
+        try:
+            with open(f"{self.path}.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with np.load(f"{self.path}.npz") as arrays:
+                for i, bucket in enumerate(meta["buckets"]):
+                    self._buckets[bucket["namespace"]] = {
+                        "knowledge_id": bucket["knowledge_id"],
+                        "vectors": arrays[f"b{i}"],
+                        "entries": bucket["entries"]
+                    }
+            self._seq = meta.get("seq", 0)
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Ignoring unreadable semantic cache: {str(e)}")
+            self._buckets = {}
+        self._replay()
+
+    def _replay(self):
+        """Apply journal records newer than the snapshot"""
+        try:
+            with open(f"{self.path}.log", "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # A record cut short by a crash
+                    if record["seq"] <= self._seq:
+                        continue
+                    self._seq = record["seq"]
+                    self._journal_records += 1
+                    if record["op"] == "store":
+                        vector = np.frombuffer(base64.b64decode(record["vector"]), dtype=np.float32)
+                        self._insert(record["namespace"], record["knowledge_id"], record["query"],
+                                     vector, record["result"], record["created"])
+                    elif record["op"] == "invalidate":
+                        self._drop_knowledge(record["knowledge_id"])
+        except FileNotFoundError:
+            pass
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable semantic cache journal: {str(e)}")
+
+    def _save(self):
+        """Write a full snapshot and start a new journal"""
+        if not self.path:
+            return
+        buckets = list(self._buckets.items())
+        meta = {"seq": self._seq, "buckets": [
+            {"namespace": ns, "knowledge_id": bucket["knowledge_id"], "entries": bucket["entries"]}
+            for ns, bucket in buckets
+        ]}
+        np.savez(f"{self.path}.tmp.npz", **{f"b{i}": bucket["vectors"] for i, (_, bucket) in enumerate(buckets)})
+        with open(f"{self.path}.tmp.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(f"{self.path}.tmp.npz", f"{self.path}.npz")
+        os.replace(f"{self.path}.tmp.json", f"{self.path}.json")
+        # Records up to seq are in the snapshot, so a crash before this point only
+        # leaves records that the next load skips
+        open(f"{self.path}.log", "w").close()
+        self._journal_records = 0
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """Return the process-wide semantic answer cache"""
+    return SemanticCache()
+
+def invalidate_knowledge_caches(knowledge_id: Any):
+    """Drop cached reads that depend on the documents of a knowledge base"""
+    invalidate_list(f"/documents/list/{knowledge_id}")
+    get_semantic_cache().invalidate_knowledge(knowledge_id)
+
+# Compact /query responses: chunks come back with only these fields, and their
+# content is fetched by chunk_id when the supporting documents are opened
+QUERY_CHUNK_FIELDS = ["chunk_id", "source", "score", "keywords"]
+CHUNK_CONTENT_CACHE_SIZE = 1000
+CHUNK_CONTENT_TTL = 60 * 60
+
+def query_accept_header() -> str:
+    """Prefer msgpack bodies for /query when the optional msgpack package is installed"""
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return "application/json"
+    return "application/msgpack, application/json;q=0.9"
+
+def decode_response(response: requests.Response) -> Any:
+    """Decode a JSON or msgpack response body (gzip is undone by requests)"""
+    if "msgpack" in response.headers.get("Content-Type", ""):
+        import msgpack
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
+
+def fetch_chunk_contents(chunks: List[Dict[str, Any]]) -> Dict[Any, str]:
+    """
+    Return chunk_id -> content for chunks, using content the response already
+    carried, then the session's cache, then one /chunks request for the rest
+    """
+    cache = st.session_state.chunk_contents
+    contents = {}
+    missing = []
+    for chunk in chunks:
+        if chunk.get("content") is not None:
+            contents[chunk["chunk_id"]] = chunk["content"]
+        elif cache.get(chunk["chunk_id"]) is not None:
+            contents[chunk["chunk_id"]] = cache.get(chunk["chunk_id"])
+        else:
+            missing.append(chunk["chunk_id"])
+    if missing:
+        try:
+            logger.info(f"Fetching content of {len(missing)} chunks")
+            response = make_api_request('POST', "/chunks", json={"chunk_ids": missing},
+                                        headers={"Accept": query_accept_header()})
+            for item in decode_response(response).get("chunks", []):
+                cache.set(item["chunk_id"], item["content"])
+                contents[item["chunk_id"]] = item["content"]
+        except Exception as e:
+            logger.error(f"Error fetching chunk content: {str(e)}")
+    return contents
+
+def format_chunk(chunk: Dict[str, Any], content: Optional[str]) -> str:
+    """Markdown for one retrieved chunk"""
+    lines = [f"**Chunk ID:** {chunk['chunk_id']}"]
+    if chunk.get('timestamp'):
+        lines.append(f"**Timestamp:** {chunk['timestamp']}")
+    lines.append(f"**Source:** {chunk['source']}")
+    if chunk.get('knowledge_name'):
+        lines.append(f"**Knowledge base:** {chunk['knowledge_name']}")
+    lines.append(f"**Content:** {content if content is not None else '_(content unavailable)_'}")
+    lines.append(f"**Score:** {chunk['score']:.4f}")
+    if chunk.get('keywords'):
+        lines.append(f"**Keywords:** {', '.join(chunk['keywords'])}")
+    return "  \n".join(lines)
+
+def render_chunks(chunks: List[Dict[str, Any]]):
+    """
+    Render retrieved chunks inside the supporting documents expander. The body only
+    runs while the expander is open, and all chunks go out in one markdown element.
+    """
+    key = "chunks_" + hashlib.sha1(json.dumps([chunk["chunk_id"] for chunk in chunks]).encode("utf-8")).hexdigest()[:12]
+    expander = st.expander(f"View Supporting Documents ({len(chunks)})", key=key, on_change="rerun")
+    with expander:
+        if not expander.open:
+            return
+        contents = fetch_chunk_contents(chunks)
+        st.markdown("\n\n---\n\n".join(format_chunk(chunk, contents.get(chunk["chunk_id"])) for chunk in chunks))
+
+def render_query_result(result: Dict[str, Any]):
+    """Render a complete (non-streamed) /query result"""
+    st.write(f"Timestamp: {result['timestamp']}")
+    st.write("Answer:", result["answer"])
+    render_chunks(result["chunks"])
+
+def iter_query_events(response: requests.Response) -> Iterator[Dict[str, Any]]:
+    """
+    Yield events from a streaming /query response. Accepts both server-sent events
+    ("data: {...}" lines) and newline-delimited JSON bodies.
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or line.startswith((":", "event:", "id:", "retry:")):
+            continue
+        if line.startswith("data:"):
+            line = line[len("data:"):].strip()
+            if line == "[DONE]":
+                return
+        yield json.loads(line)
+
+def stream_query(payload: Dict[str, Any],
+                 transform_chunks: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None
+                 ) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Send a streaming /query and render it incrementally: retrieved chunks as soon as
+    retrieval finishes, then answer tokens as they arrive. Returns the assembled
+    result and whether it was streamed; servers that reply with a plain JSON body
+    are handled as a fallback and left for the caller to render.
+    """
+    start = time.perf_counter()
+    response = make_api_request(
+        'POST',
+        "/query",
+        json={**payload, "stream": True},
+        headers={"Accept": "text/event-stream, application/x-ndjson"},
+        stream=True
     )
+    if response is None:
+        return None, False
+    # Streamed bodies hold the connection until read to the end; close it on every
+    # exit, including early returns and error events
+    with response:
+        if response.status_code != 200:
+            return None, False
+    
+        content_type = response.headers.get("Content-Type", "")
+        if "text/event-stream" not in content_type and "ndjson" not in content_type:
+            logger.info("Server returned a buffered /query response, streaming not supported")
+            return decode_response(response), False
+    
+        result = {"timestamp": None, "answer": "", "chunks": []}
+        timestamp_slot = st.empty()
+        chunks_slot = st.empty()
+        answer_slot = st.empty()
+        first_token_at = None
     
-    if uploaded_files:
-        for file in uploaded_files:
+        for event in iter_query_events(response):
+            event_type = event.get("type")
+            if event_type == "chunks":
+                result["chunks"] = event.get("chunks", [])
+                if transform_chunks:
+                    result["chunks"] = transform_chunks(result["chunks"])
+                logger.info(f"Received {len(result['chunks'])} chunks after {time.perf_counter() - start:.3f}s")
+                with chunks_slot.container():
+                    render_chunks(result["chunks"])
+            elif event_type == "token":
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    logger.info(f"Time to first token for /query: {first_token_at - start:.3f}s")
+                result["answer"] += event.get("content", "")
+                answer_slot.markdown(f"**Answer:** {result['answer']}▌")
+            elif event_type == "done":
+                result["timestamp"] = event.get("timestamp")
+                result["answer"] = event.get("answer", result["answer"])
+            elif event_type == "error":
+                raise RuntimeError(event.get("detail", "Streaming query failed"))
+    
+        answer_slot.markdown(f"**Answer:** {result['answer']}")
+        if result["timestamp"]:
+            timestamp_slot.write(f"Timestamp: {result['timestamp']}")
+        logger.info(f"Streamed /query completed in {time.perf_counter() - start:.3f}s")
+        return result, True
+
+# Local retrieval: the engine lives in local_retrieval.py and is imported on first
+# use. Sessions may only index directories inside the corpus root (LOCAL_CORPUS_DIR,
+# or the local_corpus_dir secret)
+LOCAL_CORPUS_DIR = "corpus"
+CHAT_MODEL = "gpt-3.5-turbo"
+
+
+def local_corpus_root() -> str:
+    return os.path.realpath(get_secrets().get("local_corpus_dir") or LOCAL_CORPUS_DIR)
+
+def resolve_corpus_dir(path: str) -> str:
+    """Resolve a corpus directory relative to the corpus root, raising ValueError outside it"""
+    root = local_corpus_root()
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Local corpus must be inside {root}")
+    if not os.path.isdir(resolved):
+        raise ValueError(f"Local corpus directory {resolved} does not exist")
+    return resolved
+
+@st.cache_resource
+def get_local_retriever(corpus_dir: str) -> local_retrieval.LocalRetriever:
+    """Return the process-wide local retriever for a corpus; chunk overlap is applied per search"""
+    return local_retrieval.LocalRetriever(corpus_dir).load_or_build()
+
+def rebuild_local_retriever(corpus_dir: str) -> local_retrieval.LocalRetriever:
+    """
+    Re-check the corpus and replace the cached retriever. Unchanged pages are
+    reused from checkpoints and the embedding cache; sessions still holding the
+    old retriever keep searching it until their next lookup.
+    """
+    get_local_retriever.clear(corpus_dir)
+    return get_local_retriever(corpus_dir)
+
+# Conversation memory: recent turns are sent verbatim under a token budget and older
+# turns are folded into a rolling summary, so the prompt stays flat as a chat grows
+CONVERSATION_TOKEN_BUDGET = 1500
+SUMMARY_BUDGET_SHARE = 0.3
+SUMMARY_TURN_WORDS = 40
+# Follow-up questions lean on earlier turns, so their cached answers are only
+# reused within the same conversation; standalone questions share the cache
+FOLLOW_UP_WORDS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their", "he", "she", "him", "her",
+    "previous", "earlier", "same", "also", "else", "again", "more"
+}
+FOLLOW_UP_PHRASES = ("the above", "you said", "you mentioned")
+FOLLOW_UP_MAX_WORDS = 3
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)"""
+    return len(text) // 4 + 1
+
+def turn_tokens(turn: Dict[str, str]) -> int:
+    return estimate_tokens(turn["query"]) + estimate_tokens(turn["answer"])
+
+def new_conversation() -> Dict[str, Any]:
+    return {"summary": "", "summary_id": None, "folded_turns": 0}
+
+def summarize_turns(summary: str, turns: List[Dict[str, str]], max_tokens: int) -> str:
+    """
+    Fold turns into the running summary. Only the new turns are processed: with an
+    OpenAI key the model rewrites the summary to include them, otherwise one
+    extractive line per turn is appended and the oldest lines are dropped to fit.
+    """
+    if openai_api_key():
+        transcript = "\n".join(f"User: {turn['query']}\nAssistant: {turn['answer']}" for turn in turns)
+        response = get_openai().ChatCompletion.create(
+            model=CHAT_MODEL,
+            temperature=0,
+            max_tokens=max_tokens,
+            messages=[
+                {"role": "system", "content": "Update the conversation summary with the new turns. "
+                                              "Keep facts, entities and open questions; be brief."},
+                {"role": "user", "content": f"Summary so far:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}"}
+            ]
+        )
+        return response["choices"][0]["message"]["content"].strip()
+    
+    lines = summary.splitlines()
+    for turn in turns:
+        answer = " ".join(turn["answer"].split()[:SUMMARY_TURN_WORDS])
+        lines.append(f"- Asked: {turn['query']} Answered: {answer}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def remember_turn(query: str, answer: str, budget: int):
+    """
+    Add a finished turn to the session's conversation and fold the oldest turns
+    into the summary once the verbatim turns exceed their share of the budget
+    """
+    history = st.session_state.chat_history
+    history.append({"query": query, "answer": answer})
+    conversation = st.session_state.conversation
+    summary_budget = int(budget * SUMMARY_BUDGET_SHARE)
+    recent_budget = budget - summary_budget
+    keep = 0
+    used = 0
+    for turn in reversed(history):
+        used += turn_tokens(turn)
+        if used > recent_budget:
+            break
+        keep += 1
+    folded = history[:len(history) - keep]
+    if folded:
+        start = time.perf_counter()
+        conversation["summary"] = summarize_turns(conversation["summary"], folded, summary_budget)
+        conversation["summary_id"] = hashlib.sha256(conversation["summary"].encode("utf-8")).hexdigest()[:16]
+        conversation["folded_turns"] += len(folded)
+        del history[:len(folded)]
+        logger.info(f"Folded {len(folded)} turns into the conversation summary in {time.perf_counter() - start:.3f}s")
+
+def conversation_context(budget: int) -> Dict[str, Any]:
+    """
+    Payload fields carrying the conversation so far: the summary, the recent turns
+    as chat messages and a context_id hashing both, which stays the same while the
+    prefix is unchanged so the server and the semantic cache can key on it
+    """
+    if budget <= 0:
+        return {}
+    conversation = st.session_state.conversation
+    messages = []
+    for turn in st.session_state.chat_history:
+        messages.append({"role": "user", "content": turn["query"]})
+        messages.append({"role": "assistant", "content": turn["answer"]})
+    if not messages and not conversation["summary"]:
+        return {}
+    context_id = hashlib.sha256(
+        json.dumps([conversation["summary_id"], messages]).encode("utf-8")
+    ).hexdigest()[:16]
+    return {
+        "chat_history": messages,
+        "conversation_summary": conversation["summary"],
+        "context_id": context_id
+    }
+
+def is_follow_up(query: str) -> bool:
+    """Whether a query refers back to the conversation (pronouns, "the above", very short questions)"""
+    words = re.findall(r"[a-z']+", query.lower())
+    return (len(words) <= FOLLOW_UP_MAX_WORDS or any(word in FOLLOW_UP_WORDS for word in words)
+            or any(phrase in " ".join(words) for phrase in FOLLOW_UP_PHRASES))
+
+def cache_context_id(query: str, payload: Dict[str, Any]) -> Optional[str]:
+    """
+    The conversation key for a query's semantic cache namespace: the context_id
+    for follow-ups sent with a conversation prefix, None for standalone questions
+    so their answers are shared across conversations
+    """
+    if payload.get("context_id") and is_follow_up(query):
+        return payload["context_id"]
+    return None
+
+def payload_messages(payload: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Chat messages for the conversation fields of a /query payload"""
+    messages = []
+    if payload.get("conversation_summary"):
+        messages.append({"role": "system", "content": f"Earlier in this conversation:\n{payload['conversation_summary']}"})
+    return messages + payload.get("chat_history", [])
+
+def generate_answer(query: str, chunks: List[Dict[str, Any]], temperature: float,
+                    conversation: Optional[List[Dict[str, str]]] = None) -> str:
+    """
+    Answer a query from retrieved chunks with the OpenAI chat API, or return the
+    best matching passage when no API key is configured
+    """
+    if not chunks:
+        return "No relevant passages found in the local corpus."
+    if not openai_api_key():
+        return f"(offline mode, best matching passage from {chunks[0]['source']}) {chunks[0]['content']}"
+    context = "\n\n".join(f"[{chunk['source']}] {chunk['content']}" for chunk in chunks)
+    response = get_openai().ChatCompletion.create(
+        model=CHAT_MODEL,
+        temperature=temperature,
+        messages=[
+            {"role": "system", "content": "Answer the question using only the provided context."},
+            *(conversation or []),
+            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
+        ]
+    )
+    return response["choices"][0]["message"]["content"]
+
+def local_query(retriever: local_retrieval.LocalRetriever, payload: Dict[str, Any], parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer a /query payload in-process, returning the same shape as the server"""
+    start = time.perf_counter()
+    chunks = retriever.search(
+        payload["query"],
+        k=int(parameters["k"]),
+        keywords=payload.get("keywords"),
+        rerank_method=parameters["rerank_method"],
+        chunk_overlap=int(parameters["chunk_overlap"])
+    )
+    result = {
+        "timestamp": datetime.now().isoformat(),
+        "answer": generate_answer(payload["query"], chunks, parameters["temperature"], payload_messages(payload)),
+        "chunks": chunks
+    }
+    logger.info(f"Local query answered in {time.perf_counter() - start:.3f}s")
+    return result
+
+# Chat parameters travel with each /query as a versioned profile. The server caches
+# profiles by content hash, so once it holds a profile the payload only carries its ID
+PROFILE_ID_LENGTH = 16
+PROFILE_UNKNOWN_STATUS = 409
+
+def parameter_profile(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the session's parameter profile, bumping its version when the parameters change"""
+    server_parameters = {
+        "temperature": parameters["temperature"],
+        "k": int(parameters["k"]),
+        "chunk_overlap": int(parameters["chunk_overlap"]),
+        # Hybrid fusion is applied client-side on top of the server's similarity ranking
+        "rerank_method": "similarity" if parameters["rerank_method"] == "hybrid" else parameters["rerank_method"]
+    }
+    profile_id = hashlib.sha256(json.dumps(server_parameters, sort_keys=True).encode("utf-8")).hexdigest()[:PROFILE_ID_LENGTH]
+    profile = st.session_state.parameter_profile
+    if profile is None or profile["profile_id"] != profile_id:
+        profile = {
+            "profile_id": profile_id,
+            "version": profile["version"] + 1 if profile else 1,
+            "parameters": server_parameters
+        }
+        st.session_state.parameter_profile = profile
+        logger.info(f"Parameter profile {profile_id} is now version {profile['version']}")
+    return profile
+
+class ProfileRegistry:
+    """Parameter profile IDs each server has already received, shared across sessions"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sent = set()
+
+    def known(self, server_url: str, profile_id: str) -> bool:
+        with self._lock:
+            return (server_url, profile_id) in self._sent
+
+    def add(self, server_url: str, profile_id: str):
+        with self._lock:
+            self._sent.add((server_url, profile_id))
+
+    def forget(self, server_url: str, profile_id: str):
+        with self._lock:
+            self._sent.discard((server_url, profile_id))
+
+@st.cache_resource
+def get_profile_registry() -> ProfileRegistry:
+    return ProfileRegistry()
+
+def attach_profile(payload: Dict[str, Any], profile: Dict[str, Any], server_url: str) -> Dict[str, Any]:
+    """Add the profile ID to a /query payload, or the full profile if the server may not hold it yet"""
+    if get_profile_registry().known(server_url, profile["profile_id"]):
+        return {**payload, "profile_id": profile["profile_id"]}
+    return {**payload, "parameter_profile": profile}
+
+def send_with_profile(send: Callable[[Dict[str, Any]], Any], payload: Dict[str, Any],
+                      profile: Dict[str, Any], server_url: str) -> Any:
+    """
+    Send a /query carrying the session's parameter profile. If the server answers
+    409 to a bare profile ID (it evicted or never stored it), the full profile is
+    sent once more.
+    """
+    registry = get_profile_registry()
+    compact = registry.known(server_url, profile["profile_id"])
+    try:
+        result = send(attach_profile(payload, profile, server_url))
+    except HTTPError as e:
+        if not compact or e.response is None or e.response.status_code != PROFILE_UNKNOWN_STATUS:
+            raise
+        logger.info(f"Server no longer holds parameter profile {profile['profile_id']}, sending it in full")
+        registry.forget(server_url, profile["profile_id"])
+        result = send(attach_profile(payload, profile, server_url))
+    registry.add(server_url, profile["profile_id"])
+    return result
+
+# Federated queries fan /query out to several knowledge bases on a bounded pool
+FEDERATED_WORKERS = 4
+
+def merge_shard_chunks(shards: List[Tuple[Any, List[Dict[str, Any]]]], k: int,
+                       knowledge_names: Dict[Any, str]) -> List[Dict[str, Any]]:
+    """
+    Merge per-knowledge-base chunk lists into one top-k list. Each base scores on
+    its own scale, so scores are turned into z-scores per base before merging: a
+    chunk ranks by how far it stands out from the rest of its own base, and a base
+    whose results are all alike (or that returned a single chunk) scores 0 rather
+    than claiming the top spot. The server's score is kept as raw_score; ties keep
+    the order within each base and then the order of shards.
+    """
+    merged = []
+    for knowledge_id, chunks in shards:
+        scores = [chunk["score"] for chunk in chunks]
+        mean = sum(scores) / len(scores) if scores else 0.0
+        std = math.sqrt(sum((score - mean) ** 2 for score in scores) / len(scores)) if scores else 0.0
+        for rank, chunk in enumerate(chunks):
+            merged.append({
+                **chunk,
+                "knowledge_id": knowledge_id,
+                "knowledge_name": knowledge_names.get(knowledge_id, str(knowledge_id)),
+                "raw_score": chunk["score"],
+                "score": (chunk["score"] - mean) / std if std > 0 else 0.0,
+                "rank": rank
+            })
+    merged.sort(key=lambda chunk: (-chunk["score"], chunk["rank"]))
+    return [{key: value for key, value in chunk.items() if key != "rank"} for chunk in merged[:k]]
+
+def federated_query(payload: Dict[str, Any], knowledge_ids: List[Any], profile: Dict[str, Any],
+                    server_url: str, knowledge_names: Dict[Any, str]) -> Dict[str, Any]:
+    """
+    Send a /query to each knowledge base in parallel and combine the results, so
+    latency follows the slowest base rather than the sum. The answer is generated
+    from the merged chunks when an OpenAI key is configured, otherwise the answer of
+    the base that owns the top merged chunk is used. Bases that fail are reported in
+    "failed" unless all of them do.
+    """
+    start = time.perf_counter()
+
+    def query_shard(knowledge_id: Any) -> Tuple[Any, Dict[str, Any], float]:
+        shard_start = time.perf_counter()
+        response = send_with_profile(
+            lambda body: make_api_request('POST', "/query", server_url=server_url, json=body,
+                                          headers={"Accept": query_accept_header()}),
+            {**payload, "knowledge_id": knowledge_id}, profile, server_url
+        )
+        return knowledge_id, decode_response(response), time.perf_counter() - shard_start
+
+    shards = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(FEDERATED_WORKERS, len(knowledge_ids))) as pool:
+        futures = {pool.submit(query_shard, knowledge_id): knowledge_id for knowledge_id in knowledge_ids}
+        for future in as_completed(futures):
             try:
-                logger.info(f"Attempting to upload file: {file.name}")
-                files = {"file": (file.name, file.getvalue(), "application/octet-stream")}
-                response = make_api_request(
-                    'POST',
-                    f"/documents/upload/{st.session_state.knowledge_id}",
-                    files=files
-                )
-                if response and response.status_code == 200:
-                    logger.info(f"File uploaded successfully: {file.name}")
-                    st.success(f"File {file.name} uploaded successfully!")
-                    st.rerun()
-                else:
-                    logger.error(f"Error uploading file: {file.name}")
-                    st.error(f"Error uploading {file.name}: {response.json().get('detail', 'Unknown error')}")
+                shards.append(future.result())
             except Exception as e:
-                logger.error(f"Error uploading file {file.name}: {str(e)}")
-                st.error(f"Error uploading {file.name}: {str(e)}")
+                logger.error(f"Query to knowledge base {futures[future]} failed: {str(e)}")
+                failed.append(futures[future])
+    if not shards:
+        raise RuntimeError("None of the selected knowledge bases answered")
+    shards.sort(key=lambda shard: knowledge_ids.index(shard[0]))
     
-    if st.button("Proceed to Chat"):
-        logger.info("Proceeding to chat interface")
-        st.session_state.step = "chat"
-        st.rerun()
+    parameters = profile["parameters"]
+    chunks = merge_shard_chunks([(knowledge_id, result.get("chunks", [])) for knowledge_id, result, _ in shards],
+                                parameters["k"], knowledge_names)
+    if openai_api_key():
+        answer = generate_answer(payload["query"], chunks, parameters["temperature"], payload_messages(payload))
+    else:
+        best_id = chunks[0]["knowledge_id"] if chunks else shards[0][0]
+        answer = next(result for knowledge_id, result, _ in shards if knowledge_id == best_id).get("answer", "")
+    logger.info(
+        f"Federated query over {len(shards)} knowledge bases in {time.perf_counter() - start:.3f}s "
+        f"(slowest {max(seconds for _, _, seconds in shards):.3f}s)"
+    )
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "answer": answer,
+        "chunks": chunks,
+        "shards": [
+            {"knowledge_id": knowledge_id, "chunks": len(result.get("chunks", [])), "seconds": round(seconds, 3)}
+            for knowledge_id, result, seconds in shards
+        ],
+        "failed": failed
+    }
+
+def run_query(payload: Dict[str, Any], stream_answers: bool, parameters: Dict[str, Any],
+              local_retriever: Optional[local_retrieval.LocalRetriever] = None, knowledge_ids: Optional[List[Any]] = None,
+              knowledge_names: Optional[Dict[Any, str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Send a query to the server (or the local engine), render the answer and return
+    the result. With more than one knowledge_id the query is federated.
+    """
+    st.session_state.history_page = None  # The server appends this query to /history
+    if local_retriever is not None:
+        result = local_query(local_retriever, payload, parameters)
+        render_query_result(result)
+        return result
+    
+    transform_chunks = None
+    chunk_fields = list(QUERY_CHUNK_FIELDS)
+    federated = bool(knowledge_ids and len(knowledge_ids) > 1)
+    if parameters["rerank_method"] == "hybrid":
+        transform_chunks = lambda chunks: local_retrieval.hybrid_rerank(chunks, payload["query"], payload.get("keywords"))
+    # Hybrid reranking and answers generated client-side need the chunk text up front
+    if transform_chunks or (federated and openai_api_key()):
+        chunk_fields.append("content")
+    payload = {**payload, "chunk_fields": chunk_fields}
+    
+    profile = parameter_profile(parameters)
+    if federated:
+        with st.spinner(f"Querying {len(knowledge_ids)} knowledge bases..."):
+            result = federated_query(payload, knowledge_ids, profile, st.session_state.server_url, knowledge_names or {})
+        if transform_chunks:
+            result["chunks"] = transform_chunks(result["chunks"])
+        names = knowledge_names or {}
+        st.caption(" · ".join(
+            f"{names.get(shard['knowledge_id'], shard['knowledge_id'])}: {shard['chunks']} chunks in {shard['seconds']:.2f}s"
+            for shard in result["shards"]
+        ))
+        if result["failed"]:
+            st.warning(f"No answer from: {', '.join(str(names.get(kid, kid)) for kid in result['failed'])}")
+        render_query_result(result)
+        return result
+    
+    if stream_answers:
+        result, streamed = send_with_profile(
+            lambda body: stream_query(body, transform_chunks), payload, profile, st.session_state.server_url
+        )
+        if result and not streamed:
+            if transform_chunks:
+                result["chunks"] = transform_chunks(result["chunks"])
+            render_query_result(result)
+        return result
+    
+    response = send_with_profile(
+        lambda body: make_api_request('POST', "/query", json=body, headers={"Accept": query_accept_header()}),
+        payload, profile, st.session_state.server_url
+    )
+    if response and response.status_code == 200:
+        result = decode_response(response)
+        if transform_chunks:
+            result["chunks"] = transform_chunks(result["chunks"])
+        render_query_result(result)
+        return result
+    return None
+
+# Chat history is read in pages of HISTORY_PAGE_SIZE entries
+HISTORY_PAGE_SIZE = 20
+
+def request_history(cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE,
+                    server_url: Optional[str] = None) -> Any:
+    """
+    Request one page of /history. Servers with cursor pagination answer
+    {"items": [...], "next_cursor": ...}; older servers ignore the parameters
+    and return the whole history as a list.
+    """
+    params = {"limit": limit}
+    if cursor is not None:
+        params["cursor"] = cursor
+    response = make_api_request('GET', "/history", server_url=server_url, params=params)
+    if response and response.status_code == 200:
+        return response.json()
+    return []
+
+def fetch_history_page(cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE,
+                       snapshot: Optional[List[Dict[str, Any]]] = None, server_url: Optional[str] = None
+                       ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[List[Dict[str, Any]]]]:
+    """
+    Return (entries, next cursor, snapshot) for a history page. Servers without
+    pagination send their whole history; it comes back as snapshot, and passing it
+    in for the following pages slices them by offset without downloading it again.
+    """
+    data = snapshot
+    if data is None:
+        data = request_history(cursor, limit, server_url)
+        if isinstance(data, dict):
+            return data.get("items", []), data.get("next_cursor"), None
+    offset = int(cursor or 0)
+    next_offset = offset + limit
+    return data[offset:next_offset], str(next_offset) if next_offset < len(data) else None, data
+
+def iter_history(limit: int = HISTORY_PAGE_SIZE, server_url: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield every history entry, one page in memory at a time"""
+    cursor = None
+    while True:
+        data = request_history(cursor, limit, server_url)
+        if not isinstance(data, dict):
+            # Server without pagination: it already sent everything
+            yield from data
+            return
+        yield from data.get("items", [])
+        cursor = data.get("next_cursor")
+        if not cursor:
+            return
+
+def export_history_ndjson(server_url: str) -> bytes:
+    """
+    Encode the full history as NDJSON, fetching it page by page. Runs as a deferred
+    download, only when the button is clicked and outside the script thread, so
+    server_url is passed in. Only one page of decoded entries is alive at a time,
+    but the encoded export is held in memory: Streamlit keeps download contents in
+    memory and cannot serve them from a stream.
+    """
+    logger.info("Exporting chat history")
+    count = 0
+    buffer = io.BytesIO()
+    for entry in iter_history(server_url=server_url):
+        buffer.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+        count += 1
+    logger.info(f"Chat history exported ({count} entries, {buffer.tell()} bytes)")
+    return buffer.getvalue()
+
+def show_history_viewer():
+    """
+    Render one page of history at a time. Referenced chunks of an entry are only
+    rendered once the user asks for them. A full-list server's history is kept
+    with the page until history_page is reset, e.g. by a new query.
+    """
+    cursor = st.session_state.history_cursors[-1]
+    page = st.session_state.history_page
+    if page is None or page["cursor"] != cursor:
+        items, next_cursor, snapshot = fetch_history_page(cursor, snapshot=page["snapshot"] if page else None)
+        page = {"cursor": cursor, "items": items, "next_cursor": next_cursor, "snapshot": snapshot}
+        st.session_state.history_page = page
+    
+    page_number = len(st.session_state.history_cursors)
+    if not page["items"]:
+        st.info("No history yet")
+    for i, entry in enumerate(page["items"]):
+        with st.expander(f"Query: {entry['query'][:100]}..."):
+            st.write(f"**Timestamp:** {entry['timestamp']}")
+            st.write(f"**Query:** {entry['query']}")
+            st.write(f"**Answer:** {entry['answer']}")
+            
+            # Display chunks summary on demand
+            chunks = entry.get('chunks') or []
+            if chunks and st.checkbox(f"Show {len(chunks)} referenced chunks", key=f"history_chunks_{page_number}_{i}"):
+                st.write("**Referenced Chunks:**")
+                st.markdown("\n".join(
+                    f"- Chunk ID: {chunk['chunk_id']} · Source: {chunk['source']} · "
+                    f"Score: {chunk['score']:.4f} · Keywords: {', '.join(chunk.get('keywords', []))}"
+                    for chunk in chunks
+                ))
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if page_number > 1 and st.button("◀ Previous Page"):
+            st.session_state.history_cursors.pop()
+            st.rerun()
+    with col2:
+        if page["next_cursor"] and st.button("Next Page ▶"):
+            st.session_state.history_cursors.append(page["next_cursor"])
+            st.rerun()
 
+@timed_render("chat_interface")
 def show_chat_interface():
     st.title("Chat Interface")
     logger.info("Displaying chat interface")
     
+    knowledge_names = {}
+    if st.session_state.user_id and st.session_state.chatbot_id:
+        try:
+            chatbots_endpoint = f"/chatbots/list/{st.session_state.user_id}"
+            knowledge_endpoint = f"/knowledge/list/{st.session_state.chatbot_id}"
+            lists = fetch_lists([chatbots_endpoint, knowledge_endpoint])
+            chatbot = next((c for c in lists[chatbots_endpoint] if c["chatbot_id"] == st.session_state.chatbot_id), None)
+            knowledge_names = {kb["knowledge_id"]: kb["knowledge_name"] for kb in lists[knowledge_endpoint]}
+            knowledge_base = next(
+                (kb for kb in lists[knowledge_endpoint] if kb["knowledge_id"] == st.session_state.knowledge_id),
+                None
+            )
+            if chatbot and knowledge_base:
+                st.caption(f"Chatbot: {chatbot['chatbot_name']} · Knowledge base: {knowledge_base['knowledge_name']}")
+        except Exception as e:
+            logger.error(f"Error fetching chat context: {str(e)}")
+    
     # Parameter Configuration
     with st.sidebar:
         st.header("Chat Parameters")
         temperature = st.slider("Temperature", 0.0, 1.0, 0.5)
         k = st.number_input("Top-k", 1, 50, 10)
         chunk_overlap = st.number_input("Chunk Overlap", 0, 100, 30)
-        rerank_method = st.selectbox("Rerank Method", ["similarity", "keyword"])
+        rerank_method = st.selectbox("Rerank Method", ["similarity", "keyword", "hybrid"])
+        knowledge_ids = [st.session_state.knowledge_id]
+        if len(knowledge_names) > 1:
+            knowledge_ids = st.multiselect(
+                "Knowledge bases",
+                options=list(knowledge_names),
+                default=[kid for kid in knowledge_ids if kid in knowledge_names],
+                format_func=lambda kid: knowledge_names[kid],
+                help="Select several to query them in parallel and merge the results"
+            ) or knowledge_ids
         
         # Add keyword input
         keywords = st.text_input("Keywords (comma-separated)", "")
         keyword_list = [k.strip() for k in keywords.split(",")] if keywords else None
-        
-        if st.button("Update Parameters"):
+        stream_answers = st.checkbox("Stream answers", value=True)
+        use_local_retrieval = st.checkbox("Local retrieval (offline)", value=False)
+        local_corpus_dir = None
+        if use_local_retrieval:
+            corpus_subdir = st.text_input("Local corpus directory", "", help=f"Relative to {local_corpus_root()}")
             try:
-                logger.info("Updating chat parameters")
-                response = make_api_request(
-                    'POST',
-                    "/set-parameters",
-                    json={
-                        "temperature": temperature,
-                        "k": k,
-                        "chunk_overlap": chunk_overlap,
-                        "rerank_method": rerank_method
-                    }
-                )
-                if response and response.status_code == 200:
-                    logger.info("Chat parameters updated successfully")
-                    st.success("Parameters updated!")
-            except Exception as e:
-                logger.error(f"Error updating parameters: {str(e)}")
-                st.error(f"Error: {str(e)}")
+                local_corpus_dir = resolve_corpus_dir(corpus_subdir)
+            except ValueError as e:
+                logger.warning(f"Rejected local corpus directory {corpus_subdir!r}: {str(e)}")
+                st.error(str(e))
+                use_local_retrieval = False
+        if use_local_retrieval:
+            if st.button("Build Local Index"):
+                with st.spinner("Ingesting local corpus..."):
+                    retriever = rebuild_local_retriever(local_corpus_dir)
+                st.success(f"Indexed {len(retriever.chunks)} chunks")
+                if retriever.ingest_reports:
+                    st.dataframe(retriever.ingest_reports)
+        use_semantic_cache = st.checkbox("Use semantic answer cache", value=True)
+        cache_threshold = st.slider("Cache similarity threshold", 0.80, 1.0, SEMANTIC_CACHE_THRESHOLD, 0.01)
+        if use_semantic_cache:
+            cache = get_semantic_cache()
+            st.caption(
+                f"Semantic cache: {len(cache)} entries, {cache.hits} hits / {cache.misses} misses "
+                f"({cache.hit_rate:.1%} hit rate)"
+            )
+        
+        memory_budget = st.number_input(
+            "Conversation memory (tokens)", 0, 8000, CONVERSATION_TOKEN_BUDGET, 250,
+            help="Budget for earlier turns sent with each query; 0 makes every query stand alone. "
+                 "Standalone questions share the semantic cache across conversations; follow-ups "
+                 "that refer to earlier turns are only answered from cache within this conversation."
+        )
+        conversation = st.session_state.conversation
+        if st.session_state.chat_history or conversation["summary"]:
+            context = conversation_context(memory_budget)
+            st.caption(
+                f"Memory: {len(st.session_state.chat_history)} recent turns, "
+                f"{conversation['folded_turns']} summarized (~{estimate_tokens(json.dumps(context))} tokens per query)"
+            )
+            if st.button("New Conversation"):
+                st.session_state.chat_history = []
+                st.session_state.conversation = new_conversation()
+                st.session_state.last_query = None
+                st.session_state.last_result = None
+                st.rerun()
+        
+        # Parameters are sent with each query, so changes apply to this session only
+        profile = parameter_profile({
+            "temperature": temperature,
+            "k": k,
+            "chunk_overlap": chunk_overlap,
+            "rerank_method": rerank_method
+        })
+        st.caption(f"Parameter profile v{profile['version']} ({profile['profile_id']})")
     
     # Chat Interface
     st.subheader("Chat")
     user_input = st.text_input("Your message:")
+    send_clicked = st.button("Send")
     
-    if st.button("Send") or (user_input and user_input.strip()):
+    # The text input keeps its value across reruns; only a new message or Send asks again
+    if user_input.strip() and not send_clicked and user_input == st.session_state.last_query:
+        if st.session_state.last_result:
+            render_query_result(st.session_state.last_result)
+    elif send_clicked or (user_input and user_input.strip()):
         if user_input.strip():
             try:
-                response = make_api_request(
-                    'POST',
-                    "/query",
-                    json={
-                        "query": user_input,
-                        "chatbot_id": st.session_state.chatbot_id,
-                        "knowledge_id": st.session_state.knowledge_id,
-                        "keywords": keyword_list
-                    }
-                )
+                payload = {
+                    "query": user_input,
+                    "chatbot_id": st.session_state.chatbot_id,
+                    "knowledge_id": knowledge_ids[0],
+                    "keywords": keyword_list,
+                    **conversation_context(memory_budget)
+                }
                 
-                if response and response.status_code == 200:
-                    result = response.json()
-                    st.write(f"Timestamp: {result['timestamp']}")
-                    st.write("Answer:", result["answer"])
+                parameters = {
+                    "temperature": temperature,
+                    "k": k,
+                    "chunk_overlap": chunk_overlap,
+                    "rerank_method": rerank_method
+                }
+                local_retriever = None
+                if use_local_retrieval:
+                    with st.spinner("Loading local index..."):
+                        local_retriever = get_local_retriever(local_corpus_dir)
+                
+                result = None
+                if not use_semantic_cache:
+                    result = run_query(payload, stream_answers, parameters, local_retriever, knowledge_ids, knowledge_names)
+                else:
+                    cache = get_semantic_cache()
+                    namespace = SemanticCache.namespace(
+                        "local" if local_retriever else st.session_state.server_url,
+                        st.session_state.chatbot_id,
+                        local_corpus_dir if local_retriever else (knowledge_ids if len(knowledge_ids) > 1 else knowledge_ids[0]),
+                        {**parameters, "keywords": keyword_list, "context_id": cache_context_id(user_input, payload)}
+                    )
+                    if cache_context_id(user_input, payload):
+                        st.caption("Follow-up question: cached answers are only reused within this conversation")
+                    try:
+                        query_vector = get_embedder()([user_input])[0]
+                    except Exception as e:
+                        logger.warning(f"Query embedding failed, bypassing semantic cache: {str(e)}")
+                        query_vector = None
                     
-                    with st.expander("View Supporting Documents"):
-                        for chunk in result["chunks"]:
-                            st.markdown(f"**Chunk ID:** {chunk['chunk_id']}")
-                            st.markdown(f"**Timestamp:** {chunk['timestamp']}")
-                            st.markdown(f"**Source:** {chunk['source']}")
-                            st.markdown(f"**Content:** {chunk['content']}")
-                            st.markdown(f"**Score:** {chunk['score']:.4f}")
-                            if chunk.get('keywords'):
-                                st.markdown(f"**Keywords:** {', '.join(chunk['keywords'])}")
-                            st.markdown("---")
+                    cached = cache.lookup(namespace, query_vector, cache_threshold) if query_vector is not None else None
+                    if cached:
+                        result, similarity = cached
+                        logger.info(f"Semantic cache hit (similarity {similarity:.3f}, hit rate {cache.hit_rate:.1%})")
+                        st.caption(f"Answered from cache (similarity {similarity:.3f})")
+                        render_query_result(result)
+                    else:
+                        result = run_query(payload, stream_answers, parameters, local_retriever,
+                                           knowledge_ids, knowledge_names)
+                        if result and query_vector is not None:
+                            cache.store(namespace, ",".join(map(str, knowledge_ids)), user_input, query_vector, result)
+                
+                st.session_state.last_query = user_input
+                st.session_state.last_result = result
+                if result and memory_budget > 0:
+                    remember_turn(user_input, result["answer"], memory_budget)
+            except RetryLaterError as e:
+                logger.warning(f"Query deferred by the server for {e.retry_after:.0f}s")
+                st.warning(f"The server is busy. Try again in {math.ceil(e.retry_after)}s.")
             except Exception as e:
                 logger.error(f"Error processing query: {str(e)}")
                 st.error(f"Error: {str(e)}")
 
     # History Display
-    if st.button("View History"):
+    if st.button("Hide History" if st.session_state.show_history else "View History"):
+        st.session_state.show_history = not st.session_state.show_history
+        st.session_state.history_cursors = [None]
+        st.session_state.history_page = None
+        st.rerun()
+    
+    if st.session_state.show_history:
         try:
-            response = make_api_request('GET', "/history")
-            if response and response.status_code == 200:
-                history = response.json()
-                for entry in history:
-                    with st.expander(f"Query: {entry['query'][:100]}..."):
-                        st.write(f"**Timestamp:** {entry['timestamp']}")
-                        st.write(f"**Query:** {entry['query']}")
-                        st.write(f"**Answer:** {entry['answer']}")
-                        
-                        # Display chunks summary
-                        if 'chunks' in entry:
-                            st.write("**Referenced Chunks:**")
-                            for chunk in entry['chunks']:
-                                st.markdown(
-                                    f"""
-                                    - Chunk ID: {chunk['chunk_id']}
-                                    - Source: {chunk['source']}
-                                    - Score: {chunk['score']:.4f}
-                                    - Keywords: {', '.join(chunk.get('keywords', []))}
-                                    """
-                                )
-                        st.markdown("---")
+            show_history_viewer()
         except Exception as e:
             logger.error(f"Error viewing history: {str(e)}")
             st.error(f"Error: {str(e)}")
@@ -552,85 +2980,391 @@ def show_chat_interface():
                 response = make_api_request('POST', "/clear-history")
                 if response and response.status_code == 200:
                     logger.info("Chat history cleared successfully")
+                    st.session_state.history_cursors = [None]
+                    st.session_state.history_page = None
                     st.success("History cleared!")
             except Exception as e:
                 logger.error(f"Error clearing history: {str(e)}")
                 st.error(f"Error: {str(e)}")
     
     with col2:
-        if st.button("Download History"):
+        st.download_button(
+            "Download History",
+            data=functools.partial(export_history_ndjson, st.session_state.server_url),
+            file_name=f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson",
+            mime="application/x-ndjson",
+            on_click="ignore"
+        )
+
+def show_diagnostics():
+    """Sidebar panel with request latency, retries, payload sizes and render times"""
+    # The tables load pandas, so the panel only renders when asked for
+    if not st.sidebar.toggle("Show diagnostics", value=False):
+        return
+    metrics = get_metrics()
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        st.caption("API requests")
+        st.dataframe(metrics.request_rows(), hide_index=True)
+        st.caption("Page renders and reruns")
+        st.dataframe(metrics.render_rows(), hide_index=True)
+        if st.session_state.server_url:
+            stats = get_api_client(st.session_state.server_url).connection_stats()
+            breaker = get_retry_policy().breaker(st.session_state.server_url)
+            st.caption(
+                f"Connections: {stats['connections_opened']} opened, {stats['connections_reused']} reused · "
+                f"Circuit: {breaker.state}"
+            )
+        prefetch = get_prefetcher().stats()
+        st.caption(
+            f"Prefetch: {prefetch['hit_rate']:.0%} hit rate · {prefetch['submitted']} submitted, "
+            f"{prefetch['cancelled']} cancelled, {prefetch['unused']} unused"
+        )
+        st.download_button(
+            "Download Prometheus metrics",
+            data=metrics.render_prometheus(),
+            file_name=METRICS_PATH,
+            mime="text/plain"
+        )
+
+# Wizard router: the steps in order, the session keys each needs before it can be
+# entered, the list endpoints its page reads (so they can be prefetched), and
+# whether it renders inside a fragment. Fragment pages rerun on their
+# own when their widgets change and step between each other without re-executing the
+# rest of the script. The chat page writes to the sidebar, which fragments cannot,
+# so it renders in the full script run.
+class WizardStep:
+    """One page of the setup wizard"""
+    def __init__(self, name: str, title: str, render: Callable[[], None],
+                 requires: Tuple[Tuple[str, str], ...] = (), fragment: bool = True,
+                 lists: Callable[[Dict[str, Any]], List[str]] = lambda state: []):
+        self.name = name
+        self.title = title
+        self.render = render
+        self.requires = requires
+        self.fragment = fragment
+        self.lists = lists
+
+WIZARD_STEPS = [
+    WizardStep("server_setup", "Server", show_server_setup),
+    WizardStep("user_setup", "User", show_user_setup,
+               requires=(("server_url", "Please connect to a server first"),),
+               lists=lambda state: ["/users/list"]),
+    WizardStep("chatbot_setup", "Chatbot", show_chatbot_setup,
+               requires=(("server_url", "Please connect to a server first"),
+                         ("user_id", "Please select or create a user first")),
+               lists=lambda state: [f"/chatbots/list/{state['user_id']}"]),
+    WizardStep("knowledge_setup", "Knowledge base", show_knowledge_setup,
+               requires=(("server_url", "Please connect to a server first"),
+                         ("user_id", "Please select or create a user first"),
+                         ("chatbot_id", "Please select or create a chatbot first")),
+               lists=lambda state: [f"/knowledge/list/{state['chatbot_id']}"]),
+    WizardStep("document_upload", "Documents", show_document_upload,
+               requires=(("server_url", "Please connect to a server first"),
+                         ("user_id", "Please select or create a user first"),
+                         ("chatbot_id", "Please select or create a chatbot first"),
+                         ("knowledge_id", "Please select or create a knowledge base first")),
+               lists=lambda state: [f"/documents/list/{state['knowledge_id']}"]),
+    WizardStep("chat", "Chat", show_chat_interface, fragment=False,
+               requires=(("server_url", "Please connect to a server first"),
+                         ("user_id", "Please select or create a user first"),
+                         ("chatbot_id", "Please select or create a chatbot first"),
+                         ("knowledge_id", "Please select or create a knowledge base first")),
+               lists=lambda state: [f"/chatbots/list/{state['user_id']}", f"/knowledge/list/{state['chatbot_id']}"])
+]
+WIZARD = {step.name: step for step in WIZARD_STEPS}
+
+def current_step() -> WizardStep:
+    return WIZARD.get(st.session_state.step, WIZARD_STEPS[0])
+
+def guard_message(step: WizardStep) -> Optional[str]:
+    """Return why a step cannot be entered yet, or None when its requirements are met"""
+    return next((message for key, message in step.requires if not st.session_state.get(key)), None)
+
+def next_step_name() -> Optional[str]:
+    index = WIZARD_STEPS.index(current_step())
+    return WIZARD_STEPS[index + 1].name if index < len(WIZARD_STEPS) - 1 else None
+
+def prefetch_step(name: Optional[str], **selection: Any):
+    """
+    Start fetching the lists a step's page reads, as if selection were already
+    stored in the session. Replaces this session's earlier speculative prefetches.
+    """
+    if name is None:
+        return
+    step = WIZARD[name]
+    state = {**st.session_state.to_dict(), **selection}
+    if any(not state.get(key) for key, _ in step.requires):
+        return
+    get_prefetcher().submit(state["server_url"], step.lists(state), st.session_state.prefetch_group)
+
+def go_to(name: str):
+    """
+    Button callback switching wizard step. The click's own rerun then renders the
+    new page, which is just the fragment unless the page needs the full script.
+    """
+    logger.info(f"Navigating to step: {name}")
+    leaving_fragment = current_step().fragment
+    st.session_state.step = name
+    if leaving_fragment and not WIZARD[name].fragment:
+        st.rerun()
+
+def choose(key: str, value: Any, message: str, next_step: str):
+    """Button callback storing a wizard selection and moving to the next step"""
+    logger.info(message)
+    st.session_state[key] = value
+    flash_success(message)
+    go_to(next_step)
+
+def rerun_step():
+    """Rerun the current page, only its fragment when Streamlit allows it"""
+    if current_step().fragment:
+        try:
+            st.rerun(scope="fragment")
+        except StreamlitAPIException:
+            pass  # Fragment-scoped reruns are not allowed during a full script run
+    st.rerun()
+
+def advance_to(name: str):
+    """Switch wizard step from a page body, after work such as creating a record"""
+    logger.info(f"Navigating to step: {name}")
+    fragment_to_fragment = current_step().fragment and WIZARD[name].fragment
+    st.session_state.step = name
+    if fragment_to_fragment:
+        rerun_step()
+    st.rerun()
+
+def show_navigation(step: WizardStep):
+    """Show the step indicator and Previous/Next buttons, with Next guarded"""
+    index = WIZARD_STEPS.index(step)
+    st.caption(" › ".join(
+        f"**{s.title}**" if s is step else s.title for s in WIZARD_STEPS
+    ))
+    col1, col2 = st.columns(2)
+    with col1:
+        if index > 0:
+            st.button("◀ Previous", on_click=go_to, args=(WIZARD_STEPS[index - 1].name,))
+    with col2:
+        if index < len(WIZARD_STEPS) - 1:
+            next_step = WIZARD_STEPS[index + 1]
+            blocked = guard_message(next_step)
+            st.button("Next ▶", on_click=go_to, args=(next_step.name,), disabled=blocked is not None, help=blocked)
+
+def render_step():
+    """Render the current wizard step, or the reason it cannot be shown yet"""
+    step = current_step()
+    show_navigation(step)
+    show_flash_messages()
+    blocked = guard_message(step)
+    if blocked:
+        logger.warning(f"Step {step.name} is blocked: {blocked}")
+        st.error(blocked)
+        return
+    # Pages that offer a selection replace this with a prefetch for the selected item
+    prefetch_step(next_step_name())
+    step.render()
+
+@st.fragment
+@timed_render("fragment")
+def render_step_fragment():
+    render_step()
+
+# Headless batch queries: python main.py batch <queries.jsonl> <results.jsonl> --server-url ...
+BATCH_CONCURRENCY = 4
+BATCH_RATE_LIMIT = 5.0
+
+class RateLimiter:
+    """Space calls evenly so that at most rate of them start per second across threads"""
+    def __init__(self, rate: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+def compact_batch_results(output_path: str) -> set:
+    """
+    Prepare an existing results file for a resumed run: keep one successful line
+    per ID and drop error lines and lines cut short by an interruption, since those
+    queries are retried and appended again. Returns the IDs already answered.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    tmp_path = output_path + ".tmp"
+    with open(output_path, "r", encoding="utf-8") as f, open(tmp_path, "w", encoding="utf-8") as out:
+        for line in f:
             try:
-                logger.info("Downloading chat history")
-                response = make_api_request('GET', "/history")
-                if response and response.status_code == 200:
-                    history = response.json()
-                    filename = f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                    st.download_button(
-                        "Download",
-                        data=json.dumps(history, indent=2),
-                        file_name=filename,
-                        mime="application/json"
-                    )
-                    logger.info(f"Chat history downloaded as {filename}")
-            except Exception as e:
-                logger.error(f"Error downloading history: {str(e)}")
-                st.error(f"Error: {str(e)}")
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interruption
+            if record.get("status") == "ok" and record["id"] not in done:
+                done.add(record["id"])
+                out.write(line if line.endswith("\n") else line + "\n")
+    os.replace(tmp_path, output_path)
+    return done
+
+def run_batch_query(server_url: str, record: Dict[str, Any], limiter: RateLimiter) -> Dict[str, Any]:
+    """Run one batch record against /query and return its result line"""
+    keywords = record.get("keywords")
+    if isinstance(keywords, str):
+        keywords = [k.strip() for k in keywords.split(",") if k.strip()] or None
+    limiter.acquire()
+    start = time.perf_counter()
+    try:
+        response = make_api_request(
+            'POST',
+            "/query",
+            server_url=server_url,
+            json={
+                "query": record["query"],
+                "chatbot_id": record["chatbot_id"],
+                "knowledge_id": record["knowledge_id"],
+                "keywords": keywords
+            }
+        )
+        result = response.json()
+        return {
+            "id": record["id"],
+            "status": "ok",
+            "query": record["query"],
+            "answer": result.get("answer"),
+            "chunks": result.get("chunks", []),
+            "timestamp": result.get("timestamp"),
+            "latency_s": round(time.perf_counter() - start, 3)
+        }
+    except Exception as e:
+        logger.error(f"Batch query {record['id']} failed: {str(e)}")
+        return {"id": record["id"], "status": "error", "query": record["query"], "error": str(e),
+                "latency_s": round(time.perf_counter() - start, 3)}
+
+def iter_batch_records(input_path: str, query_field: str = "query",
+                       defaults: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """Read JSONL query records lazily, filling in IDs and default chatbot/knowledge IDs"""
+    defaults = defaults or {}
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield {
+                "id": str(record.get("id") or record.get("request_id") or f"line-{line_number}"),
+                "query": record[query_field],
+                "chatbot_id": record.get("chatbot_id", defaults.get("chatbot_id")),
+                "knowledge_id": record.get("knowledge_id", defaults.get("knowledge_id")),
+                "keywords": record.get("keywords")
+            }
 
-def show_navigation():
-    """Show navigation buttons between steps"""
-    steps = ["server_setup", "user_setup", "chatbot_setup", 
-             "knowledge_setup", "document_upload", "chat"]
+def run_batch(input_path: str, output_path: str, server_url: str, concurrency: int = BATCH_CONCURRENCY,
+              rate: float = BATCH_RATE_LIMIT, query_field: str = "query",
+              defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run every query in input_path against /query with bounded concurrency and a
+    rate limit, appending one JSON result per line to output_path as each query
+    finishes. Queries already answered in output_path are skipped, so an
+    interrupted run resumes where it stopped; failed results from earlier runs are
+    dropped first, leaving one line per query ID.
+    """
+    server_url = server_url.rstrip('/')
+    done = compact_batch_results(output_path)
+    limiter = RateLimiter(rate)
+    stats = {"completed": 0, "failed": 0, "skipped": 0}
+    start = time.perf_counter()
     
-    col1, col2 = st.columns(2)
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        
+        def drain(return_when: str):
+            finished, still_pending = wait(pending, return_when=return_when)
+            for future in finished:
+                result = future.result()
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["completed" if result["status"] == "ok" else "failed"] += 1
+            return still_pending
+        
+        for record in iter_batch_records(input_path, query_field, defaults):
+            if record["id"] in done:
+                stats["skipped"] += 1
+                continue
+            pending.add(pool.submit(run_batch_query, server_url, record, limiter))
+            if len(pending) >= concurrency * 2:
+                pending = drain(FIRST_COMPLETED)
+        while pending:
+            pending = drain(FIRST_COMPLETED)
     
-    with col1:
-        if st.session_state.step != "server_setup":
-            if st.button("◀ Previous"):
-                current_idx = steps.index(st.session_state.step)
-                if current_idx > 0:
-                    logger.info(f"Navigating to previous step: {steps[current_idx - 1]}")
-                    st.session_state.step = steps[current_idx - 1]
-                    st.rerun()
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["queries_per_s"] = round((stats["completed"] + stats["failed"]) / elapsed, 2) if elapsed else 0.0
+    logger.info(
+        f"Batch finished: {stats['completed']} ok, {stats['failed']} failed, {stats['skipped']} skipped "
+        f"in {stats['seconds']}s ({stats['queries_per_s']} queries/s)"
+    )
+    return stats
+
+def batch_main(argv: List[str]) -> int:
+    """Command line entry point for headless batch queries"""
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Run JSONL queries against /query")
+    parser.add_argument("input", help="JSONL file with one query per line")
+    parser.add_argument("output", help="JSONL results file; existing successful results are skipped")
+    parser.add_argument("--server-url", required=True)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=BATCH_RATE_LIMIT, help="Maximum queries started per second")
+    parser.add_argument("--query-field", default="query", help="Field holding the query text")
+    parser.add_argument("--chatbot-id", help="Default chatbot_id for records without one")
+    parser.add_argument("--knowledge-id", help="Default knowledge_id for records without one")
+    args = parser.parse_args(argv)
     
-    with col2:
-        if st.session_state.step != "chat":
-            if st.button("Next ▶"):
-                current_idx = steps.index(st.session_state.step)
-                if current_idx < len(steps) - 1:
-                    logger.info(f"Navigating to next step: {steps[current_idx + 1]}")
-                    st.session_state.step = steps[current_idx + 1]
-                    st.rerun()
+    stats = run_batch(
+        args.input,
+        args.output,
+        args.server_url,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        query_field=args.query_field,
+        defaults={"chatbot_id": args.chatbot_id, "knowledge_id": args.knowledge_id}
+    )
+    print(json.dumps(stats))
+    return 0 if stats["failed"] == 0 else 1
 
 def main():
     """Main application function"""
+    start = time.perf_counter()
+    st.set_page_config(
+        page_title="Chatbot Interface",
+        page_icon="🤖",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
     try:
         # Initialize session state
         init_session_state()
         
-        # Show current step in sidebar
-        st.sidebar.write(f"Current Step: {st.session_state.step}")
-        
-        # Show navigation
-        show_navigation()
-        
-        # Display appropriate page based on current step
-        if st.session_state.step == "server_setup":
-            show_server_setup()
-        elif st.session_state.step == "user_setup":
-            show_user_setup()
-        elif st.session_state.step == "chatbot_setup":
-            show_chatbot_setup()
-        elif st.session_state.step == "knowledge_setup":
-            show_knowledge_setup()
-        elif st.session_state.step == "document_upload":
-            show_document_upload()
-        elif st.session_state.step == "chat":
-            show_chat_interface()
+        # Fragment pages rerun on their own after this first render
+        if current_step().fragment:
+            render_step_fragment()
+        else:
+            render_step()
             
     except Exception as e:
         logger.error(f"Application error: {str(e)}")
         st.error(f"An error occurred: {str(e)}")
         logger.exception("Detailed error traceback:")
+    finally:
+        get_metrics().observe_render("rerun", time.perf_counter() - start)
+    
+    show_diagnostics()
+    get_metrics_exporter()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
     main()
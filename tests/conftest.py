@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import MockRagServer
+
+
+@pytest.fixture
+def server():
+    """A local mock RAG server on a free port"""
+    mock = MockRagServer().start()
+    yield mock
+    mock.stop()
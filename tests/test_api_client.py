@@ -0,0 +1,58 @@
+import main
+
+REQUESTS = 10
+
+
+def test_connections_are_reused(server):
+    client = main.ApiClient(server.url)
+    try:
+        for _ in range(REQUESTS):
+            client.request('GET', "/users/list").raise_for_status()
+        assert client.connection_stats() == {
+            "requests": REQUESTS,
+            "connections_opened": 1,
+            "connections_reused": REQUESTS - 1,
+        }
+    finally:
+        client.close()
+
+
+def test_make_api_request_shares_pooled_client(server):
+    for _ in range(REQUESTS):
+        main.make_api_request('GET', "/users/list", server_url=server.url)
+    stats = main.get_api_client(server.url).connection_stats()
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == REQUESTS - 1
+
+
+def test_async_client_keeps_its_pool_across_renders(server):
+    client = main.AsyncApiClient(server.url)
+    try:
+        first = client.gather_json(["/users/list", "/chatbots/list/1"])
+        pool = client.client._transport._pool
+        connections = {id(connection) for connection in pool.connections}
+        second = client.gather_json(["/users/list", "/chatbots/list/1"])
+        assert first == second
+        assert {id(connection) for connection in pool.connections} == connections
+        assert server.requests["GET /users/list"] == 2
+    finally:
+        client.close()
+
+
+def test_one_failing_endpoint_does_not_fail_the_others(server):
+    client = main.AsyncApiClient(server.url)
+    try:
+        users, missing = client.gather_json(["/users/list", "/no/such/list"])
+        assert users and missing is None
+    finally:
+        client.close()
+
+
+def test_failed_list_reads_are_not_cached(server, monkeypatch):
+    main.get_list_cache().clear()
+    monkeypatch.setattr(main.st.session_state, "server_url", server.url, raising=False)
+    lists = main.fetch_lists(["/users/list", "/no/such/list"])
+    assert lists["/no/such/list"] == []
+    assert main.get_list_cache().get((server.url, "/users/list")) == lists["/users/list"]
+    assert main.get_list_cache().get((server.url, "/no/such/list")) is None
+    main.get_list_cache().clear()
@@ -0,0 +1,83 @@
+import json
+
+import main
+
+QUERIES = 20
+
+
+def write_queries(path):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(QUERIES):
+            f.write(json.dumps({"id": f"q{i}", "query": f"question {i}", "chatbot_id": 1, "knowledge_id": 1}) + "\n")
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_leaves_one_line_per_query(server, tmp_path):
+    queries, results = tmp_path / "queries.jsonl", tmp_path / "results.jsonl"
+    write_queries(queries)
+    server.fail_rate, server.fail_status = 0.5, 400
+    first = main.run_batch(str(queries), str(results), server.url, rate=0)
+    assert first["failed"] > 0 and first["completed"] + first["failed"] == QUERIES
+    
+    server.fail_rate = 0.0
+    second = main.run_batch(str(queries), str(results), server.url, rate=0)
+    assert (second["completed"], second["failed"], second["skipped"]) == (first["failed"], 0, first["completed"])
+    lines = read_results(results)
+    assert len(lines) == QUERIES
+    assert sorted(line["id"] for line in lines) == sorted(f"q{i}" for i in range(QUERIES))
+    assert all(line["status"] == "ok" for line in lines)
+
+
+def test_resume_drops_truncated_and_duplicate_lines(tmp_path):
+    results = tmp_path / "results.jsonl"
+    results.write_text(
+        '{"id": "a", "status": "ok"}\n'
+        '{"id": "b", "status": "error", "error": "boom"}\n'
+        '{"id": "a", "status": "ok"}\n'
+        '{"id": "c", "sta',
+        encoding="utf-8"
+    )
+    assert main.compact_batch_results(str(results)) == {"a"}
+    assert read_results(results) == [{"id": "a", "status": "ok"}]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+def test_rate_limiter_spaces_calls_evenly():
+    clock = FakeClock()
+    limiter = main.RateLimiter(4.0, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == [0.25, 0.5]
+
+
+def test_rate_limiter_does_not_bank_idle_time():
+    clock = FakeClock()
+    limiter = main.RateLimiter(2.0, clock=clock, sleep=clock.sleep)
+    limiter.acquire()
+    clock.now += 10
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == [0.5]
+
+
+def test_zero_rate_is_unlimited():
+    clock = FakeClock()
+    limiter = main.RateLimiter(0, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        limiter.acquire()
+    assert clock.sleeps == []
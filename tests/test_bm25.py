@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+import pytest
+
+import local_retrieval
+
+DOCS = ["invoice tax", "invoice refund refund", "supplier"]
+
+
+def test_postings_are_grouped_by_term():
+    index = local_retrieval.InvertedIndex(DOCS)
+    assert index.vocab == {"invoice": 0, "tax": 1, "refund": 2, "supplier": 3}
+    assert index.offsets.tolist() == [0, 2, 3, 4, 5]
+    postings = {term: index.doc_ids[index.offsets[i]:index.offsets[i + 1]].tolist() for term, i in index.vocab.items()}
+    assert postings == {"invoice": [0, 1], "tax": [0], "refund": [1], "supplier": [2]}
+
+
+def test_bm25_scores_match_the_formula():
+    k1, b = 1.5, 0.75
+    index = local_retrieval.InvertedIndex(DOCS, k1=k1, b=b)
+    avg_length = (2 + 3 + 1) / 3
+
+    def term_score(tf, df, length):
+        idf = math.log1p((3 - df + 0.5) / (df + 0.5))
+        return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+
+    expected = [
+        term_score(1, 2, 2),
+        term_score(1, 2, 3) + term_score(2, 1, 3),
+        0.0
+    ]
+    assert index.scores("refund invoice refund") == pytest.approx(expected, rel=1e-5)
+    assert index.scores("unknown").tolist() == [0.0, 0.0, 0.0]
+
+
+def test_rarer_terms_weigh_more():
+    index = local_retrieval.InvertedIndex(DOCS)
+    scores = index.scores("tax invoice")
+    assert local_retrieval.top_indices(scores, 3).tolist() == [0, 1, 2]
+    assert index.scores("tax")[0] > index.scores("invoice")[0]
+
+
+def test_reciprocal_rank_fusion():
+    fused = local_retrieval.reciprocal_rank_fusion([np.array([2, 0]), np.array([0, 1])], size=4, k=60)
+    assert fused.tolist() == pytest.approx([1 / 62 + 1 / 61, 1 / 62, 1 / 61, 0.0])
+    assert local_retrieval.top_indices(fused, 2).tolist() == [0, 2]
+
+
+def test_hybrid_rerank_promotes_keyword_matches():
+    chunks = [
+        {"chunk_id": 1, "content": "general guidance on invoices", "score": 0.9},
+        {"chunk_id": 2, "content": "self-billed e-invoice refund rules", "score": 0.8},
+        {"chunk_id": 3, "content": "unrelated text", "score": 0.7},
+    ]
+    reranked = local_retrieval.hybrid_rerank(chunks, "refund", keywords=["self-billed"])
+    assert [chunk["chunk_id"] for chunk in reranked] == [2, 1, 3]
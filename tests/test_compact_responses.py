@@ -0,0 +1,68 @@
+import sys
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def session(server, monkeypatch):
+    monkeypatch.setattr(main.st.session_state, "server_url", server.url, raising=False)
+    monkeypatch.setattr(main.st.session_state, "chunk_contents", main.TTLCache(maxsize=100, ttl=60), raising=False)
+    return main.st.session_state
+
+
+def query(server, accept, **body):
+    return main.make_api_request('POST', "/query", server_url=server.url, headers={"Accept": accept},
+                                 json={"query": "e-invoice", "chatbot_id": 1, "knowledge_id": 1, "k": 10, **body})
+
+
+def test_msgpack_and_json_decode_to_the_same_data(server):
+    as_json = main.make_api_request('GET', "/users/list", server_url=server.url, headers={"Accept": "application/json"})
+    as_msgpack = main.make_api_request('GET', "/users/list", server_url=server.url,
+                                       headers={"Accept": main.query_accept_header()})
+    assert as_json.headers["Content-Type"] == "application/json"
+    assert as_msgpack.headers["Content-Type"] == "application/msgpack"
+    assert main.decode_response(as_msgpack) == main.decode_response(as_json) == server.users
+
+
+def test_gzip_bodies_are_decoded(server):
+    for accept in ("application/json", main.query_accept_header()):
+        response = query(server, accept)
+        assert response.headers.get("Content-Encoding") == "gzip"
+        result = main.decode_response(response)
+        assert len(result["chunks"]) == 10
+        assert result["chunks"][0]["content"].startswith("Passage 0 relevant to: e-invoice")
+
+
+def test_accept_header_falls_back_to_json_without_msgpack(monkeypatch):
+    monkeypatch.setitem(sys.modules, "msgpack", None)
+    assert main.query_accept_header() == "application/json"
+
+
+def test_projected_chunks_leave_out_content(server):
+    result = main.decode_response(query(server, main.query_accept_header(), chunk_fields=main.QUERY_CHUNK_FIELDS))
+    assert all(set(chunk) == set(main.QUERY_CHUNK_FIELDS) for chunk in result["chunks"])
+
+
+def test_chunk_content_is_fetched_once_on_demand(server, session):
+    chunks = main.decode_response(query(server, main.query_accept_header(), chunk_fields=main.QUERY_CHUNK_FIELDS))["chunks"]
+    contents = main.fetch_chunk_contents(chunks)
+    assert set(contents) == {chunk["chunk_id"] for chunk in chunks}
+    assert contents[chunks[0]["chunk_id"]] == server.chunk_contents[chunks[0]["chunk_id"]]
+    assert server.requests["POST /chunks"] == 1
+    
+    assert main.fetch_chunk_contents(chunks) == contents
+    assert server.requests["POST /chunks"] == 1
+
+
+def test_chunks_carrying_content_need_no_request(server, session):
+    chunks = main.decode_response(query(server, "application/json"))["chunks"]
+    contents = main.fetch_chunk_contents(chunks)
+    assert contents == {chunk["chunk_id"]: chunk["content"] for chunk in chunks}
+    assert "POST /chunks" not in server.requests
+
+
+def test_chunks_the_server_does_not_know_are_left_out(server, session):
+    chunks = [{"chunk_id": "unknown-chunk"}, {"chunk_id": "inline", "content": "text"}]
+    assert main.fetch_chunk_contents(chunks) == {"inline": "text"}
@@ -0,0 +1,34 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("query", [
+    "What must a self-billed e-invoice contain?",
+    "When does the e-invoice mandate start for taxpayers above RM100 million?",
+    "List the mandatory fields of a consolidated e-invoice",
+])
+def test_standalone_questions_share_the_cache(query):
+    assert not main.is_follow_up(query)
+    assert main.cache_context_id(query, {"context_id": "abc"}) is None
+
+
+@pytest.mark.parametrize("query", [
+    "Why?",
+    "And for refunds?",
+    "Does that apply to foreign suppliers?",
+    "Can you explain the above in simpler terms?",
+    "What about them?",
+])
+def test_follow_ups_are_keyed_on_the_conversation(query):
+    assert main.is_follow_up(query)
+    assert main.cache_context_id(query, {"context_id": "abc"}) == "abc"
+
+
+def test_follow_up_without_a_conversation_is_shared():
+    assert main.cache_context_id("Why?", {}) is None
+
+
+def test_estimate_tokens():
+    assert main.estimate_tokens("") == 1
+    assert main.estimate_tokens("x" * 400) == 101
@@ -0,0 +1,100 @@
+import pytest
+import requests
+
+import main
+from benchmark import MockRagServer
+
+
+@pytest.fixture(autouse=True)
+def fresh_endpoint_memory():
+    main.get_unsupported_endpoints.clear()
+    main.get_list_cache().clear()
+    yield
+    main.get_unsupported_endpoints.clear()
+    main.get_list_cache().clear()
+
+
+@pytest.fixture
+def fan_out_server():
+    mock = MockRagServer(batch_endpoint=False).start()
+    yield mock
+    mock.stop()
+
+
+def add_documents(server, count):
+    return [server._add_document(1, f"doc{i}.pdf", 100)["document_id"] for i in range(count)]
+
+
+def test_batch_endpoint_deletes_in_one_request(server):
+    document_ids = add_documents(server, 3)
+    outcome = main.batch_document_action(server.url, 1, "delete", document_ids + [999999])
+    assert outcome == {**{document_id: None for document_id in document_ids}, 999999: "Document not found"}
+    assert server.requests["POST /documents/batch"] == 1
+    assert "DELETE /documents/delete/{id}" not in server.requests
+    assert server.documents[1] == []
+
+
+def test_missing_batch_endpoint_falls_back_to_fan_out(fan_out_server):
+    document_ids = add_documents(fan_out_server, 3)
+    outcome = main.batch_document_action(fan_out_server.url, 1, "delete", document_ids)
+    assert outcome == {document_id: None for document_id in document_ids}
+    assert fan_out_server.requests["POST /documents/batch"] == 1
+    assert fan_out_server.requests["DELETE /documents/delete/{id}"] == 3
+    assert fan_out_server.documents[1] == []
+
+
+def test_unsupported_batch_endpoint_is_remembered(fan_out_server):
+    main.batch_document_action(fan_out_server.url, 1, "reindex", add_documents(fan_out_server, 2))
+    main.batch_document_action(fan_out_server.url, 1, "reindex", add_documents(fan_out_server, 2))
+    assert fan_out_server.requests["POST /documents/batch"] == 1
+    assert fan_out_server.requests["POST /documents/reindex/{id}"] == 4
+    assert (fan_out_server.url, "/documents/batch") in main.get_unsupported_endpoints()
+
+
+def method_not_allowed(method, endpoint, **kwargs):
+    if endpoint == "/documents/batch":
+        response = requests.Response()
+        response.status_code = 405
+        raise requests.HTTPError("405 Method Not Allowed", response=response)
+    return requests.Response()
+
+
+def test_method_not_allowed_also_falls_back(monkeypatch):
+    monkeypatch.setattr(main, "make_api_request", method_not_allowed)
+    assert main.batch_document_action("http://server", 1, "delete", [1, 2]) == {1: None, 2: None}
+    assert ("http://server", "/documents/batch") in main.get_unsupported_endpoints()
+
+
+def test_other_batch_errors_are_raised(monkeypatch):
+    def server_error(method, endpoint, **kwargs):
+        response = requests.Response()
+        response.status_code = 500
+        raise requests.HTTPError("500 Server Error", response=response)
+    
+    monkeypatch.setattr(main, "make_api_request", server_error)
+    with pytest.raises(requests.HTTPError):
+        main.batch_document_action("http://server", 1, "delete", [1])
+    assert not main.get_unsupported_endpoints()
+
+
+def test_fan_out_reports_per_document_errors(monkeypatch):
+    def flaky(method, endpoint, **kwargs):
+        if endpoint == "/documents/delete/2":
+            raise RuntimeError("gone")
+        return method_not_allowed(method, endpoint, **kwargs)
+    
+    monkeypatch.setattr(main, "make_api_request", flaky)
+    assert main.batch_document_action("http://server", 1, "delete", [1, 2]) == {1: None, 2: "gone"}
+
+
+def test_update_cached_list_edits_only_cached_lists(server, monkeypatch):
+    monkeypatch.setattr(main.st.session_state, "server_url", server.url, raising=False)
+    endpoint = "/documents/list/1"
+    main.update_cached_list(endpoint, lambda docs: docs + [{"document_id": 1}])
+    assert main.get_list_cache().get((server.url, endpoint)) is None
+    
+    document_ids = add_documents(server, 2)
+    assert [doc["document_id"] for doc in main.fetch_list(endpoint)] == document_ids
+    main.update_cached_list(endpoint, lambda docs: [d for d in docs if d["document_id"] != document_ids[0]])
+    assert [doc["document_id"] for doc in main.fetch_list(endpoint)] == document_ids[1:]
+    assert server.requests["GET /documents/list/{id}"] == 1
@@ -0,0 +1,67 @@
+import pytest
+
+import main
+
+NAMES = {1: "e-invoice", 2: "aml-cft"}
+
+
+def chunks(knowledge_id, *scores):
+    return [{"chunk_id": f"{knowledge_id}-{i}", "score": score} for i, score in enumerate(scores)]
+
+
+def test_bases_are_compared_by_how_far_chunks_stand_out():
+    # Base 2 scores on a larger scale, but base 1's top chunk stands out more
+    merged = main.merge_shard_chunks([(1, chunks(1, 0.9, 0.2, 0.1)), (2, chunks(2, 40.0, 39.0, 38.0))], 3, NAMES)
+    assert [chunk["chunk_id"] for chunk in merged] == ["1-0", "2-0", "2-1"]
+    assert merged[0]["raw_score"] == 0.9
+    assert merged[0]["knowledge_name"] == "e-invoice"
+    assert "rank" not in merged[0]
+
+
+def test_top_chunks_are_not_forced_level():
+    merged = main.merge_shard_chunks([(1, chunks(1, 0.5, 0.49, 0.48)), (2, chunks(2, 0.9, 0.1, 0.1))], 6, NAMES)
+    assert merged[0]["chunk_id"] == "2-0"
+    assert merged[0]["score"] > merged[1]["score"]
+
+
+def test_single_chunk_base_is_neutral():
+    merged = main.merge_shard_chunks([(1, chunks(1, 0.2)), (2, chunks(2, 0.9, 0.5, 0.1))], 4, NAMES)
+    assert [chunk["chunk_id"] for chunk in merged] == ["2-0", "1-0", "2-1", "2-2"]
+    assert merged[1]["score"] == 0.0
+
+
+def test_equal_scores_keep_the_base_order():
+    merged = main.merge_shard_chunks([(1, chunks(1, 0.7, 0.7)), (2, chunks(2, 0.3, 0.3))], 4, NAMES)
+    assert [chunk["chunk_id"] for chunk in merged] == ["1-0", "2-0", "1-1", "2-1"]
+    assert {chunk["score"] for chunk in merged} == {0.0}
+
+
+def test_empty_shard_is_skipped():
+    merged = main.merge_shard_chunks([(1, []), (2, chunks(2, 0.9, 0.1))], 5, NAMES)
+    assert [chunk["chunk_id"] for chunk in merged] == ["2-0", "2-1"]
+    assert main.merge_shard_chunks([(1, [])], 5, NAMES) == []
+
+
+class FakeResponse:
+    headers = {}
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def test_answer_comes_from_the_base_owning_the_top_chunk(monkeypatch):
+    results = {
+        1: {"answer": "from e-invoice", "chunks": chunks(1, 0.95, 0.9, 0.85)},
+        2: {"answer": "from aml-cft", "chunks": chunks(2, 0.6, 0.1, 0.05)},
+    }
+    monkeypatch.setattr(main, "openai_api_key", lambda: "")
+    monkeypatch.setattr(main, "send_with_profile",
+                        lambda send, payload, profile, server_url: FakeResponse(results[payload["knowledge_id"]]))
+    profile = {"parameters": {"k": 4, "temperature": 0.5}}
+    result = main.federated_query({"query": "q"}, [1, 2], profile, "http://server", NAMES)
+    assert result["chunks"][0]["chunk_id"] == "2-0"
+    assert result["answer"] == "from aml-cft"
+    assert result["failed"] == []
@@ -0,0 +1,33 @@
+import json
+import os
+
+import main
+
+
+def test_export_fetches_every_page(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i in range(main.HISTORY_PAGE_SIZE * 2 + 5):
+        server._answer({"query": f"question {i}", "k": 1})
+    data = main.export_history_ndjson(server.url)
+    entries = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+    assert [entry["query"] for entry in entries] == [f"question {i}" for i in range(len(entries))]
+    assert len(entries) == main.HISTORY_PAGE_SIZE * 2 + 5
+    assert server.requests["GET /history"] == 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_full_list_history_is_downloaded_once_per_viewer(server):
+    server.paginate_history = False
+    for i in range(main.HISTORY_PAGE_SIZE + 5):
+        server._answer({"query": f"question {i}", "k": 1})
+    first, cursor, snapshot = main.fetch_history_page(server_url=server.url)
+    second, last_cursor, _ = main.fetch_history_page(cursor, snapshot=snapshot)
+    assert [entry["query"] for entry in first + second] == [f"question {i}" for i in range(main.HISTORY_PAGE_SIZE + 5)]
+    assert last_cursor is None
+    assert server.requests["GET /history"] == 1
+
+
+def test_paginated_history_has_no_snapshot(server):
+    server._answer({"query": "question", "k": 1})
+    items, cursor, snapshot = main.fetch_history_page(server_url=server.url)
+    assert len(items) == 1 and cursor is None and snapshot is None
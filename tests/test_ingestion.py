@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+import local_retrieval
+
+
+def write_pages(path, pages, lines_per_page=local_retrieval.TEXT_LINES_PER_PAGE):
+    path.write_text("".join(
+        f"page{page} line{line} text\n" for page, count in enumerate(pages, start=1) for line in range(count)
+    ))
+    assert all(count == lines_per_page for count in pages[:-1])
+
+
+def ingest(path, checkpoint_dir):
+    ingestor = local_retrieval.DocumentIngestor(str(path), chunk_size=50, batch_size=8,
+                                                checkpoint_dir=str(checkpoint_dir))
+    chunks = [chunk for batch in ingestor.batches() for chunk in batch]
+    return ingestor, chunks
+
+
+def test_pages_are_checkpointed_one_file_each(tmp_path):
+    doc = tmp_path / "doc.txt"
+    write_pages(doc, [200, 200, 10])
+    ingestor, chunks = ingest(doc, tmp_path / "checkpoints")
+    assert ingestor.stats["pages"] == 3
+    assert ingestor.stats["chunks"] == len(chunks) == 12 + 12 + 1
+    assert sorted(os.listdir(ingestor.checkpoint_dir)) == ["page-1.json", "page-2.json", "page-3.json", "state.json"]
+    with open(ingestor.state_path, encoding="utf-8") as f:
+        assert json.load(f)["completed"] is True
+
+
+def test_unchanged_file_is_replayed_without_parsing(tmp_path, monkeypatch):
+    doc = tmp_path / "doc.txt"
+    write_pages(doc, [200, 10])
+    _, first = ingest(doc, tmp_path / "checkpoints")
+    monkeypatch.setattr(local_retrieval.DocumentIngestor, "iter_pages",
+                        lambda self: pytest.fail("an unchanged file should not be parsed"))
+    ingestor, second = ingest(doc, tmp_path / "checkpoints")
+    assert [chunk["content"] for chunk in second] == [chunk["content"] for chunk in first]
+    assert ingestor.stats["pages_changed"] == 0
+
+
+def test_only_changed_pages_are_rechunked(tmp_path):
+    doc = tmp_path / "doc.txt"
+    write_pages(doc, [200, 200, 200])
+    ingest(doc, tmp_path / "checkpoints")
+    text = doc.read_text().replace("page2 line7 text", "page2 line7 edited text")
+    doc.write_text(text)
+    ingestor, chunks = ingest(doc, tmp_path / "checkpoints")
+    assert ingestor.stats["pages_changed"] == 1
+    assert {chunk["page"] for chunk in chunks if chunk["changed"]} == {2}
+    assert any("edited" in chunk["content"] for chunk in chunks)
+
+
+def test_shorter_document_drops_stale_pages(tmp_path):
+    doc = tmp_path / "doc.txt"
+    write_pages(doc, [200, 200, 200])
+    ingestor, _ = ingest(doc, tmp_path / "checkpoints")
+    write_pages(doc, [200, 5])
+    ingestor, chunks = ingest(doc, tmp_path / "checkpoints")
+    assert ingestor.stats["pages"] == 2
+    assert "page-3.json" not in os.listdir(ingestor.checkpoint_dir)
+    assert {chunk["page"] for chunk in chunks} == {1, 2}
@@ -0,0 +1,89 @@
+import pytest
+
+import main
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = main.TTLCache(maxsize=4, ttl=30, clock=clock)
+    cache.set("users", [1])
+    clock.now += 29.9
+    assert cache.get("users") == [1]
+    clock.now += 0.1
+    assert cache.get("users") is None
+    assert "users" not in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_rewriting_an_entry_restarts_its_ttl(clock):
+    cache = main.TTLCache(maxsize=4, ttl=30, clock=clock)
+    cache.set("users", [1])
+    clock.now += 20
+    cache.set("users", [1, 2])
+    clock.now += 20
+    assert cache.get("users") == [1, 2]
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = main.TTLCache(maxsize=2, ttl=30, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_contains_does_not_count(clock):
+    cache = main.TTLCache(maxsize=2, ttl=30, clock=clock)
+    cache.set("a", 1)
+    assert "a" in cache and "b" not in cache
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+@pytest.fixture
+def list_cache(server, clock, monkeypatch):
+    cache = main.TTLCache(maxsize=16, ttl=30, clock=clock)
+    monkeypatch.setattr(main, "get_list_cache", lambda: cache)
+    monkeypatch.setattr(main.st.session_state, "server_url", server.url, raising=False)
+    return cache
+
+
+def test_fetch_list_refetches_after_expiry(server, clock, list_cache):
+    main.fetch_list("/users/list")
+    main.fetch_list("/users/list")
+    assert server.requests["GET /users/list"] == 1
+    clock.now += 30
+    main.fetch_list("/users/list")
+    assert server.requests["GET /users/list"] == 2
+
+
+def test_invalidate_list_makes_the_next_read_see_the_write(server, list_cache):
+    before = main.fetch_list("/users/list")
+    main.make_api_request('POST', "/users/create", server_url=server.url, json={"user_name": "new"})
+    assert main.fetch_list("/users/list") == before
+    
+    main.invalidate_list("/users/list")
+    after = main.fetch_list("/users/list")
+    assert [user["user_name"] for user in after][-1] == "new"
+    assert server.requests["GET /users/list"] == 2
+
+
+def test_invalidate_list_only_drops_its_own_endpoint(server, list_cache):
+    main.fetch_list("/users/list")
+    main.fetch_list("/chatbots/list/1")
+    main.invalidate_list("/users/list")
+    assert (server.url, "/users/list") not in list_cache
+    assert (server.url, "/chatbots/list/1") in list_cache
@@ -0,0 +1,114 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+import local_retrieval
+import main
+
+
+@pytest.fixture
+def corpus_root(tmp_path, monkeypatch):
+    root = tmp_path / "corpus"
+    (root / "guides").mkdir(parents=True)
+    monkeypatch.setattr(main, "get_secrets", lambda: {"local_corpus_dir": str(root)})
+    return root
+
+
+def test_corpus_inside_the_root_is_allowed(corpus_root):
+    assert main.resolve_corpus_dir("") == os.path.realpath(corpus_root)
+    assert main.resolve_corpus_dir("guides") == os.path.realpath(corpus_root / "guides")
+
+
+@pytest.mark.parametrize("path", ["/", "..", "guides/../..", "/etc"])
+def test_corpus_outside_the_root_is_rejected(corpus_root, path):
+    with pytest.raises(ValueError, match="must be inside"):
+        main.resolve_corpus_dir(path)
+
+
+def test_symlink_out_of_the_root_is_rejected(corpus_root, tmp_path):
+    (corpus_root / "escape").symlink_to(tmp_path)
+    with pytest.raises(ValueError, match="must be inside"):
+        main.resolve_corpus_dir("escape")
+
+
+def test_missing_corpus_directory_is_rejected(corpus_root):
+    with pytest.raises(ValueError, match="does not exist"):
+        main.resolve_corpus_dir("missing")
+
+
+def stub_embedding(texts):
+    """Deterministic offline embedding: counts of two marker words plus a bias"""
+    vectors = np.array([[text.count("alpha"), text.count("beta"), 1.0] for text in texts], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def retriever_corpus(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    words = [f"w{i}" for i in range(300)]
+    words[120] = "alpha"
+    (corpus / "guide.txt").write_text(" ".join(words))
+    (corpus / "notes.md").write_text("beta " * 20)
+    return corpus
+
+
+def test_local_retriever_builds_offline(retriever_corpus, tmp_path):
+    retriever = local_retrieval.LocalRetriever(str(retriever_corpus), chunk_overlap=10, embed_fn=stub_embedding,
+                                               index_dir=str(tmp_path / "index"), chunk_size=50)
+    retriever.load_or_build()
+    results = retriever.search("alpha", k=3, keywords=["alpha"])
+    assert len(results) == 3
+    for chunk in results:
+        assert {"chunk_id", "source", "content", "score", "keywords"} <= set(chunk)
+    assert results[0]["source"] == "guide.txt"
+    assert "alpha" in results[0]["content"].split()
+    assert results[0]["keywords"] == ["alpha"]
+    assert results[0]["score"] >= results[1]["score"] >= results[2]["score"]
+
+
+def test_local_retriever_respects_chunk_overlap(retriever_corpus, tmp_path):
+    retriever = local_retrieval.LocalRetriever(str(retriever_corpus), chunk_overlap=10, embed_fn=stub_embedding,
+                                               index_dir=str(tmp_path / "index"), chunk_size=50)
+    retriever.load_or_build()
+    guide = [retriever.chunk(i)["content"].split() for i, chunk in enumerate(retriever.chunks)
+             if chunk["source"] == "guide.txt"]
+    assert guide[0] == [f"w{i}" for i in range(50)]
+    assert all(len(words) == 60 for words in guide[1:])
+    for previous, current in zip(guide, guide[1:]):
+        assert current[:10] == previous[-10:]
+    assert guide[-1][-1] == "w299"
+    assert [retriever.chunk(i, 0)["content"] for i in range(len(retriever.chunks))] == \
+        [chunk["content"] for chunk in retriever.chunks]
+
+
+def test_changing_chunk_overlap_reuses_the_index(retriever_corpus, tmp_path):
+    embedded = []
+
+    def counting_embedding(texts):
+        embedded.extend(texts)
+        return stub_embedding(texts)
+
+    index_dir = tmp_path / "index"
+    for overlap in (10, 0, 25):
+        retriever = local_retrieval.LocalRetriever(str(retriever_corpus), chunk_overlap=overlap,
+                                                   embed_fn=counting_embedding, index_dir=str(index_dir), chunk_size=50)
+        retriever.load_or_build()
+    assert len(embedded) == len(retriever.chunks)
+    assert sorted(path.name for path in index_dir.glob("*.f32")) == \
+        [f"{hashlib.sha1(str(retriever_corpus).encode('utf-8')).hexdigest()}.f32"]
+    assert retriever.search("alpha", k=1)[0]["content"].split()[:25] == [f"w{i}" for i in range(75, 100)]
+
+
+def test_rebuild_replaces_the_corpus_index(retriever_corpus, tmp_path):
+    index_dir = tmp_path / "index"
+    local_retrieval.LocalRetriever(str(retriever_corpus), embed_fn=stub_embedding, index_dir=str(index_dir),
+                                   chunk_size=50).load_or_build()
+    (retriever_corpus / "extra.txt").write_text("alpha beta gamma")
+    retriever = local_retrieval.LocalRetriever(str(retriever_corpus), embed_fn=stub_embedding,
+                                               index_dir=str(index_dir), chunk_size=50).load_or_build()
+    assert any(chunk["source"] == "extra.txt" for chunk in retriever.chunks)
+    assert len(list(index_dir.glob("*.f32"))) == 1
+    assert len(list(index_dir.glob("*.json"))) == 1
@@ -0,0 +1,85 @@
+import logging
+import logging.handlers
+import threading
+import time
+
+import main
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SlowHandler(logging.Handler):
+    """Stands in for a file handler on a slow disk"""
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+        self.messages = []
+        self.done = threading.Event()
+
+    def emit(self, record: logging.LogRecord):
+        time.sleep(self.delay)
+        self.messages.append(record.getMessage())
+        if record.getMessage() == "last":
+            self.done.set()
+
+
+def make_record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("chatbot_app", logging.INFO, __file__, 0, message, None, None)
+
+
+def test_setup_logging_installs_one_handler():
+    logger = main.setup_logging()
+    assert main.setup_logging() is logger
+    assert len(logger.handlers) == 1
+    assert isinstance(logger.handlers[0], logging.handlers.QueueHandler)
+
+
+def test_rate_limit_filter_suppresses_repeats():
+    clock = FakeClock()
+    rate_limit = main.RateLimitFilter(prefixes=("Displaying ",), interval=60.0, clock=clock)
+    first = make_record("Displaying chat interface")
+    assert rate_limit.filter(first)
+    assert first.suppressed == 0
+    for _ in range(3):
+        clock.now += 10
+        assert not rate_limit.filter(make_record("Displaying chat interface"))
+    assert rate_limit.filter(make_record("Displaying user setup page"))
+    assert rate_limit.filter(make_record("Attempting GET request to /users/list"))
+
+    clock.now = 60.0
+    after = make_record("Displaying chat interface")
+    assert rate_limit.filter(after)
+    assert after.suppressed == 3
+    assert not rate_limit.filter(make_record("Displaying chat interface"))
+
+
+def test_json_formatter_reports_suppressed_count():
+    record = make_record("Displaying chat interface")
+    record.suppressed = 3
+    assert '"suppressed": 3' in main.JsonFormatter().format(record)
+
+
+def test_log_calls_do_not_wait_for_slow_handlers():
+    logger = main.setup_logging()
+    listener = logger.queue_listener
+    slow = SlowHandler(delay=0.05)
+    original = listener.handlers
+    listener.handlers = original + (slow,)
+    try:
+        start = time.perf_counter()
+        for i in range(20):
+            logger.info(f"message {i}")
+        logger.info("last")
+        elapsed = time.perf_counter() - start
+        # 21 records take over a second to write; logging them must not
+        assert elapsed < 0.1
+        assert slow.done.wait(timeout=5)
+        assert slow.messages[-1] == "last"
+    finally:
+        listener.handlers = original
@@ -0,0 +1,90 @@
+import re
+import time
+
+import main
+
+SAMPLE = re.compile(r'^([a-z_]+)(\{(?:[a-z]+="[^"]*",?)*\})? (-?[0-9.e+-]+)$')
+
+
+def samples(text, name):
+    found = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match and match[1] == name:
+            found[match[2] or ""] = float(match[3])
+    return found
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = main.Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.01, 0.05, 0.5, 5.0):
+        hist.observe(value)
+    assert hist.counts == [2, 3, 4]
+    assert hist.count == 5
+    assert abs(hist.sum - 5.565) < 1e-9
+
+
+def test_quantiles_interpolate_recent_observations():
+    hist = main.Histogram()
+    for value in (1.0, 2.0, 3.0, 4.0):
+        hist.observe(value)
+    assert hist.quantile(0.5) == 2.5
+    assert hist.quantile(0.0) == 1.0
+    assert hist.quantile(1.0) == 4.0
+    assert main.Histogram().quantile(0.5) == 0.0
+
+
+def test_prometheus_text_format():
+    metrics = main.Metrics()
+    for seconds in (0.003, 0.02, 0.4, 60.0):
+        metrics.observe_request('GET', "/chatbots/list/12", "200", seconds, response_bytes=100)
+    metrics.observe_request('GET', "/chatbots/list/12", "ConnectTimeout", 3.0)
+    metrics.record_retry('GET', "/chatbots/list/7")
+    metrics.observe_render('say "hi"', 0.2)
+    text = metrics.render_prometheus()
+    
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    for line in lines:
+        assert line.startswith(("# HELP ", "# TYPE ")) or SAMPLE.match(line), line
+    for line in lines:
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            assert kind in ("histogram", "counter", "gauge")
+            assert lines.index(line) == lines.index(next(l for l in lines if l.startswith(f"# HELP {name} "))) + 1
+    
+    buckets = samples(text, "ragapi_client_request_duration_seconds_bucket")
+    label = 'method="GET",endpoint="/chatbots/list/{id}"'
+    assert buckets["{" + label + ',le="0.005"}'] == 1
+    assert buckets["{" + label + ',le="0.025"}'] == 2
+    assert buckets["{" + label + ',le="0.5"}'] == 3
+    assert buckets["{" + label + ',le="30.0"}'] == 4
+    assert buckets["{" + label + ',le="+Inf"}'] == 5
+    counts = list(buckets.values())
+    assert counts == sorted(counts)
+    assert samples(text, "ragapi_client_request_duration_seconds_count") == {"{" + label + "}": 5}
+    assert samples(text, "ragapi_client_request_duration_seconds_sum")["{" + label + "}"] == 63.423
+    
+    assert samples(text, "ragapi_client_requests_total") == {
+        "{" + label + ',status="200"}': 4,
+        "{" + label + ',status="ConnectTimeout"}': 1,
+    }
+    assert samples(text, "ragapi_client_retries_total") == {"{" + label + "}": 1}
+    assert samples(text, "ragapi_client_response_bytes_total") == {"{" + label + "}": 400}
+    assert "{render=\"say 'hi'\"}" in samples(text, "ragapi_client_render_duration_seconds_count")
+
+
+def test_exporter_writes_in_the_background_and_at_stop(tmp_path):
+    path = tmp_path / "metrics.prom"
+    metrics = main.Metrics()
+    exporter = main.MetricsExporter(metrics, path=str(path), interval=0.01)
+    try:
+        deadline = time.monotonic() + 5
+        while not path.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert path.exists()
+    finally:
+        metrics.observe_render("rerun", 0.1)
+        exporter.stop()
+    assert 'ragapi_client_render_duration_seconds_count{render="rerun"} 1' in path.read_text()
+    assert not (tmp_path / "metrics.prom.tmp").exists()
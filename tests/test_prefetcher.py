@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+import main
+from benchmark import MockRagServer
+
+
+@pytest.fixture
+def slow_server():
+    mock = MockRagServer(latency=0.2).start()
+    yield mock
+    mock.stop()
+
+
+def wait_idle(prefetcher: main.Prefetcher, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while prefetcher._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not prefetcher._pending
+
+
+def test_prefetch_fills_the_cache_and_counts_a_hit(server):
+    cache = main.TTLCache()
+    prefetcher = main.Prefetcher(cache)
+    prefetcher.submit(server.url, ["/users/list"], group="session")
+    wait_idle(prefetcher)
+    key = (server.url, "/users/list")
+    assert cache.get(key) == server.users
+    prefetcher.claim(key)
+    assert prefetcher.stats()["hits"] == 1
+    assert prefetcher._groups == {}
+
+
+def test_cancelling_an_in_flight_prefetch(slow_server):
+    cache = main.TTLCache()
+    prefetcher = main.Prefetcher(cache)
+    key = (slow_server.url, "/users/list")
+    prefetcher.submit(slow_server.url, ["/users/list"], group="session")
+    future, _ = prefetcher._pending[key]
+    time.sleep(0.05)  # Let the request start
+    prefetcher.cancel(key)
+    assert future.result(timeout=5) is None  # No KeyError from the worker
+    assert key not in cache
+    assert prefetcher._pending == {}
+    assert prefetcher._groups == {}
+    assert prefetcher.stats()["cancelled"] == 1
+
+
+def test_new_selection_cancels_the_previous_one(slow_server):
+    cache = main.TTLCache()
+    prefetcher = main.Prefetcher(cache)
+    prefetcher.submit(slow_server.url, ["/chatbots/list/1"], group="session")
+    prefetcher.submit(slow_server.url, ["/chatbots/list/2"], group="session")
+    wait_idle(prefetcher)
+    assert (slow_server.url, "/chatbots/list/1") not in cache
+    assert (slow_server.url, "/chatbots/list/2") in cache
+    assert prefetcher.stats()["cancelled"] == 1
+    assert prefetcher._groups == {}
+
+
+def test_prefetch_shared_by_another_session_is_kept(slow_server):
+    cache = main.TTLCache()
+    prefetcher = main.Prefetcher(cache)
+    prefetcher.submit(slow_server.url, ["/chatbots/list/1"], group="a")
+    prefetcher.submit(slow_server.url, ["/chatbots/list/1"], group="b")
+    prefetcher.submit(slow_server.url, ["/chatbots/list/2"], group="a")
+    wait_idle(prefetcher)
+    assert (slow_server.url, "/chatbots/list/1") in cache
+    assert prefetcher.stats()["cancelled"] == 0
+    assert prefetcher._groups == {}
+
+
+def test_join_waits_for_an_in_flight_prefetch(slow_server):
+    prefetcher = main.Prefetcher(main.TTLCache())
+    prefetcher.submit(slow_server.url, ["/users/list"], group="session")
+    assert prefetcher.join((slow_server.url, "/users/list")) == slow_server.users
+    assert prefetcher.stats()["joins"] == 1
+    assert slow_server.total_requests() == 1
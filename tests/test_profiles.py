@@ -0,0 +1,88 @@
+import pytest
+import requests
+
+import main
+
+PARAMETERS = {"temperature": 0.5, "k": 3, "chunk_overlap": 30, "rerank_method": "similarity"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    main.get_profile_registry.clear()
+    yield
+    main.get_profile_registry.clear()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(main.st.session_state, "parameter_profile", None, raising=False)
+    return main.st.session_state
+
+
+def recording_send(server, sent):
+    def send(body):
+        sent.append(body)
+        return main.make_api_request('POST', "/query", server_url=server.url,
+                                     json={"query": "q", "chatbot_id": 1, "knowledge_id": 1, **body})
+    return send
+
+
+def test_profile_is_sent_in_full_once(server, session):
+    profile = main.parameter_profile(PARAMETERS)
+    sent = []
+    for _ in range(3):
+        main.send_with_profile(recording_send(server, sent), {}, profile, server.url)
+    assert sent[0]["parameter_profile"] == profile
+    assert [body.get("profile_id") for body in sent[1:]] == [profile["profile_id"]] * 2
+    assert all("parameter_profile" not in body for body in sent[1:])
+
+
+def test_server_that_forgets_the_profile_gets_it_again(server, session):
+    profile = main.parameter_profile(PARAMETERS)
+    sent = []
+    main.send_with_profile(recording_send(server, sent), {}, profile, server.url)
+    server.profiles.clear()
+    
+    response = main.send_with_profile(recording_send(server, sent), {}, profile, server.url)
+    assert response.status_code == 200
+    assert [("profile_id" in body, "parameter_profile" in body) for body in sent] == [
+        (False, True), (True, False), (False, True)
+    ]
+    assert server.profiles[profile["profile_id"]] == profile["parameters"]
+    assert main.get_profile_registry().known(server.url, profile["profile_id"])
+
+
+def test_conflict_on_a_full_profile_is_not_retried(session):
+    profile = main.parameter_profile(PARAMETERS)
+    calls = []
+    
+    def conflict(body):
+        calls.append(body)
+        response = requests.Response()
+        response.status_code = main.PROFILE_UNKNOWN_STATUS
+        raise requests.HTTPError("409 Conflict", response=response)
+    
+    with pytest.raises(requests.HTTPError):
+        main.send_with_profile(conflict, {}, profile, "http://server")
+    assert len(calls) == 1
+    assert not main.get_profile_registry().known("http://server", profile["profile_id"])
+
+
+def test_profile_version_follows_parameter_changes(session):
+    first = main.parameter_profile(PARAMETERS)
+    assert first["version"] == 1
+    assert main.parameter_profile(dict(PARAMETERS)) is first
+    
+    second = main.parameter_profile({**PARAMETERS, "k": 5})
+    assert second["version"] == 2
+    assert second["profile_id"] != first["profile_id"]
+    
+    third = main.parameter_profile(PARAMETERS)
+    assert third["version"] == 3
+    assert third["profile_id"] == first["profile_id"]
+
+
+def test_hybrid_rerank_shares_the_similarity_profile(session):
+    similarity = main.parameter_profile(PARAMETERS)
+    hybrid = main.parameter_profile({**PARAMETERS, "rerank_method": "hybrid"})
+    assert hybrid["profile_id"] == similarity["profile_id"]
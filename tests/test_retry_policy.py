@@ -0,0 +1,188 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+import main
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def policy(clock):
+    return main.RetryPolicy(base_delay=0.5, max_delay=8.0, clock=clock, sleep=clock.advance, rng=lambda: 1.0)
+
+
+def test_backoff_grows_exponentially_up_to_the_cap(policy):
+    assert [policy.backoff(attempt) for attempt in range(7)] == [0.5, 1.0, 2.0, 4.0, 8.0, 8.0, 8.0]
+
+
+def test_backoff_applies_full_jitter(clock):
+    policy = main.RetryPolicy(base_delay=0.5, max_delay=8.0, clock=clock, rng=lambda: 0.25)
+    assert policy.backoff(3) == 1.0
+
+
+def test_retry_after_seconds(policy):
+    assert policy.backoff(0, retry_after="7") == 7.0
+    assert policy.backoff(0, retry_after="0") == 0.0
+    assert policy.backoff(0, retry_after="3600") == 3600.0
+
+
+def test_retry_after_http_date(policy):
+    delay = policy.backoff(0, retry_after=formatdate(time.time() + 10, usegmt=True))
+    assert 8.0 <= delay <= 10.0
+    assert policy.backoff(0, retry_after=formatdate(time.time() - 60, usegmt=True)) == 0.0
+
+
+def test_unparseable_retry_after_falls_back_to_backoff(policy):
+    assert policy.backoff(2, retry_after="soon") == 2.0
+
+
+def test_post_query_is_not_retried_on_502(policy):
+    assert policy.retry_delay('POST', "/query", 0, 3, status_code=502) is None
+    assert policy.retry_delay('POST', "/query", 0, 3, status_code=503) == 0.5
+    assert policy.retry_delay('POST', "/query", 0, 3, status_code=429, retry_after="2") == 2.0
+
+
+def test_idempotent_requests_are_retried_on_502(policy):
+    assert policy.retry_delay('GET', "/users/list", 0, 3, status_code=502) == 0.5
+    assert policy.retry_delay('POST', "/clear-history", 0, 3, status_code=502) == 0.5
+
+
+def test_post_query_is_retried_only_when_the_connection_failed(policy):
+    assert policy.retry_delay('POST', "/query", 0, 3) is None
+    assert policy.retry_delay('POST', "/query", 0, 3, connection_failed=True) == 0.5
+
+
+def test_no_retry_on_client_errors_or_after_the_last_attempt(policy):
+    assert policy.retry_delay('GET', "/users/list", 0, 3, status_code=404) is None
+    assert policy.retry_delay('GET', "/users/list", 2, 3, status_code=503) is None
+
+
+def test_long_retry_after_is_returned_without_spending_the_budget(policy):
+    tokens = policy.budget("/users/list").tokens
+    assert policy.retry_delay('GET', "/users/list", 0, 3, status_code=503, retry_after="30") == 30.0
+    assert policy.budget("/users/list").tokens == tokens
+
+
+def test_retry_budget_runs_out(policy):
+    retries = 0
+    while policy.retry_delay('GET', "/documents/list/1", 0, 3, status_code=503) is not None:
+        retries += 1
+    assert retries == main.RETRY_BUDGET_MAX_TOKENS
+    # Budgets are per endpoint, with IDs collapsed
+    assert policy.retry_delay('GET', "/documents/list/2", 0, 3, status_code=503) is None
+    assert policy.retry_delay('GET', "/users/list", 0, 3, status_code=503) is not None
+    # Every request deposits a fraction of a token
+    for _ in range(int(1 / main.RETRY_BUDGET_RATIO)):
+        policy.before_request("http://server", "/documents/list/1")
+    assert policy.retry_delay('GET', "/documents/list/1", 0, 3, status_code=503) is not None
+    assert policy.retry_delay('GET', "/documents/list/1", 0, 3, status_code=503) is None
+
+
+def test_circuit_breaker_state_machine(clock):
+    breaker = main.CircuitBreaker(failure_threshold=3, reset_timeout=30.0, clock=clock)
+    assert breaker.state == "closed"
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+    clock.advance(29.9)
+    assert not breaker.allow_request()
+    clock.advance(0.1)
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request()  # Only one trial request
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.advance(30.0)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+
+def test_lost_half_open_trial_is_retried_after_the_reset_timeout(clock):
+    breaker = main.CircuitBreaker(failure_threshold=1, reset_timeout=30.0, clock=clock)
+    breaker.record_failure()
+    clock.advance(30.0)
+    assert breaker.allow_request()  # The trial's outcome is never recorded
+    clock.advance(29.9)
+    assert not breaker.allow_request()
+    clock.advance(0.1)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_open_circuit_fails_fast(policy, clock):
+    for _ in range(main.CIRCUIT_FAILURE_THRESHOLD):
+        policy.record_outcome("http://server", ok=False)
+    with pytest.raises(main.CircuitOpenError):
+        policy.before_request("http://server", "/users/list")
+    clock.advance(main.CIRCUIT_RESET_TIMEOUT)
+    policy.before_request("http://server", "/users/list")
+    assert policy.breaker("http://server").state == "half_open"
+    policy.record_outcome("http://server", ok=True)
+    assert policy.breaker("http://server").state == "closed"
+
+
+def test_make_api_request_sleeps_on_the_injected_clock(server, policy, clock, monkeypatch):
+    monkeypatch.setattr(main, "get_retry_policy", lambda: policy)
+    server.fail_rate = 1.0
+    server.fail_status = 503
+    start = clock()
+    with pytest.raises(main.HTTPError):
+        main.make_api_request('GET', "/users/list", server_url=server.url)
+    assert server.total_requests() == 3
+    assert clock() - start == 0.0  # The mock sends Retry-After: 0
+    server.fail_status = 502
+    server.reset_counts()
+    with pytest.raises(main.HTTPError):
+        main.make_api_request('POST', "/query", server_url=server.url, json={"query": "q"})
+    assert server.total_requests() == 1
+
+
+def test_long_retry_after_is_surfaced_instead_of_slept(server, policy, clock, monkeypatch):
+    monkeypatch.setattr(main, "get_retry_policy", lambda: policy)
+    server.fail_rate = 1.0
+    server.fail_status = 503
+    server.retry_after = "30"
+    start = clock()
+    with pytest.raises(main.RetryLaterError) as error:
+        main.make_api_request('GET', "/users/list", server_url=server.url)
+    assert error.value.retry_after == 30.0
+    assert "retry in 30s" in str(error.value)
+    assert server.total_requests() == 1
+    assert clock() - start == 0.0
+
+
+def test_unexpected_error_resolves_the_half_open_trial(server, policy, clock, monkeypatch):
+    monkeypatch.setattr(main, "get_retry_policy", lambda: policy)
+    for _ in range(main.CIRCUIT_FAILURE_THRESHOLD):
+        policy.record_outcome(server.url, ok=False)
+    clock.advance(main.CIRCUIT_RESET_TIMEOUT)
+    monkeypatch.setattr(main.ApiClient, "request", lambda *args, **kwargs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        main.make_api_request('GET', "/users/list", server_url=server.url)
+    assert policy.breaker(server.url).state == "open"
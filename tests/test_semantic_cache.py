@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+import main
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "semantic_cache")
+
+
+def vector(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+
+
+def result(i: int) -> dict:
+    return {"answer": f"answer {i}", "chunks": [{"chunk_id": f"c{i}", "score": 1.0}]}
+
+
+def test_stores_append_to_the_journal_without_rewriting_the_snapshot(path):
+    cache = main.SemanticCache(path=path, journal_max=100)
+    for i in range(10):
+        cache.store("ns", 1, f"query {i}", vector(i), result(i))
+    assert not os.path.exists(f"{path}.npz")
+    with open(f"{path}.log", encoding="utf-8") as f:
+        assert len(f.readlines()) == 10
+
+
+def test_journal_is_replayed_on_load(path):
+    cache = main.SemanticCache(path=path, journal_max=100)
+    for i in range(3):
+        cache.store("ns", 1, f"query {i}", vector(i), result(i))
+    cache.store("other", 2, "query 3", vector(3), result(3))
+    cache.invalidate_knowledge(2)
+
+    reloaded = main.SemanticCache(path=path, journal_max=100)
+    assert len(reloaded) == 3
+    assert reloaded.lookup("ns", vector(1))[0] == result(1)
+    assert reloaded.lookup("other", vector(3)) is None
+
+
+def test_journal_is_compacted_into_the_snapshot(path):
+    cache = main.SemanticCache(path=path, journal_max=4)
+    for i in range(6):
+        cache.store("ns", 1, f"query {i}", vector(i), result(i))
+    assert os.path.exists(f"{path}.npz")
+    with open(f"{path}.log", encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+    reloaded = main.SemanticCache(path=path, journal_max=4)
+    assert len(reloaded) == 6
+
+
+def test_flush_compacts_pending_records(path):
+    cache = main.SemanticCache(path=path, journal_max=100)
+    cache.store("ns", 1, "query", vector(0), result(0))
+    cache.flush()
+    assert os.path.getsize(f"{path}.log") == 0
+    assert len(main.SemanticCache(path=path)) == 1
+
+
+def test_records_already_in_the_snapshot_are_not_replayed(path):
+    cache = main.SemanticCache(path=path, journal_max=100)
+    cache.store("ns", 1, "query", vector(0), result(0))
+    with open(f"{path}.log", encoding="utf-8") as f:
+        journal = f.read()
+    cache.flush()
+    # A crash between writing the snapshot and truncating the journal
+    with open(f"{path}.log", "w", encoding="utf-8") as f:
+        f.write(journal)
+    assert len(main.SemanticCache(path=path)) == 1
+
+
+def test_truncated_journal_record_is_ignored(path):
+    cache = main.SemanticCache(path=path, journal_max=100)
+    for i in range(2):
+        cache.store("ns", 1, f"query {i}", vector(i), result(i))
+    with open(f"{path}.log", "a", encoding="utf-8") as f:
+        f.write('{"seq": 3, "op": "sto')
+    assert len(main.SemanticCache(path=path)) == 2
+
+
+def test_replay_applies_the_entry_limit(path):
+    cache = main.SemanticCache(path=path, max_entries=3, journal_max=100)
+    for i in range(5):
+        cache.store("ns", 1, f"query {i}", vector(i), result(i))
+    assert len(main.SemanticCache(path=path, max_entries=3)) == 3
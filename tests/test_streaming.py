@@ -0,0 +1,89 @@
+import pytest
+import requests
+
+import main
+
+
+class FakeStream:
+    def __init__(self, lines, content_type="text/event-stream"):
+        self.lines = lines
+        self.status_code = 200
+        self.headers = {"Content-Type": content_type}
+        self.closed = False
+
+    def iter_lines(self, decode_unicode=False):
+        yield from self.lines
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def test_sse_events_are_decoded():
+    lines = [
+        "event: message",
+        'data: {"type": "chunks", "chunks": []}',
+        "",
+        "id: 2",
+        'data: {"type": "token", "content": "Hi"}',
+        "retry: 1000",
+    ]
+    assert list(main.iter_query_events(FakeStream(lines))) == [
+        {"type": "chunks", "chunks": []},
+        {"type": "token", "content": "Hi"},
+    ]
+
+
+def test_ndjson_events_are_decoded():
+    lines = ['{"type": "token", "content": "a"}', "", '{"type": "done", "timestamp": "t"}']
+    events = list(main.iter_query_events(FakeStream(lines, "application/x-ndjson")))
+    assert [event["type"] for event in events] == ["token", "done"]
+
+
+def test_comments_and_keep_alives_are_skipped():
+    lines = [": keep-alive", "", ":", 'data: {"type": "token", "content": "x"}', ": ping"]
+    assert list(main.iter_query_events(FakeStream(lines))) == [{"type": "token", "content": "x"}]
+
+
+def test_done_sentinel_ends_the_stream():
+    lines = ['data: {"type": "token", "content": "x"}', "data: [DONE]", 'data: {"type": "token", "content": "late"}']
+    assert list(main.iter_query_events(FakeStream(lines))) == [{"type": "token", "content": "x"}]
+
+
+def test_error_event_raises_and_closes_the_response(monkeypatch):
+    stream = FakeStream([
+        'data: {"type": "token", "content": "partial"}',
+        'data: {"type": "error", "detail": "model overloaded"}',
+    ])
+    monkeypatch.setattr(main, "make_api_request", lambda *args, **kwargs: stream)
+    with pytest.raises(RuntimeError, match="model overloaded"):
+        main.stream_query({"query": "q"})
+    assert stream.closed
+
+
+def test_completed_stream_closes_the_response(monkeypatch):
+    stream = FakeStream([
+        'data: {"type": "token", "content": "Hello "}',
+        'data: {"type": "token", "content": "world"}',
+        'data: {"type": "done", "timestamp": "2026-01-01T00:00:00"}',
+    ])
+    monkeypatch.setattr(main, "make_api_request", lambda *args, **kwargs: stream)
+    result, streamed = main.stream_query({"query": "q"})
+    assert streamed
+    assert result["answer"] == "Hello world"
+    assert stream.closed
+
+
+def test_mock_server_stream_round_trips(server):
+    response = requests.post(f"{server.url}/query", json={"query": "what is e-invoicing", "stream": True},
+                             stream=True, timeout=5)
+    with response:
+        events = list(main.iter_query_events(response))
+    assert events[0]["type"] == "chunks"
+    assert events[-1]["type"] == "done"
+    assert all(event["type"] == "token" for event in events[1:-1])
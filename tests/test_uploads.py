@@ -0,0 +1,129 @@
+import email.parser
+import email.policy
+import hashlib
+import io
+
+import requests
+
+import main
+
+
+class NamedBytes(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def make_manifest(tmp_path, content):
+    manifest = main.UploadManifest(path=str(tmp_path / "manifest.json"))
+    manifest.record(1, "report.pdf", hashlib.sha256(content).hexdigest(), len(content), 7)
+    return manifest
+
+
+EXISTING = [{"document_id": 7, "filename": "report.pdf"}]
+
+
+def test_same_name_is_flagged_but_not_replaced(tmp_path):
+    manifest = make_manifest(tmp_path, b"old")
+    [item] = main.plan_uploads([NamedBytes("report.pdf", b"new")], 1, EXISTING, manifest)
+    assert item["action"] == "upload"
+    assert item["replaces"] is None
+    assert item["conflicts_with"] == EXISTING[0]
+    assert main.name_conflicts([NamedBytes("report.pdf", b"new")], EXISTING) == ["report.pdf"]
+
+
+def test_confirmed_name_is_replaced(tmp_path):
+    manifest = make_manifest(tmp_path, b"old")
+    [item] = main.plan_uploads([NamedBytes("report.pdf", b"new")], 1, EXISTING, manifest, replace=["report.pdf"])
+    assert item["action"] == "replace"
+    assert item["replaces"] == EXISTING[0]
+
+
+def test_unconfirmed_upload_keeps_existing_document(server, tmp_path):
+    manifest = make_manifest(tmp_path, b"old")
+    sessions = main.TTLCache(maxsize=16, ttl=60)
+    report = main.upload_document(server.url, 1, io.BytesIO(b"new"), "report.pdf", sessions, manifest,
+                                  hashlib.sha256(b"new").hexdigest(), None, EXISTING[0])
+    assert report["status"] == "uploaded"
+    assert not any(key.startswith("DELETE") for key in server.requests)
+
+
+def test_duplicate_content_is_skipped(tmp_path):
+    manifest = make_manifest(tmp_path, b"old")
+    [item] = main.plan_uploads([NamedBytes("copy.pdf", b"old")], 1, EXISTING, manifest)
+    assert item["action"] == "skip"
+    assert item["duplicate_of"] == "report.pdf"
+
+
+def parse_multipart(content_type, body):
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    return [(part.get_param("name", header="content-disposition"), part.get_filename(), part.get_payload(decode=True))
+            for part in message.iter_parts()]
+
+
+def test_multipart_stream_round_trips_through_a_parser():
+    data = bytes(range(256)) * 40 + b"\r\n--not-a-boundary\r\n"
+    body = main.MultipartFileStream(io.BytesIO(data), 'quarterly "final".pdf', len(data), block_size=7)
+    
+    chunks = []
+    for size in (1, 5, 64, 1000):
+        chunks.append(body.read(size))
+    chunks.append(body.read())
+    raw = b"".join(chunks)
+    assert len(raw) == len(body)
+    assert parse_multipart(body.content_type, raw) == [("file", "quarterly %22final%22.pdf", data)]
+    
+    body.seek(0)
+    assert b"".join(body) == raw
+
+
+def test_streamed_upload_reaches_the_server_intact(server):
+    data = b"x" * (3 * main.UPLOAD_BLOCK_SIZE + 11)
+    response = main.upload_streamed(server.url, 1, io.BytesIO(data), "big.bin", len(data))
+    document = response.json()
+    assert document["filename"] == "big.bin"
+    assert server.documents[1] == [document]
+
+
+def test_stale_upload_session_starts_a_new_one(server, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 1000)
+    data = b"y" * 2500
+    sessions = main.TTLCache(maxsize=16, ttl=60)
+    sessions.set((server.url, 1, "large.bin", len(data)), "deadbeef")
+    
+    response = main.upload_resumable(server.url, 1, io.BytesIO(data), "large.bin", len(data), sessions)
+    assert response.json()["size"] == len(data)
+    assert server.requests["GET /documents/upload-session/{id}"] == 1
+    assert server.requests["POST /documents/upload-session/{id}"] == 1
+    assert server.requests["PUT /documents/upload-session/{id}"] == 3
+    assert sessions.get((server.url, 1, "large.bin", len(data))) is None
+
+
+def test_interrupted_upload_resumes_at_the_acknowledged_byte(server, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 1000)
+    data = b"z" * 2500
+    upload_id = main.make_api_request('POST', "/documents/upload-session/1", server_url=server.url,
+                                      json={"filename": "large.bin", "size": len(data)}).json()["upload_id"]
+    main.make_api_request('PUT', f"/documents/upload-session/{upload_id}", server_url=server.url, data=data[:1000])
+    sessions = main.TTLCache(maxsize=16, ttl=60)
+    sessions.set((server.url, 1, "large.bin", len(data)), upload_id)
+    
+    response = main.upload_resumable(server.url, 1, io.BytesIO(data), "large.bin", len(data), sessions)
+    assert response.json()["size"] == len(data)
+    # One PUT before the interruption, then only the two remaining pieces
+    assert server.requests["PUT /documents/upload-session/{id}"] == 1 + 2
+
+
+def test_stale_session_on_a_server_without_sessions_gives_up(monkeypatch):
+    def not_found(method, endpoint, **kwargs):
+        response = requests.Response()
+        response.status_code = 404
+        raise requests.HTTPError("404 Not Found", response=response)
+    
+    monkeypatch.setattr(main, "make_api_request", not_found)
+    sessions = main.TTLCache(maxsize=16, ttl=60)
+    sessions.set(("http://server", 1, "large.bin", 10), "deadbeef")
+    assert main.upload_resumable("http://server", 1, io.BytesIO(b"0123456789"), "large.bin", 10, sessions) is None
+    assert sessions.get(("http://server", 1, "large.bin", 10)) is None